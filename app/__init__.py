@@ -1,22 +1,36 @@
 """Инициализация приложения и его компонентов"""
+import json
 import sys
-from typing import Optional, Callable, Awaitable, Dict, Any
+from typing import Optional, Callable, Awaitable, Dict, Any, List, Tuple
 from pathlib import Path
 import os
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.bot import DefaultBotProperties
 from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import text
 import logging
 
 from app.handlers import register_handlers
 from app.data.data_loader import load_survey_data
 from app.config import Config
+from app.database.models import engine, read_engine, Base, WRITE_OPTIONS, get_session_maker
+from app.database.migrations import run_migrations
+from app.database.retention import ensure_partitions, partition_answers
 from app.services.image_service import ImageService
+from app.services.image_optimizer import optimize_images
 from app.services.survey_service import SurveyService
+from app.services.survey_provider import SurveyProvider
 from app.services.db_service import DBService
+from app.services.quota_service import QuotaService, load_quota_limits
+from app.services.journey_service import JourneyService
+from app.services.answer_buffer import AnswerBuffer
+from app.services.identity_cache import IdentityCache
+from app.services.answer_catalog import AnswerCatalog
+from app.services.search_service import SearchService
 from app.ui.keyboards import KeyboardFactory
 from app.ui.message_builder import MessageBuilder
+from app.tenants import Tenant
 
 
 logger = logging.getLogger(__name__)
@@ -31,12 +45,12 @@ def setup_logging():
     )
 
 
-async def setup_bot(token: str):
-    """
-    Инициализация Bot + Dispatcher, создание общих сервисов
-    и middleware для инъекции зависимостей в хэндлеры.
-    Возвращает (bot, dp).
-    """
+# Общие для всех ботов процесса объекты: скомпилированные опросы и кеш изображений
+_survey_services: Dict[Tuple[str, Optional[str]], SurveyService] = {}
+_image_service: Optional[ImageService] = None
+
+
+async def _create_bot(token: str) -> Bot:
     bot = Bot(token=token, default=DefaultBotProperties(parse_mode="HTML"))
     # Убедимся, что нет включённого webhook / других getUpdates
     try:
@@ -44,42 +58,158 @@ async def setup_bot(token: str):
         logger.info("Webhook cleared (drop_pending_updates=True)")
     except Exception as e:
         logger.warning("Не удалось удалить webhook: %s", e)
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+    return bot
 
-    # Создаём общие объекты — один экземпляр на процесс
-    # Получаем путь к файлу опроса: сначала из Config, иначе смотрим в app/data/ovz.json
+
+def _get_image_service() -> ImageService:
+    global _image_service
+    if _image_service is None:
+        # Используем Config.IMAGES_DIR если задан, иначе папку app/images по умолчанию
+        images_dir = getattr(Config, "IMAGES_DIR", None)
+        if not images_dir:
+            images_dir = Path(__file__).parent.joinpath("images")
+        optimized_dir = getattr(Config, "IMAGES_CACHE_DIR", None) or None
+        if optimized_dir and getattr(Config, "IMAGE_OPTIMIZE", False):
+            # Первый запуск готовит JPEG-копии; дальше обрабатываются только изменённые файлы
+            try:
+                optimize_images(
+                    str(images_dir),
+                    optimized_dir,
+                    max_side=Config.IMAGE_MAX_SIDE,
+                    quality=Config.IMAGE_JPEG_QUALITY,
+                )
+            except Exception as e:
+                logger.exception("Оптимизация изображений не выполнена: %s", e)
+        aliases = None
+        aliases_file = getattr(Config, "IMAGE_ALIASES_FILE", "")
+        if aliases_file:
+            try:
+                with open(aliases_file, "r", encoding="utf-8") as f:
+                    aliases = json.load(f)
+            except Exception as e:
+                logger.exception("Не удалось загрузить псевдонимы изображений: %s", e)
+        _image_service = ImageService(
+            str(images_dir),
+            getattr(Config, "MEDIA_CACHE_FILE", None) or None,
+            optimized_dir=optimized_dir,
+            aliases=aliases,
+        )
+    return _image_service
+
+
+async def _prewarm_media(bot: Bot, survey_service: SurveyService) -> None:
+    """Загружает изображения опроса в служебный чат до начала приёма апдейтов (если настроено)"""
+    chat_id = getattr(Config, "MEDIA_WARMUP_CHAT_ID", "")
+    if not chat_id:
+        return
     try:
+        await _get_image_service().prewarm(
+            bot,
+            int(chat_id),
+            survey_service.get_image_names() + _get_image_service().composite_names(),
+            concurrency=Config.MEDIA_WARMUP_CONCURRENCY,
+            timeout=Config.MEDIA_WARMUP_TIMEOUT,
+        )
+    except Exception as e:
+        logger.exception("Прогрев изображений не выполнен: %s", e)
+
+
+async def _get_survey_service(
+    dp: Dispatcher,
+    survey_file: Optional[str] = None,
+    survey_source: str = "json",
+    schema: Optional[str] = None,
+) -> SurveyService:
+    """
+    Возвращает SurveyService для источника опроса; боты с одинаковым источником
+    делят один экземпляр (и один разобранный опрос).
+    """
+    # Получаем путь к файлу опроса: сначала из Config, иначе смотрим в app/data/ovz.json
+    if not survey_file:
         survey_file = getattr(Config, "SURVEY_FILE", None)
-        if not survey_file:
-            survey_file = os.path.join(os.path.dirname(__file__), "data", "ovz.json")
+    if not survey_file:
+        survey_file = os.path.join(os.path.dirname(__file__), "data", "ovz.json")
+    key = ("db", schema) if survey_source == "db" else ("json", os.path.abspath(survey_file))
+    survey_service = _survey_services.get(key)
+    if survey_service is not None:
+        return survey_service
+
+    try:
         survey_data = load_survey_data(survey_file)
     except Exception as exc:
         logger.exception("Не удалось загрузить данные опроса: %s", exc)
         raise
     survey_service = SurveyService(survey_data)
-    keyboard_factory = KeyboardFactory()
-    # Инициализируем сервис работы с изображениями и билдера сообщений
-    # Используем Config.IMAGES_DIR если задан, иначе папку app/images по умолчанию
-    from pathlib import Path
-    images_dir = getattr(Config, "IMAGES_DIR", None)
-    if not images_dir:
-        images_dir = Path(__file__).parent.joinpath("images")
-    image_service = ImageService(str(images_dir))
-    message_builder = MessageBuilder(image_service)
-    # DB: ensure tables and provide db_service
+
+    # Опрос из БД: заменяем JSON-снимок и следим за строкой Версия_опроса
+    if survey_source == "db":
+        survey_provider = SurveyProvider(get_session_maker(schema), poll_interval=Config.SURVEY_POLL_INTERVAL)
+        try:
+            survey_service.set_survey_data(await survey_provider.load())
+            survey_provider.subscribe(survey_service.set_survey_data)
+            survey_provider.subscribe(
+                lambda data: _get_image_service().index_references(survey_service.get_image_names())
+            )
+            survey_provider.start_polling()
+            dp.shutdown.register(survey_provider.stop_polling)
+        except Exception as e:
+            logger.exception("Не удалось загрузить опрос из БД, используется JSON: %s", e)
+
+    # Разрешаем ссылки опроса на изображения сразу, чтобы ошибки были видны при старте
+    _get_image_service().index_references(survey_service.get_image_names())
+    if getattr(Config, "LEVEL_IMAGES_COMPOSITE", False):
+        for images in survey_service.get_level_image_groups():
+            _get_image_service().build_composite(images)
+    _survey_services[key] = survey_service
+    return survey_service
+
+
+async def _init_database(schema: Optional[str] = None) -> DBService:
+    """Создаёт недостающие таблицы в схеме и возвращает DBService для неё"""
+    session_maker = get_session_maker(schema)
+    db_service = DBService(
+        session_maker,
+        schema,
+        group_commit=getattr(Config, "SQLITE_GROUP_COMMIT", False),
+        commit_batch=Config.SQLITE_COMMIT_BATCH,
+        commit_window=Config.SQLITE_COMMIT_WINDOW_MS / 1000,
+        identity_cache=IdentityCache(Config.IDENTITY_CACHE_SIZE, Config.IDENTITY_CACHE_TTL),
+        answer_history=getattr(Config, "ANSWER_HISTORY", False),
+        compact_answers=getattr(Config, "ANSWER_STORAGE", "text") == "compact",
+    )
     try:
-        from app.database.models import engine, Base
-        db_service = DBService()
-        async with engine.begin() as conn:
+        # SQLite: CREATE TABLE in a BEGIN IMMEDIATE transaction, like every write
+        bind = engine.execution_options(**WRITE_OPTIONS)
+        if schema:
+            bind = bind.execution_options(schema_translate_map={None: schema})
+            if engine.dialect.name == "postgresql":
+                async with engine.begin() as conn:
+                    await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
+        async with bind.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
-        logger.info("Database tables ensured")
+        logger.info("Database tables ensured (schema=%s)", schema)
+        if getattr(Config, "DB_MIGRATE", True):
+            await run_migrations(engine, schema)
+        if getattr(Config, "ANSWER_PARTITIONS", False) and engine.dialect.name == "postgresql":
+            async with engine.begin() as conn:
+                await conn.run_sync(partition_answers, schema, Config.ANSWER_PARTITIONS_AHEAD)
+                created = await conn.run_sync(ensure_partitions, schema, Config.ANSWER_PARTITIONS_AHEAD)
+            if created:
+                logger.info("Answer partitions created (schema=%s): %s", schema, created)
+        await db_service.detect_schema()
     except Exception as e:
         logger.exception("Failed to init database: %s", e)
-        db_service = DBService()
+    return db_service
 
-    # middleware для инъекции зависимостей в kwargs хэндлеров (message / callback_query)
+
+def _make_inject_deps(resolve_deps: Callable[[Dict[str, Any]], Dict[str, Any]]):
+    """
+    Создаёт middleware для инъекции зависимостей в kwargs хэндлеров (message / callback_query).
+    resolve_deps по данным события возвращает словарь сервисов бота, получившего событие.
+    """
     async def inject_deps(handler, event, data: dict):
+        deps = resolve_deps(data)
+        db_service = deps.get("db_service")
         # Diagnostic logging: record whether db_service is available when middleware runs
         try:
             evt_name = type(event).__name__ if event is not None else 'None'
@@ -96,10 +226,7 @@ async def setup_bot(token: str):
 
         # force-assign dependencies into handler data. Use explicit assignment to avoid
         # existing user/state keys silently shadowing injected services (was using setdefault).
-        data["survey_service"] = survey_service
-        data["keyboard_factory"] = keyboard_factory
-        data["message_builder"] = message_builder
-        data["db_service"] = db_service
+        data.update(deps)
         try:
             # log id/type and final keys after assignment at DEBUG level (non-sensitive)
             logger.debug(
@@ -112,6 +239,113 @@ async def setup_bot(token: str):
             logger.debug("inject_deps.debug: could not log assigned services info")
         return await handler(event, data)
 
+    return inject_deps
+
+
+async def _create_deps(dp: Dispatcher, tenant: Optional[Tenant] = None) -> Dict[str, Any]:
+    """Собирает сервисы одного бота; тяжёлые объекты берутся из общих кешей процесса"""
+    schema = tenant.schema if tenant else None
+    db_service = await _init_database(schema)
+    # answer_id для строк Анкета_ответ без запроса при каждом сохранении
+    answer_catalog = AnswerCatalog(db_service.session_maker, poll_interval=Config.SURVEY_POLL_INTERVAL)
+    try:
+        await answer_catalog.load()
+    except Exception as e:
+        logger.exception("Не удалось загрузить каталог ответов, answer_id ищется по тексту: %s", e)
+    db_service.answer_catalog = answer_catalog
+    if db_service.compact_answers and not (db_service.capabilities and db_service.capabilities.answer_view):
+        logger.warning("ANSWER_STORAGE=compact: нет представления Анкета_ответ_полный (DB_MIGRATE=0?) — "
+                       "ответы хранятся текстом")
+    answer_catalog.start_polling()
+    dp.shutdown.register(answer_catalog.stop_polling)
+    survey_service = await _get_survey_service(
+        dp,
+        survey_file=tenant.survey_file if tenant else None,
+        survey_source=tenant.survey_source if tenant else getattr(Config, "SURVEY_SOURCE", "json"),
+        schema=schema,
+    )
+    quota_service = None
+    if getattr(Config, "QUOTAS_FILE", ""):
+        quota_service = QuotaService(
+            load_quota_limits(Config.QUOTAS_FILE),
+            db_service.session_maker,
+            flush_interval=Config.QUOTA_FLUSH_INTERVAL,
+            survey_service=survey_service,
+        )
+        try:
+            await quota_service.load()
+        except Exception as e:
+            logger.exception("Не удалось восстановить счётчики квот: %s", e)
+        db_service.add_commit_listener(quota_service.on_save_committed)
+        quota_service.start()
+        dp.shutdown.register(quota_service.stop)
+    journey_service = None
+    if getattr(Config, "JOURNEY_ENABLED", False):
+        journey_service = JourneyService(
+            db_service.session_maker,
+            capacity=Config.JOURNEY_BUFFER_SIZE,
+            flush_interval=Config.JOURNEY_FLUSH_INTERVAL,
+            run_ttl=Config.JOURNEY_RUN_TTL,
+        )
+        try:
+            await journey_service.load()
+        except Exception as e:
+            logger.exception("Не удалось восстановить воронку из журнала: %s", e)
+        journey_service.start_flushing()
+        dp.shutdown.register(journey_service.stop)
+    answer_buffer = None
+    if getattr(Config, "SAVE_MODE", "final") == "incremental":
+        if db_service.incremental_supported:
+            answer_buffer = AnswerBuffer(
+                db_service,
+                max_pending=Config.ANSWER_BUFFER_SIZE,
+                flush_interval=Config.ANSWER_FLUSH_INTERVAL,
+                run_ttl=Config.ANSWER_RUN_TTL,
+            )
+            answer_buffer.start_flushing()
+            dp.shutdown.register(answer_buffer.stop)
+        else:
+            logger.warning("SAVE_MODE=incremental: в схеме нет Анкета.status / Анкета_ответ.answer_key — "
+                           "ответы сохраняются в конце опроса")
+    # после остановки буфера ответов: его последний сброс идёт через DBService
+    dp.shutdown.register(db_service.close)
+    search_service = SearchService(db_service.session_maker)
+    try:
+        await search_service.load()
+    except Exception as e:
+        logger.exception("Не удалось загрузить поисковый индекс: %s", e)
+    db_service.add_commit_listener(search_service.on_save_committed)
+    return {
+        "survey_service": survey_service,
+        "keyboard_factory": KeyboardFactory(),
+        "message_builder": MessageBuilder(
+            _get_image_service(),
+            composite_levels=getattr(Config, "LEVEL_IMAGES_COMPOSITE", False),
+        ),
+        "db_service": db_service,
+        "quota_service": quota_service,
+        "journey_service": journey_service,
+        "answer_buffer": answer_buffer,
+        "search_service": search_service,
+        "tenant": tenant,
+    }
+
+
+async def setup_bot(token: str):
+    """
+    Инициализация Bot + Dispatcher, создание общих сервисов
+    и middleware для инъекции зависимостей в хэндлеры.
+    Возвращает (bot, dp).
+    """
+    bot = await _create_bot(token)
+    storage = MemoryStorage()
+    dp = Dispatcher(storage=storage)
+
+    # Создаём общие объекты — один экземпляр на процесс
+    deps = await _create_deps(dp)
+    await _prewarm_media(bot, deps["survey_service"])
+    inject_deps = _make_inject_deps(lambda data: deps)
+
     # регистрируем middleware для сообщений и callback_query
     dp.message.middleware(inject_deps)
     dp.callback_query.middleware(inject_deps)
@@ -120,4 +354,40 @@ async def setup_bot(token: str):
     register_handlers(dp)
 
     logger.info("Bot setup complete")
-    return bot, dp
\ No newline at end of file
+    return bot, dp
+
+
+async def setup_multi_bot(tenants: List[Tenant]):
+    """
+    Несколько ботов в одном процессе: один Dispatcher (роутеры — синглтоны модулей),
+    один пул соединений и общие кеши изображений/опросов. Сервисы арендатора
+    выбираются middleware по id бота, получившего событие; FSM-ключи MemoryStorage
+    содержат bot_id, так что состояния ботов не пересекаются.
+    Возвращает (bots, dp) — запуск через dp.start_polling(*bots).
+    """
+    storage = MemoryStorage()
+    dp = Dispatcher(storage=storage)
+
+    # Для SQLite схемы подключаются при открытии соединения — регистрируем их заранее
+    for tenant in tenants:
+        get_session_maker(tenant.schema)
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+
+    bots = []
+    deps_by_bot: Dict[int, Dict[str, Any]] = {}
+    for tenant in tenants:
+        bot = await _create_bot(tenant.token)
+        deps_by_bot[bot.id] = await _create_deps(dp, tenant)
+        await _prewarm_media(bot, deps_by_bot[bot.id]["survey_service"])
+        bots.append(bot)
+        logger.info("Tenant %s registered (bot_id=%s schema=%s)", tenant.name, bot.id, tenant.schema)
+
+    inject_deps = _make_inject_deps(lambda data: deps_by_bot[data["bot"].id])
+    dp.message.middleware(inject_deps)
+    dp.callback_query.middleware(inject_deps)
+    register_handlers(dp)
+
+    logger.info("Multi-bot setup complete: %s bots, %s surveys", len(bots), len(_survey_services))
+    return bots, dp
@@ -16,4 +16,109 @@ class Config:
     
     # Параметры опроса
     DEFAULT_MODULE = "modul_1"
-    DEFAULT_QUESTION_ID = 1
\ No newline at end of file
+    DEFAULT_QUESTION_ID = 1
+
+    # Источник опроса: "json" (файл DATA_FILE) или "db" (таблицы Вопрос/Ответ/...)
+    SURVEY_SOURCE = os.getenv("SURVEY_SOURCE", "json")
+    # Как часто (сек.) проверять строку Версия_опроса при SURVEY_SOURCE=db
+    SURVEY_POLL_INTERVAL = float(os.getenv("SURVEY_POLL_INTERVAL", "60"))
+
+    # JSON-файл с описанием нескольких ботов (см. app/tenants.py); пусто — один бот из BOT_TOKEN
+    TENANTS_FILE = os.getenv("TENANTS_FILE", "")
+
+    # Квоты выборки: JSON {"modul_1:1": {"18-34": 100}, ...}; пусто — квоты выключены
+    QUOTAS_FILE = os.getenv("QUOTAS_FILE", "")
+    QUOTA_FLUSH_INTERVAL = float(os.getenv("QUOTA_FLUSH_INTERVAL", "30"))
+
+    # Журнал прохождения опроса (воронка /funnel)
+    JOURNEY_ENABLED = os.getenv("JOURNEY_ENABLED", "1") == "1"
+    JOURNEY_BUFFER_SIZE = int(os.getenv("JOURNEY_BUFFER_SIZE", "10000"))
+    JOURNEY_FLUSH_INTERVAL = float(os.getenv("JOURNEY_FLUSH_INTERVAL", "5"))
+    # Через сколько секунд без ответа проход считается брошенным (память воронки на пользователя)
+    JOURNEY_RUN_TTL = float(os.getenv("JOURNEY_RUN_TTL", "86400"))
+
+    # Кеш Telegram file_id загруженных изображений (пусто — не сохранять между перезапусками)
+    MEDIA_CACHE_FILE = os.getenv("MEDIA_CACHE_FILE", os.path.join(BASE_DIR, 'data', 'file_ids.json'))
+
+    # Прогрев изображений при старте: служебный чат для загрузки (пусто — прогрев выключен)
+    MEDIA_WARMUP_CHAT_ID = os.getenv("MEDIA_WARMUP_CHAT_ID", "")
+    MEDIA_WARMUP_CONCURRENCY = int(os.getenv("MEDIA_WARMUP_CONCURRENCY", "4"))
+    MEDIA_WARMUP_TIMEOUT = float(os.getenv("MEDIA_WARMUP_TIMEOUT", "60"))
+
+    # Оптимизированные копии изображений (JPEG); IMAGE_OPTIMIZE=1 — подготовить при старте (нужен Pillow)
+    IMAGES_CACHE_DIR = os.getenv("IMAGES_CACHE_DIR", os.path.join(BASE_DIR, 'data', 'image_cache'))
+    IMAGE_OPTIMIZE = os.getenv("IMAGE_OPTIMIZE", "1") == "1"
+    IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1280"))
+    IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+    # Псевдонимы изображений: JSON {"имя в опросе": "файл в IMAGES_DIR"}; пусто — без псевдонимов
+    IMAGE_ALIASES_FILE = os.getenv("IMAGE_ALIASES_FILE", "")
+
+    # Изображения уровней одной картинкой-сеткой вместо альбома (собирается при старте, нужен Pillow)
+    LEVEL_IMAGES_COMPOSITE = os.getenv("LEVEL_IMAGES_COMPOSITE", "0") == "1"
+
+    # Сохранение ответов: "final" — всё разом в конце опроса, "incremental" — по мере ответов
+    # (анкета со статусом in_progress с первого ответа; нужны столбцы Анкета.status и Анкета_ответ.answer_key)
+    SAVE_MODE = os.getenv("SAVE_MODE", "final")
+    ANSWER_BUFFER_SIZE = int(os.getenv("ANSWER_BUFFER_SIZE", "5"))
+    ANSWER_FLUSH_INTERVAL = float(os.getenv("ANSWER_FLUSH_INTERVAL", "10"))
+    # Через сколько секунд без ответа проход считается брошенным и его буфер освобождается
+    ANSWER_RUN_TTL = float(os.getenv("ANSWER_RUN_TTL", "86400"))
+    # Повторное прохождение переписывает только изменившиеся ответы; ANSWER_HISTORY=1 — прежние
+    # значения изменённых и удалённых ответов сохраняются в Анкета_ответ_история
+    ANSWER_HISTORY = os.getenv("ANSWER_HISTORY", "0") == "1"
+    # Хранение ответов: "text" — текст варианта в каждой строке; "compact" — для вариантов из каталога
+    # только answer_id (answer_text остаётся свободным ответам, полный вид — Анкета_ответ_полный).
+    # Существующие строки: python scripts/compact_answers.py
+    ANSWER_STORAGE = os.getenv("ANSWER_STORAGE", "text")
+
+    # Postgres: Анкета_ответ секционирована по месяцам created_at. ANSWER_PARTITIONS=1 — при старте
+    # таблица перестраивается в секционированную (копия всех строк под блокировкой — для большой
+    # таблицы лучше заранее: python scripts/answer_retention.py partition) и создаются секции
+    # текущего месяца и ANSWER_PARTITIONS_AHEAD следующих. Архив старых месяцев — там же (archive)
+    ANSWER_PARTITIONS = os.getenv("ANSWER_PARTITIONS", "0") == "1"
+    ANSWER_PARTITIONS_AHEAD = int(os.getenv("ANSWER_PARTITIONS_AHEAD", "3"))
+
+    # База данных: DATABASE_URL (postgresql+asyncpg://... или sqlite+aiosqlite:///...);
+    # пусто — SQLite в SQLITE_PATH. Относительные пути SQLite считаются от корня проекта
+    DATABASE_URL = os.getenv("DATABASE_URL", "")
+    SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(BASE_DIR.parent, 'db.sqlite3'))
+
+    # Миграции схемы при старте (индексы, уникальный Персона.user_id, новые столбцы)
+    DB_MIGRATE = os.getenv("DB_MIGRATE", "1") == "1"
+
+    # Пул соединений (см. /dbstats — ожидание соединения из пула)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+    # Кеш подготовленных запросов asyncpg на соединение; 0 — выключить (pgbouncer в режиме transaction)
+    DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+    # Отдельный пул только для чтения (экспорт, админ-команды): DATABASE_READ_URL — например,
+    # реплика Postgres; пусто — та же база (SQLite открывается как read-only URI).
+    # Таймаут запроса в мс и предел строк на таблицу экспорта; 0 — без ограничения
+    DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", "")
+    READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", "2"))
+    READ_MAX_OVERFLOW = int(os.getenv("READ_MAX_OVERFLOW", "2"))
+    READ_STATEMENT_TIMEOUT_MS = int(os.getenv("READ_STATEMENT_TIMEOUT_MS", "30000"))
+    READ_ROW_LIMIT = int(os.getenv("READ_ROW_LIMIT", "100000"))
+
+    # PRAGMA для каждого соединения SQLite
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000"))
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+    # SQLite: сохранения опроса пишет одна задача-писатель, объединяя их в общие транзакции
+    # (до SQLITE_COMMIT_BATCH сохранений, ожидание попутчиков SQLITE_COMMIT_WINDOW_MS).
+    # Выигрыш есть только при одновременных сохранениях, поэтому по умолчанию выключено
+    SQLITE_GROUP_COMMIT = os.getenv("SQLITE_GROUP_COMMIT", "0") == "1"
+    SQLITE_COMMIT_BATCH = int(os.getenv("SQLITE_COMMIT_BATCH", "64"))
+    SQLITE_COMMIT_WINDOW_MS = float(os.getenv("SQLITE_COMMIT_WINDOW_MS", "5"))
+
+    # Кеш tg_id -> Персона.id / Анкета.id в памяти процесса (0 — выключен), TTL в секундах
+    IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "10000"))
+    IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "300"))
@@ -0,0 +1,282 @@
+"""Создание engine: настройки пула, тюнинг диалектов и метрики ожидания соединений
+
+Все параметры берутся из Config (переменные окружения). Postgres получает QueuePool
+заданного размера с pre-ping/recycle и размером кеша подготовленных выражений asyncpg;
+SQLite — абсолютный путь к базе и pragma на каждое соединение (WAL, synchronous,
+busy_timeout, размер кеша и mmap).
+
+Чтения администратора и отчёты идут через отдельный engine (create_read_engine_from_config):
+небольшой собственный пул, при желании на реплике (DATABASE_READ_URL), транзакции только
+для чтения с таймаутом выражения в Postgres и URI-соединение только для чтения в SQLite —
+выгрузка никогда не отнимает соединения у сохранений респондентов.
+"""
+import functools
+import json
+import logging
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class PoolMetrics:
+    """Сколько запросы соединения ждут свободного соединения пула (сигнал для выбора размера пула)"""
+
+    def __init__(self, samples: int = 1000):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self._recent: Deque[float] = deque(maxlen=samples)
+
+    def observe(self, wait: float) -> None:
+        self.checkouts += 1
+        self.total_wait += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+        self._recent.append(wait)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Время ожидания (в секундах) на квантиле q по последним выдачам соединений
+
+        Args:
+            q: Квантиль от 0 до 1
+
+        Returns:
+            Optional[float]: Время ожидания или None, если выдач ещё не было
+        """
+        if not self._recent:
+            return None
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": (self.total_wait / self.checkouts * 1000) if self.checkouts else 0.0,
+            "p95_wait_ms": (self.percentile(0.95) or 0.0) * 1000,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+pool_metrics = PoolMetrics()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool, записывающий время ожидания свободного соединения"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        pool_metrics.observe(time.perf_counter() - started)
+        return conn
+
+
+def _is_sqlite_file(parsed) -> bool:
+    return parsed.get_backend_name() == 'sqlite' and parsed.database not in (None, '', ':memory:') \
+        and not parsed.database.startswith('file:')
+
+
+def database_url() -> str:
+    """DATABASE_URL из окружения или SQLite по абсолютному пути (SQLITE_PATH)"""
+    url = Config.DATABASE_URL
+    if not url:
+        return f"sqlite+aiosqlite:///{Path(Config.SQLITE_PATH).resolve()}"
+    parsed = make_url(url)
+    if _is_sqlite_file(parsed) and not Path(parsed.database).is_absolute():
+        # a relative path would follow the working directory of whoever started the bot
+        parsed = parsed.set(database=str((Config.BASE_DIR.parent / parsed.database).resolve()))
+        return parsed.render_as_string(hide_password=False)
+    return url
+
+
+def read_database_url() -> Optional[str]:
+    """
+    URL engine для отчётов: DATABASE_READ_URL (например, реплика Postgres) или основная база;
+    файл SQLite открывается через URI только для чтения
+
+    Returns:
+        Optional[str]: URL или None для SQLite в памяти (отчёты тогда идут через основной engine)
+    """
+    url = Config.DATABASE_READ_URL or database_url()
+    parsed = make_url(url)
+    if parsed.get_backend_name() != 'sqlite':
+        return url
+    if not _is_sqlite_file(parsed):
+        # ':memory:' cannot be shared; a 'file:' URI is used as given
+        return None if parsed.database in (None, '', ':memory:') else url
+    path = Path(parsed.database)
+    if not path.is_absolute():
+        path = Config.BASE_DIR.parent / path
+    parsed = parsed.set(database=path.resolve().as_uri(), query={**parsed.query, "mode": "ro", "uri": "true"})
+    return parsed.render_as_string(hide_password=False)
+
+
+# JSON columns (Анкета.answers): Cyrillic answers stored as is, not as \uXXXX escapes
+_json_serializer = functools.partial(json.dumps, ensure_ascii=False)
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """
+    Именованные аргументы create_async_engine для диалекта `url`
+
+    Args:
+        url: URL базы данных
+
+    Returns:
+        Dict[str, Any]: Параметры пула и диалекта
+    """
+    parsed = make_url(url)
+    options: Dict[str, Any] = {"future": True, "json_serializer": _json_serializer}
+    if parsed.get_backend_name() == 'sqlite' and parsed.database in (None, '', ':memory:'):
+        # in-memory databases keep the dialect's single-connection pool
+        return options
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
+        pool_timeout=Config.DB_POOL_TIMEOUT,
+    )
+    if parsed.get_backend_name() == 'sqlite':
+        # local file: no server to drop idle connections, recycle/pre-ping only cost round-trips
+        return options
+    options.update(pool_recycle=Config.DB_POOL_RECYCLE, pool_pre_ping=Config.DB_POOL_PRE_PING)
+    if parsed.get_driver_name() == 'asyncpg':
+        # 0 disables the cache (needed behind pgbouncer in transaction mode)
+        options["connect_args"] = {"prepared_statement_cache_size": Config.DB_STATEMENT_CACHE_SIZE}
+    return options
+
+
+def read_engine_options(url: str) -> Dict[str, Any]:
+    """
+    Именованные аргументы create_async_engine для engine отчётов
+
+    Args:
+        url: URL базы для чтения (см. read_database_url)
+
+    Returns:
+        Dict[str, Any]: Параметры отдельного пула и соединений только для чтения
+    """
+    parsed = make_url(url)
+    options: Dict[str, Any] = {
+        "future": True,
+        # a pool of its own, without the wait metrics of the save path pool
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": Config.READ_POOL_SIZE,
+        "max_overflow": Config.READ_MAX_OVERFLOW,
+        "pool_timeout": Config.DB_POOL_TIMEOUT,
+    }
+    if parsed.get_backend_name() == 'sqlite':
+        return options
+    options.update(pool_recycle=Config.DB_POOL_RECYCLE, pool_pre_ping=Config.DB_POOL_PRE_PING)
+    if parsed.get_driver_name() == 'asyncpg':
+        server_settings = {"default_transaction_read_only": "on"}
+        if Config.READ_STATEMENT_TIMEOUT_MS:
+            server_settings["statement_timeout"] = str(Config.READ_STATEMENT_TIMEOUT_MS)
+        options["connect_args"] = {
+            "prepared_statement_cache_size": Config.DB_STATEMENT_CACHE_SIZE,
+            "server_settings": server_settings,
+        }
+    return options
+
+
+def sqlite_pragmas() -> Dict[str, Any]:
+    """Pragma соединений основного engine SQLite из Config"""
+    return {
+        "journal_mode": Config.SQLITE_JOURNAL_MODE,
+        "synchronous": Config.SQLITE_SYNCHRONOUS,
+        "busy_timeout": Config.SQLITE_BUSY_TIMEOUT_MS,
+        # negative cache_size is in KiB
+        "cache_size": -Config.SQLITE_CACHE_SIZE_KB,
+        "mmap_size": Config.SQLITE_MMAP_SIZE,
+    }
+
+
+def sqlite_read_pragmas() -> Dict[str, Any]:
+    """Pragma соединений отчётов только для чтения (режим журнала задаёт пишущий engine)"""
+    return {
+        "query_only": 1,
+        "busy_timeout": Config.SQLITE_BUSY_TIMEOUT_MS,
+        "cache_size": -Config.SQLITE_CACHE_SIZE_KB,
+        "mmap_size": Config.SQLITE_MMAP_SIZE,
+    }
+
+
+def install_sqlite_pragmas(engine: AsyncEngine, pragmas: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Применяет pragma к каждому новому соединению engine
+
+    Обработчик регистрируется после ATTACH схем арендаторов, поэтому journal_mode
+    переключает и подключённые базы арендаторов.
+
+    Args:
+        engine: Engine SQLite
+        pragmas: Pragma {имя: значение} (по умолчанию — sqlite_pragmas())
+    """
+    pragmas = sqlite_pragmas() if pragmas is None else pragmas
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def create_engine_from_config() -> AsyncEngine:
+    """Основной engine приложения (сохранения и чтения бота) по настройкам Config"""
+    url = database_url()
+    engine = create_async_engine(url, **engine_options(url))
+    logger.info("Database engine: %s pool=%s", engine.url.render_as_string(hide_password=True), engine.pool.status())
+    return engine
+
+
+def create_read_engine_from_config() -> Optional[AsyncEngine]:
+    """Engine отчётов или None, если чтения должны идти через основной engine (SQLite в памяти)"""
+    url = read_database_url()
+    if url is None:
+        return None
+    engine = create_async_engine(url, **read_engine_options(url))
+    if engine.dialect.name == 'sqlite':
+        install_sqlite_pragmas(engine, sqlite_read_pragmas())
+    logger.info("Read engine: %s pool=%s", engine.url.render_as_string(hide_password=True), engine.pool.status())
+    return engine
+
+
+def pool_stats(engine: AsyncEngine) -> Dict[str, Any]:
+    """
+    Заполненность пула и метрики ожидания соединений пула сохранений (для /dbstats)
+
+    Args:
+        engine: Engine, пул которого описывается
+
+    Returns:
+        Dict[str, Any]: Размер пула, выданные/свободные соединения и времена ожидания
+    """
+    pool = engine.pool
+    stats: Dict[str, Any] = {"pool": type(pool).__name__}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            idle=pool.checkedin(),
+        )
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool_metrics.snapshot())
+    return stats
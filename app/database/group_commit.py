@@ -0,0 +1,174 @@
+"""Групповой коммит SQLite через единственного писателя
+
+В SQLite одновременно пишет только одно соединение, и каждый коммит — это fsync.
+Вместо отдельной транзакции на каждое сохранение вызывающие передают элемент задаче-
+писателю с собственным соединением. Задача берёт всё, что уже ждёт в очереди, и если
+пачка набралась, ждёт ещё попутчиков короткое окно (или до `max_batch` элементов), а затем
+коммитит одной транзакцией; future каждого вызывающего завершается, когда этот коммит
+записан на диск. Одиночное сохранение окно не ждёт: пришедшие во время его коммита
+образуют следующую пачку.
+
+Элемент приходит с пакетной функцией `fn(session, items) -> results`, и все элементы одной
+функции пишутся одним её вызовом — пачка сохранений стоит столько же выражений, сколько одно
+сохранение. Если вызов падает, он откатывается к своему SAVEPOINT, а элементы повторяются
+по одному, каждый в своём savepoint: ошибочный элемент роняет только своего вызывающего.
+
+Engine писателя несёт WRITE_OPTIONS, поэтому каждая пачка начинается с BEGIN IMMEDIATE и
+держит `lock` (models.sqlite_write_lock). Чтения идут через обычные сессии пула с простым
+BEGIN и с WAL никогда не ждут писателя. Слушатели коммита (поисковый индекс, сброс журнала
+прохождения и квот) пишут не через писателя, а в собственной models.write_session под той же
+блокировкой — в процессе они встают в очередь между пачками, а не ждут в busy_timeout.
+Другие процессы по-прежнему ждут в busy_timeout.
+"""
+import asyncio
+import contextlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+logger = logging.getLogger(__name__)
+
+BatchFn = Callable[[AsyncSession, List[Any]], Awaitable[List[Any]]]
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """Владеет одним пишущим соединением и коммитит элементы очереди пачками"""
+
+    def __init__(self, bind: AsyncEngine, max_batch: int = 64, window: float = 0.005,
+                 lock: Optional[asyncio.Lock] = None):
+        """
+        Args:
+            bind: Engine (может нести schema_translate_map), из которого открывается пишущее соединение
+            max_batch: Максимум элементов в одной транзакции
+            window: Сколько секунд ждать новых элементов, если в пачке их уже больше одного
+            lock: Удерживается на время каждой транзакции пачки (другие писатели того же файла базы)
+        """
+        self.bind = bind
+        self.max_batch = max_batch
+        self.window = window
+        self.lock = lock
+        self.batches = 0
+        self.items = 0
+        self._queue: "asyncio.Queue[Tuple[BatchFn, Any, asyncio.Future]]" = asyncio.Queue()
+        self._conn: Optional[AsyncConnection] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, fn: BatchFn, item):
+        """
+        Записывает `item` вызовом fn(session, [..., item, ...]) в ближайшей пачке
+
+        Args:
+            fn: Пакетная функция записи
+            item: Элемент для записи
+
+        Returns:
+            Результат fn для этого элемента — после коммита пачки
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((fn, item, future))
+        return await future
+
+    async def close(self) -> None:
+        """Коммитит уже поставленное в очередь, останавливает задачу и освобождает соединение"""
+        if self._task is not None and not self._task.done():
+            self._queue.put_nowait(_STOP)
+            await self._task
+        self._task = None
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            batch = []
+            item = await self._queue.get()
+            deadline = loop.time() + self.window
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.max_batch:
+                    break
+                if not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    continue
+                if len(batch) == 1:
+                    # no one else is saving: commit at once, arrivals during it form the next batch
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            await self._commit(batch)
+            if stopping:
+                # whatever was queued behind the stop marker
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not _STOP:
+                        await self._commit([item])
+
+    async def _commit(self, batch: List[Tuple[BatchFn, Any, asyncio.Future]]) -> None:
+        groups: Dict[BatchFn, List[Tuple[Any, asyncio.Future]]] = {}
+        for fn, item, future in batch:
+            if not future.done():
+                groups.setdefault(fn, []).append((item, future))
+        if not groups:
+            return
+        outcomes = []
+        try:
+            async with (self.lock if self.lock is not None else contextlib.nullcontext()):
+                if self._conn is None:
+                    self._conn = await self.bind.connect()
+                async with AsyncSession(bind=self._conn, expire_on_commit=False) as session:
+                    for fn, entries in groups.items():
+                        outcomes.extend(await self._write_group(session, fn, entries))
+                    await session.commit()
+        except Exception as e:
+            logger.exception("GroupCommitWriter: batch of %s failed to commit", len(batch))
+            # the connection may be unusable now; open a fresh one for the next batch
+            conn, self._conn = self._conn, None
+            if conn is not None:
+                with contextlib.suppress(Exception):
+                    await conn.invalidate()
+            for _fn, _item, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.items += len(outcomes)
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def _write_group(self, session: AsyncSession, fn: BatchFn, entries: List[Tuple[Any, asyncio.Future]]):
+        try:
+            async with session.begin_nested():
+                results = await fn(session, [item for item, _future in entries])
+            return [(future, result, None) for (_item, future), result in zip(entries, results)]
+        except Exception as e:
+            if len(entries) == 1:
+                return [(entries[0][1], None, e)]
+            logger.warning("GroupCommitWriter: batch write of %s items failed (%s), retrying one by one", len(entries), e)
+        outcomes = []
+        for item, future in entries:
+            try:
+                async with session.begin_nested():
+                    outcomes.append((future, (await fn(session, [item]))[0], None))
+            except Exception as e:
+                outcomes.append((future, None, e))
+        return outcomes
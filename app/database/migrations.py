@@ -0,0 +1,314 @@
+"""Версионные миграции схемы для баз, созданных до текущих моделей
+
+Base.metadata.create_all только создаёт недостающие таблицы и не меняет существующие.
+Шаги ниже доводят существующую схему (SQLite или Postgres, общая или схема арендатора)
+до того, что ожидает путь сохранения. Каждый шаг идемпотентен — сначала сверяется
+с живой схемой — и выполняется в своей транзакции; применённые версии записываются
+в `Миграция`. Запускается при старте, до определения возможностей схемы.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from sqlalchemy import Column, Index, MetaData, Table, bindparam, delete, func, insert, inspect, select, text, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.database.models import (
+    ANSWER_VIEW, WRITE_OPTIONS, Anketa, AnketaAnswer, CustomAnswerDoc, Otvet, Persona, SchemaMigration,
+)
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_xact_lock key: several bot processes may start at once
+_PG_LOCK_KEY = 0x616E6B657461
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable  # apply(sync_conn, schema) -> None
+
+
+def _table(sync_conn, name: str, schema: Optional[str], *columns: str) -> Optional[Table]:
+    """Table только с колонками `columns` или None, если таблицы или какой-то из колонок нет"""
+    insp = inspect(sync_conn)
+    if not insp.has_table(name, schema=schema):
+        return None
+    existing = {c['name'] for c in insp.get_columns(name, schema=schema)}
+    if not set(columns) <= existing:
+        return None
+    return Table(name, MetaData(), *[Column(c) for c in columns], schema=schema)
+
+
+def _create_index(sync_conn, schema: Optional[str], table_name: str, index: Index) -> None:
+    """Создаёт копию индекса модели на живой таблице, если индекса с таким именем ещё нет"""
+    columns = [c.name for c in index.columns]
+    table = _table(sync_conn, table_name, schema, *columns)
+    if table is None:
+        logger.info("Migration: %s(%s) not found in schema %s, index %s skipped", table_name, columns, schema, index.name)
+        return
+    names = {ix['name'] for ix in inspect(sync_conn).get_indexes(table_name, schema=schema)}
+    if index.name in names:
+        return
+    Index(index.name, *[table.c[c] for c in columns], unique=index.unique, **index.dialect_kwargs).create(sync_conn)
+    logger.info("Migration: created index %s on %s(%s)", index.name, table_name, ", ".join(columns))
+
+
+def _model_index(model, name: str) -> Index:
+    return next(ix for ix in model.__table__.indexes if ix.name == name)
+
+
+def _add_column(sync_conn, schema: Optional[str], table_name: str, column: Column) -> None:
+    insp = inspect(sync_conn)
+    if not insp.has_table(table_name, schema=schema):
+        return
+    if column.name in {c['name'] for c in insp.get_columns(table_name, schema=schema)}:
+        return
+    preparer = sync_conn.dialect.identifier_preparer
+    table = preparer.format_table(Table(table_name, MetaData(), schema=schema))
+    col_type = column.type.compile(dialect=sync_conn.dialect)
+    sync_conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {preparer.quote(column.name)} {col_type}"))
+    logger.info("Migration: added column %s.%s %s", table_name, column.name, col_type)
+
+
+def _index_answer_anketa_id(sync_conn, schema):
+    _create_index(sync_conn, schema, AnketaAnswer.__tablename__, _model_index(AnketaAnswer, 'ix_anketa_answer_anketa_id'))
+
+
+def _index_anketa_person_id(sync_conn, schema):
+    # legacy layouts without person_id look the Анкета up by its primary key
+    _create_index(sync_conn, schema, Anketa.__tablename__, _model_index(Anketa, 'ix_anketa_person_id'))
+
+
+def _index_otvet_text(sync_conn, schema):
+    _create_index(sync_conn, schema, Otvet.__tablename__, _model_index(Otvet, 'ix_otvet_text'))
+
+
+def _incremental_columns(sync_conn, schema):
+    _add_column(sync_conn, schema, Anketa.__tablename__, Anketa.__table__.c.status)
+    _add_column(sync_conn, schema, AnketaAnswer.__tablename__, AnketaAnswer.__table__.c.answer_key)
+
+
+def _unique_persona_user_id(sync_conn, schema):
+    """Объединяет дубли Персона (остаётся самый ранний id на user_id) и добавляет уникальный индекс"""
+    persona = _table(sync_conn, Persona.__tablename__, schema, 'id', 'user_id')
+    if persona is None:
+        return
+    dupes = sync_conn.execute(
+        select(persona.c.user_id, func.min(persona.c.id))
+        .group_by(persona.c.user_id)
+        .having(func.count() > 1)
+    ).all()
+    anketa = _table(sync_conn, Anketa.__tablename__, schema, 'id', 'person_id')
+    legacy = anketa is None and _table(sync_conn, Anketa.__tablename__, schema, 'id') is not None
+    for user_id, keep_id in dupes:
+        extra = [pid for (pid,) in sync_conn.execute(
+            select(persona.c.id).where(persona.c.user_id == user_id, persona.c.id != keep_id)
+        )]
+        if anketa is not None:
+            sync_conn.execute(update(anketa).where(anketa.c.person_id.in_(extra)).values(person_id=keep_id))
+        elif legacy:
+            # Анкета.id == Персона.id: rows that own an Анкета cannot be merged automatically
+            owners = Table(Anketa.__tablename__, MetaData(), Column('id'), schema=schema)
+            taken = {pid for (pid,) in sync_conn.execute(select(owners.c.id).where(owners.c.id.in_(extra)))}
+            if taken:
+                raise RuntimeError(
+                    f"Персона user_id={user_id}: duplicates {sorted(taken)} own legacy Анкета rows, merge them manually"
+                )
+        sync_conn.execute(delete(persona).where(persona.c.id.in_(extra)))
+    if dupes:
+        logger.warning("Migration: merged duplicate Персона rows for %s user_id values", len(dupes))
+    _create_index(sync_conn, schema, Persona.__tablename__, _model_index(Persona, 'ix_persona_user_id'))
+
+
+def backfill_answer_labels(sync_conn, schema: Optional[str]) -> int:
+    """
+    Заполняет пустые Ответ.label по таблицам опроса (см. answer_labels)
+
+    Args:
+        sync_conn: Синхронное соединение миграции
+        schema: Схема арендатора (None — общая)
+
+    Returns:
+        int: Число обновлённых строк
+    """
+    from app.services.answer_catalog import answer_labels
+    from app.services.survey_provider import survey_row_queries
+
+    otvet = _table(sync_conn, Otvet.__tablename__, schema, 'id', 'text', 'label')
+    if otvet is None:
+        return 0
+    missing = {i for (i,) in sync_conn.execute(select(otvet.c.id).where(otvet.c.label.is_(None)))}
+    if not missing:
+        return 0
+    if schema:
+        sync_conn = sync_conn.execution_options(schema_translate_map={None: schema})
+    _version, _modules, _questions, answers_q, scale_q = survey_row_queries()
+    labels = answer_labels(sync_conn.execute(answers_q).all(), list(sync_conn.execute(scale_q).scalars()))
+    # level answers: the label is the scale option only
+    params = [{'row_id': i, 'new_label': labels[i]} for i in missing if labels.get(i) is not None]
+    if params:
+        sync_conn.execute(
+            update(otvet).where(otvet.c.id == bindparam('row_id')).values(label=bindparam('new_label')), params
+        )
+    # options and the scale itself: the label is the text
+    sync_conn.execute(update(otvet).where(otvet.c.label.is_(None)).values(label=otvet.c.text))
+    return len(missing)
+
+
+def _answer_labels(sync_conn, schema):
+    _add_column(sync_conn, schema, Otvet.__tablename__, Otvet.__table__.c.label)
+    updated = backfill_answer_labels(sync_conn, schema)
+    if updated:
+        logger.info("Migration: filled Ответ.label for %s rows", updated)
+
+
+def create_answer_view(sync_conn, schema):
+    """Создаёт представление Анкета_ответ_полный по живым колонкам Анкета_ответ, если его ещё нет"""
+    answers = _table(sync_conn, AnketaAnswer.__tablename__, schema, 'answer_id', 'answer_text')
+    otvet = _table(sync_conn, Otvet.__tablename__, schema, 'id', 'text', 'label')
+    if answers is None or otvet is None:
+        return
+    insp = inspect(sync_conn)
+    if ANSWER_VIEW in insp.get_view_names(schema=schema):
+        return
+    preparer = sync_conn.dialect.identifier_preparer
+    # SQLite resolves a view's tables in the view's own database and rejects qualified names
+    table_schema = None if sync_conn.dialect.name == 'sqlite' else schema
+
+    def name(table_name: str, table_schema: Optional[str]) -> str:
+        return preparer.format_table(Table(table_name, MetaData(), schema=table_schema))
+
+    columns = []
+    for column in insp.get_columns(AnketaAnswer.__tablename__, schema=schema):
+        quoted = preparer.quote(column['name'])
+        if column['name'] == 'answer_text':
+            columns.append(f"COALESCE(a.{quoted}, o.label, o.text) AS {quoted}")
+        else:
+            columns.append(f"a.{quoted}")
+    sync_conn.execute(text(
+        f"CREATE VIEW {name(ANSWER_VIEW, schema)} AS SELECT {', '.join(columns)} "
+        f"FROM {name(AnketaAnswer.__tablename__, table_schema)} a "
+        f"LEFT JOIN {name(Otvet.__tablename__, table_schema)} o ON o.id = a.answer_id"
+    ))
+    logger.info("Migration: created view %s", ANSWER_VIEW)
+
+
+def _compact_answer_storage(sync_conn, schema):
+    _answer_labels(sync_conn, schema)
+    create_answer_view(sync_conn, schema)
+
+
+def _anketa_snapshot(sync_conn, schema):
+    # existing rows stay NULL: readers rebuild their answers from Анкета_ответ
+    _add_column(sync_conn, schema, Anketa.__tablename__, Anketa.__table__.c.answers)
+
+
+
+def _backfill_custom_answers(sync_conn, schema):
+    """
+    Переносит в Свободный_ответ свободные ответы, сохранённые до его появления (answer_key на :custom_answer)
+
+    Строки, записанные до добавления answer_key, не отличить от выбранных вариантов — они пропускаются.
+    """
+    from app.services.search_service import CUSTOM_SUFFIX
+
+    answers = _table(sync_conn, AnketaAnswer.__tablename__, schema, 'id', 'anketa_id', 'answer_text', 'answer_key')
+    docs = _table(sync_conn, CustomAnswerDoc.__tablename__, schema, 'anketa_id', 'user_id', 'question_key', 'text')
+    persona = _table(sync_conn, Persona.__tablename__, schema, 'id', 'user_id')
+    anketa = _table(sync_conn, Anketa.__tablename__, schema, 'id', 'person_id')
+    if anketa is None:
+        anketa = _table(sync_conn, Anketa.__tablename__, schema, 'id')
+    if answers is None or docs is None or persona is None or anketa is None:
+        return
+    # legacy layout: Анкета.id == Персона.id
+    owner = anketa.c.person_id if 'person_id' in anketa.c else anketa.c.id
+    rows = sync_conn.execute(
+        select(answers.c.anketa_id, persona.c.user_id, answers.c.answer_key, answers.c.answer_text)
+        .join(anketa, anketa.c.id == answers.c.anketa_id)
+        .join(persona, persona.c.id == owner)
+        .where(
+            answers.c.answer_key.like('%' + CUSTOM_SUFFIX),
+            answers.c.answer_text.is_not(None),
+            # anketas saved since the listener started indexing are already there
+            answers.c.anketa_id.not_in(select(docs.c.anketa_id)),
+        )
+        .order_by(answers.c.id)
+    ).all()
+    params = [
+        {'anketa_id': anketa_id, 'user_id': user_id, 'question_key': key[:-len(CUSTOM_SUFFIX)], 'text': value}
+        for anketa_id, user_id, key, value in rows
+        if value.strip()
+    ]
+    if params:
+        sync_conn.execute(insert(docs), params)
+        logger.info("Migration: indexed %s stored custom answers into %s", len(params), CustomAnswerDoc.__tablename__)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "index Анкета_ответ.anketa_id", _index_answer_anketa_id),
+    Migration(2, "index Анкета.person_id", _index_anketa_person_id),
+    Migration(3, "index Ответ.text", _index_otvet_text),
+    Migration(4, "Анкета.status and Анкета_ответ.answer_key", _incremental_columns),
+    Migration(6, "Ответ.label and view Анкета_ответ_полный", _compact_answer_storage),
+    Migration(7, "Анкета.answers snapshot", _anketa_snapshot),
+    Migration(8, "Свободный_ответ from stored custom answers", _backfill_custom_answers),
+    # last: the only step that may refuse to run (legacy duplicates) and block the ones after it
+    Migration(5, "unique Персона.user_id", _unique_persona_user_id),
+]
+
+
+def _versions_table(schema: Optional[str]) -> Table:
+    return SchemaMigration.__table__.to_metadata(MetaData(), schema=schema)
+
+
+def _applied_sync(sync_conn, schema: Optional[str]) -> set:
+    versions = _versions_table(schema)
+    versions.create(sync_conn, checkfirst=True)
+    return {v for (v,) in sync_conn.execute(select(versions.c.version))}
+
+
+def _migrate_sync(sync_conn, schema: Optional[str], migration: Migration) -> bool:
+    versions = _versions_table(schema)
+    if sync_conn.dialect.name == 'postgresql':
+        sync_conn.execute(select(func.pg_advisory_xact_lock(_PG_LOCK_KEY)))
+    # another process may have applied it while we waited for the lock (SQLite: BEGIN IMMEDIATE)
+    if sync_conn.execute(select(versions.c.version).where(versions.c.version == migration.version)).first():
+        return False
+    migration.apply(sync_conn, schema)
+    sync_conn.execute(insert(versions).values(version=migration.version, name=migration.name))
+    return True
+
+
+async def run_migrations(engine: AsyncEngine, schema: Optional[str] = None) -> List[int]:
+    """
+    Применяет ожидающие миграции к схеме
+
+    Останавливается на первом упавшем шаге: ошибка пишется в лог, шаг повторяется при следующем запуске.
+
+    Args:
+        engine: Основной engine
+        schema: Схема арендатора (None — общая)
+
+    Returns:
+        List[int]: Применённые версии
+    """
+    # SQLite: BEGIN IMMEDIATE — processes starting at once apply each step one after another
+    engine = engine.execution_options(**WRITE_OPTIONS)
+    async with engine.begin() as conn:
+        done = await conn.run_sync(_applied_sync, schema)
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version in done:
+            continue
+        try:
+            async with engine.begin() as conn:
+                if await conn.run_sync(_migrate_sync, schema, migration):
+                    applied.append(migration.version)
+        except Exception:
+            logger.exception("Migration %s (%s) failed in schema %s", migration.version, migration.name, schema)
+            break
+    if applied:
+        logger.info("Migrations applied (schema=%s): %s", schema, applied)
+    return applied
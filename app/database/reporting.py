@@ -0,0 +1,90 @@
+"""Ограниченные чтения для команд администратора и выгрузок (в сессиях read_engine)
+
+Postgres прерывает выражение по таймауту на сервере (READ_STATEMENT_TIMEOUT_MS — настройка
+сессий пула чтения). В SQLite такой настройки нет, поэтому по истечении таймаута выражение
+прерывается через sqlite3_interrupt; в остальных диалектах — отменяется на стороне клиента.
+"""
+import asyncio
+from typing import List, Optional, Tuple
+
+from sqlalchemy.exc import OperationalError
+
+from app.config import Config
+
+
+async def fetch_rows(session, statement, limit: Optional[int] = None,
+                     timeout_ms: Optional[int] = None) -> Tuple[List[dict], bool]:
+    """
+    Не больше `limit` строк выражения в виде словарей
+
+    Строки читаются потоком, так что большая таблица не загружается дальше лимита.
+
+    Args:
+        session: Сессия чтения
+        statement: Выражение select
+        limit: Лимит строк (по умолчанию READ_ROW_LIMIT, 0 — без лимита)
+        timeout_ms: Таймаут выражения (по умолчанию READ_STATEMENT_TIMEOUT_MS, 0 — без таймаута)
+
+    Returns:
+        Tuple[List[dict], bool]: Строки и признак, что остались непрочитанные
+
+    Raises:
+        asyncio.TimeoutError: Выражение выполнялось дольше таймаута
+    """
+    limit = Config.READ_ROW_LIMIT if limit is None else limit
+    timeout_ms = Config.READ_STATEMENT_TIMEOUT_MS if timeout_ms is None else timeout_ms
+
+    async def read():
+        rows = []
+        result = await session.stream(statement)
+        try:
+            async for row in result:
+                if limit and len(rows) >= limit:
+                    return rows, True
+                rows.append(dict(row._mapping))
+        finally:
+            await result.close()
+        return rows, False
+
+    if not timeout_ms:
+        return await read()
+    conn = await session.connection()
+    if conn.dialect.name != 'sqlite':
+        return await asyncio.wait_for(read(), timeout_ms / 1000)
+    # cancelling the await would leave the statement running in the driver thread (and the
+    # cursor close waiting for it): interrupt the statement itself when the time is up
+    driver_conn = (await conn.get_raw_connection()).driver_connection
+    interrupted = []
+
+    def interrupt():
+        interrupted.append(asyncio.ensure_future(driver_conn.interrupt()))
+
+    timer = asyncio.get_running_loop().call_later(timeout_ms / 1000, interrupt)
+    try:
+        return await read()
+    except OperationalError as e:
+        if interrupted:
+            raise asyncio.TimeoutError(f"statement interrupted after {timeout_ms} ms") from e
+        raise
+    finally:
+        timer.cancel()
+
+
+def answers_from_rows(rows) -> dict:
+    """
+    Восстанавливает {ключ ответа: значение} по строкам Анкета_ответ (mappings в порядке id)
+
+    Запасной путь для Анкета без снимка answers (сохранённых до появления колонки).
+    Несколько строк одного ключа — список множественного выбора; строки без answer_key
+    получают ключ по question_id.
+    """
+    answers = {}
+    for row in rows:
+        key = row.get('answer_key') or row.get('question_id')
+        value = row.get('answer_text')
+        if key in answers:
+            previous = answers[key]
+            answers[key] = (previous if isinstance(previous, list) else [previous]) + [value]
+        else:
+            answers[key] = value
+    return answers
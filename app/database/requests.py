@@ -1,4 +1,4 @@
-from app.database.models import async_session, Persona
+from app.database.models import write_session, Persona
 from sqlalchemy import select
 
 
@@ -7,7 +7,7 @@ async def set_user(tg_id: int, username: str = ''):
 
     This replaces the old `users` table usage and maps Telegram user id -> Persona.User_id.
     """
-    async with async_session() as session:
+    async with write_session() as session:
         person = await session.scalar(select(Persona).where(Persona.user_id == tg_id))
         if not person:
             session.add(Persona(user_id=tg_id, username=(username or '')))
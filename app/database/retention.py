@@ -0,0 +1,304 @@
+"""Хранение данных ответов: помесячные секции, архивирование и удаление тестовых персон
+
+В Postgres Анкета_ответ можно секционировать по диапазону created_at — секция на месяц
+(Анкета_ответ_2026_10) и секция DEFAULT для строк вне них. Запрос с диапазоном created_at
+(одна волна опроса) тогда читает только секции этой волны, vacuum и обслуживание индексов
+идут по месяцам, а старый месяц покидает таблицу через DETACH (или выгрузку в .csv.gz и DROP)
+вместо долгого DELETE. В SQLite таблица остаётся одной: функции секций там ничего не делают.
+
+Тестовые прогоны (scripts/collect_test_data.py) пишут синтетических персон в те же таблицы;
+purge_test_personas удаляет их вместе со всем, что они сохранили.
+
+Все функции принимают синхронное соединение (conn.run_sync) и схему арендатора, как шаги
+миграций; командная строка — scripts/answer_retention.py.
+"""
+import csv
+import datetime
+import gzip
+import logging
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import MetaData, Table, delete, func, inspect, select, text
+
+from app.database.migrations import _table, create_answer_view
+from app.database.models import (
+    ANSWER_VIEW,
+    Anketa,
+    AnketaAnswer,
+    AnketaAnswerHistory,
+    CustomAnswerDoc,
+    JourneyEvent,
+    Persona,
+)
+
+logger = logging.getLogger(__name__)
+
+ANSWER_TABLE = AnketaAnswer.__tablename__
+DEFAULT_PARTITION = f'{ANSWER_TABLE}_default'
+_MONTH_RE = re.compile(r'_(\d{4})_(\d{2})$')
+
+# usernames of the personas written by scripts/collect_test_data.py
+TEST_USERNAME_PREFIX = 'test_user_'
+
+
+def month_start(day: datetime.date) -> datetime.date:
+    return datetime.date(day.year, day.month, 1)
+
+
+def add_months(month: datetime.date, count: int) -> datetime.date:
+    years, index = divmod(month.month - 1 + count, 12)
+    return datetime.date(month.year + years, index + 1, 1)
+
+
+def partition_name(month: datetime.date) -> str:
+    return f'{ANSWER_TABLE}_{month.year:04d}_{month.month:02d}'
+
+
+def _qualified(sync_conn, name: str, schema: Optional[str]) -> str:
+    return sync_conn.dialect.identifier_preparer.format_table(Table(name, MetaData(), schema=schema))
+
+
+def is_partitioned(sync_conn, schema: Optional[str]) -> bool:
+    """Секционирована ли Анкета_ответ (вне Postgres всегда False)"""
+    if sync_conn.dialect.name != 'postgresql':
+        return False
+    return sync_conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = :name AND n.nspname = COALESCE(:schema, current_schema())"
+    ), {'name': ANSWER_TABLE, 'schema': schema}).first() is not None
+
+
+def partitions(sync_conn, schema: Optional[str]) -> Dict[str, Optional[datetime.date]]:
+    """{имя секции: её месяц} Анкета_ответ; None — секция DEFAULT (или имя не по шаблону)"""
+    rows = sync_conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "JOIN pg_namespace n ON n.oid = p.relnamespace "
+        "WHERE p.relname = :name AND n.nspname = COALESCE(:schema, current_schema())"
+    ), {'name': ANSWER_TABLE, 'schema': schema}).all()
+    result = {}
+    for (name,) in rows:
+        match = _MONTH_RE.search(name)
+        result[name] = datetime.date(int(match[1]), int(match[2]), 1) if match else None
+    return result
+
+
+def _create_month(sync_conn, schema: Optional[str], month: datetime.date, has_default: bool) -> int:
+    """Подключает секцию месяца `month`, перенося её строки из DEFAULT; возвращает число перенесённых строк"""
+    parent = _qualified(sync_conn, ANSWER_TABLE, schema)
+    part = _qualified(sync_conn, partition_name(month), schema)
+    lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+    # CREATE ... PARTITION OF would fail once the DEFAULT partition holds rows of this month
+    sync_conn.execute(text(f"CREATE TABLE {part} (LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    moved = 0
+    if has_default:
+        default = _qualified(sync_conn, DEFAULT_PARTITION, schema)
+        moved = sync_conn.execute(text(
+            f"WITH moved AS (DELETE FROM {default} WHERE created_at >= :lower AND created_at < :upper RETURNING *) "
+            f"INSERT INTO {part} SELECT * FROM moved"
+        ), {'lower': lower, 'upper': upper}).rowcount
+    sync_conn.execute(text(f"ALTER TABLE {parent} ATTACH PARTITION {part} FOR VALUES FROM ('{lower}') TO ('{upper}')"))
+    logger.info("Retention: created partition %s (%s rows moved from the default partition)", partition_name(month), moved)
+    return moved
+
+
+def ensure_partitions(sync_conn, schema: Optional[str], ahead: int = 3,
+                      today: Optional[datetime.date] = None) -> List[str]:
+    """
+    Создаёт секции текущего месяца и `ahead` следующих
+
+    Без них новые ответы попадают в DEFAULT, которую приходится читать каждому запросу по волне.
+
+    Returns:
+        List[str]: Имена созданных секций
+    """
+    if not is_partitioned(sync_conn, schema):
+        return []
+    existing = partitions(sync_conn, schema)
+    has_default = DEFAULT_PARTITION in existing
+    current = month_start(today or datetime.date.today())
+    created = []
+    for index in range(ahead + 1):
+        month = add_months(current, index)
+        if partition_name(month) not in existing:
+            _create_month(sync_conn, schema, month, has_default)
+            created.append(partition_name(month))
+    return created
+
+
+def partition_answers(sync_conn, schema: Optional[str], ahead: int = 3,
+                      today: Optional[datetime.date] = None) -> bool:
+    """
+    Пересоздаёт Анкета_ответ как таблицу, секционированную по месяцу created_at
+
+    Одна транзакция под блокировкой ACCESS EXCLUSIVE: копируется каждая строка, поэтому на большой
+    таблице запускайте в окно обслуживания (scripts/answer_retention.py partition). Последовательность
+    id, внешние ключи и индексы переходят на новую таблицу; первичный ключ становится (id, created_at),
+    как требует Postgres для секционированных таблиц, а created_at получает NOT NULL.
+
+    Returns:
+        bool: False, если делать нечего (не Postgres или таблица уже секционирована)
+    """
+    if sync_conn.dialect.name != 'postgresql' or is_partitioned(sync_conn, schema):
+        return False
+    insp = inspect(sync_conn)
+    if not insp.has_table(ANSWER_TABLE, schema=schema):
+        return False
+    columns = [c['name'] for c in insp.get_columns(ANSWER_TABLE, schema=schema)]
+    if 'created_at' not in columns:
+        raise RuntimeError(f"{ANSWER_TABLE} has no created_at column to partition by")
+    old = _qualified(sync_conn, ANSWER_TABLE, schema)
+    staging_name = f'{ANSWER_TABLE}_partitioned'
+    staging = _qualified(sync_conn, staging_name, schema)
+    preparer = sync_conn.dialect.identifier_preparer
+    sync_conn.execute(text(f"LOCK TABLE {old} IN ACCESS EXCLUSIVE MODE"))
+
+    sequence = sync_conn.execute(select(func.pg_get_serial_sequence(old, 'id'))).scalar()
+    if sequence is None:
+        raise RuntimeError(f"{ANSWER_TABLE}.id has no owned sequence (identity column?): partition it manually")
+    foreign_keys = insp.get_foreign_keys(ANSWER_TABLE, schema=schema)
+    indexes = insp.get_indexes(ANSWER_TABLE, schema=schema)
+    view = ANSWER_VIEW in insp.get_view_names(schema=schema)
+    if view:
+        # depends on the old table; recreated over the new one below
+        sync_conn.execute(text(f"DROP VIEW {_qualified(sync_conn, ANSWER_VIEW, schema)}"))
+
+    sync_conn.execute(text(
+        f"CREATE TABLE {staging} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (created_at)"
+    ))
+    first = sync_conn.execute(text(f"SELECT min(created_at) FROM {old}")).scalar()
+    current = month_start(today or datetime.date.today())
+    month = month_start(first) if first is not None and first.date() < current else current
+    last = add_months(current, ahead)
+    while month <= last:
+        part = _qualified(sync_conn, partition_name(month), schema)
+        sync_conn.execute(text(
+            f"CREATE TABLE {part} PARTITION OF {staging} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        ))
+        month = add_months(month, 1)
+    sync_conn.execute(text(f"CREATE TABLE {_qualified(sync_conn, DEFAULT_PARTITION, schema)} PARTITION OF {staging} DEFAULT"))
+
+    column_list = ', '.join(preparer.quote(c) for c in columns)
+    select_list = ', '.join('COALESCE(created_at, now())' if c == 'created_at' else preparer.quote(c) for c in columns)
+    copied = sync_conn.execute(text(f"INSERT INTO {staging} ({column_list}) SELECT {select_list} FROM {old}")).rowcount
+    # the sequence would be dropped with the old table
+    sync_conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {staging}.id"))
+    sync_conn.execute(text(f"DROP TABLE {old}"))
+    sync_conn.execute(text(f"ALTER TABLE {staging} RENAME TO {preparer.quote(ANSWER_TABLE)}"))
+
+    sync_conn.execute(text(f"ALTER TABLE {old} ALTER COLUMN created_at SET NOT NULL"))
+    sync_conn.execute(text(f"ALTER TABLE {old} ADD PRIMARY KEY (id, created_at)"))
+    for fk in foreign_keys:
+        referred = _qualified(sync_conn, fk['referred_table'], fk.get('referred_schema') or schema)
+        sync_conn.execute(text(
+            f"ALTER TABLE {old} ADD FOREIGN KEY ({', '.join(preparer.quote(c) for c in fk['constrained_columns'])}) "
+            f"REFERENCES {referred} ({', '.join(preparer.quote(c) for c in fk['referred_columns'])})"
+        ))
+    for index in indexes:
+        if None in index['column_names']:
+            logger.warning("Retention: expression index %s on %s not recreated", index['name'], ANSWER_TABLE)
+            continue
+        if index.get('unique'):
+            # a unique index of a partitioned table must contain created_at
+            logger.warning("Retention: unique index %s on %s not recreated", index['name'], ANSWER_TABLE)
+            continue
+        # created on the parent, so every partition (present and future) gets it
+        sync_conn.execute(text(
+            f"CREATE INDEX {preparer.quote(index['name'])} ON {old} "
+            f"({', '.join(preparer.quote(c) for c in index['column_names'])})"
+        ))
+    if view:
+        create_answer_view(sync_conn, schema)
+    logger.warning("Retention: %s is now partitioned by month of created_at (%s rows copied)", ANSWER_TABLE, copied)
+    return True
+
+
+def archivable_partitions(sync_conn, schema: Optional[str], before: datetime.date) -> List[str]:
+    """Помесячные секции, закончившиеся не позже `before` (сначала старые)"""
+    months = [(month, name) for name, month in partitions(sync_conn, schema).items() if month is not None]
+    return [name for month, name in sorted(months) if add_months(month, 1) <= before]
+
+
+def archive_partition(sync_conn, schema: Optional[str], name: str,
+                      export_dir: Optional[Path] = None) -> Tuple[int, Optional[Path]]:
+    """
+    Выводит одну помесячную секцию из Анкета_ответ
+
+    Без `export_dir` секция только отключается: она остаётся обычной таблицей, которую не читают
+    запросы к Анкета_ответ, и её можно выгрузить или удалить позже. С ним строки сначала пишутся
+    в <export_dir>/<schema>.<name>.csv.gz (с заголовком), а таблица удаляется.
+
+    Returns:
+        Tuple[int, Optional[Path]]: Число строк и файл выгрузки (или None)
+    """
+    parent = _qualified(sync_conn, ANSWER_TABLE, schema)
+    part = _qualified(sync_conn, name, schema)
+    rows, path = 0, None
+    if export_dir is not None:
+        export_dir.mkdir(parents=True, exist_ok=True)
+        path = export_dir / f"{schema or 'public'}.{name}.csv.gz"
+        partial = path.with_name(path.name + '.part')
+        result = sync_conn.execution_options(stream_results=True).execute(text(f"SELECT * FROM {part} ORDER BY id"))
+        with gzip.open(partial, 'wt', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(result.keys())
+            for row in result:
+                writer.writerow(row)
+                rows += 1
+        partial.replace(path)
+    else:
+        rows = sync_conn.execute(text(f"SELECT count(*) FROM {part}")).scalar()
+    sync_conn.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {part}"))
+    if path is not None:
+        sync_conn.execute(text(f"DROP TABLE {part}"))
+    logger.info("Retention: %s %s (%s rows)%s", 'archived' if path else 'detached', name, rows,
+                f" to {path}" if path else '')
+    return rows, path
+
+
+def purge_test_personas(sync_conn, schema: Optional[str],
+                        username_prefix: str = TEST_USERNAME_PREFIX) -> Dict[str, int]:
+    """
+    Удаляет Персона с username на `username_prefix` вместе со всеми их данными
+
+    Ответы, история ответов, проиндексированные свободные ответы, события пути, Анкета и Персона
+    удаляются в транзакции вызывающего (для пробного запуска её откатывают). Счётчики квот ведутся
+    по ячейкам, а не по персонам, и не меняются.
+
+    Returns:
+        Dict[str, int]: Число удалённых строк по таблицам
+    """
+    persona = _table(sync_conn, Persona.__tablename__, schema, 'id', 'user_id', 'username')
+    if persona is None:
+        return {}
+    test_pids = select(persona.c.id).where(persona.c.username.startswith(username_prefix, autoescape=True))
+    test_users = select(persona.c.user_id).where(persona.c.id.in_(test_pids))
+    anketa = _table(sync_conn, Anketa.__tablename__, schema, 'id', 'person_id')
+    if anketa is None:
+        # legacy layout: Анкета.id == Персона.id
+        anketa = _table(sync_conn, Anketa.__tablename__, schema, 'id')
+    anketa_ids = None
+    if anketa is not None:
+        owner = anketa.c.person_id if 'person_id' in anketa.c else anketa.c.id
+        anketa_ids = select(anketa.c.id).where(owner.in_(test_pids))
+
+    counts: Dict[str, int] = {}
+
+    def purge(model, column: str, ids) -> None:
+        table = _table(sync_conn, model.__tablename__, schema, column)
+        if table is not None:
+            counts[model.__tablename__] = sync_conn.execute(delete(table).where(table.c[column].in_(ids))).rowcount
+
+    # children first: Анкета_ответ references Анкета, Анкета references Персона
+    if anketa_ids is not None:
+        for model in (AnketaAnswer, AnketaAnswerHistory, CustomAnswerDoc):
+            purge(model, 'anketa_id', anketa_ids)
+    purge(JourneyEvent, 'user_id', test_users)
+    if anketa_ids is not None:
+        purge(Anketa, 'id', anketa_ids)
+    purge(Persona, 'id', test_pids)
+    return counts
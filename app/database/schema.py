@@ -0,0 +1,538 @@
+"""Определение возможностей схемы и подходящие стратегии записи
+
+Развёрнутые базы различаются: таблицы, созданные setup_database.py,
+Base.metadata.create_all или старыми версиями, имеют разную структуру Анкета
+и могут не иметь уникального индекса на Персона.user_id. Вместо того чтобы
+узнавать структуру по падающим выражениям при каждом сохранении, она
+проверяется один раз при запуске, а DBService получает объекты-стратегии,
+которые сразу идут нужным путём.
+"""
+import datetime
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from sqlalchemy import Column, MetaData, Table, bindparam, delete, func, insert, inspect, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.database.models import ANSWER_VIEW, Anketa, AnketaAnswer, Persona
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SchemaCapabilities:
+    """Что на самом деле есть в подключённой базе (определяется один раз на схему)"""
+    dialect: str
+    driver: str
+    anketa_columns: FrozenSet[str]
+    answer_columns: FrozenSet[str]
+    persona_user_id_unique: bool
+    # Анкета_ответ_полный (app/database/migrations.py) restores answer_text of compact rows
+    answer_view: bool = False
+
+    @property
+    def anketa_has_person_id(self) -> bool:
+        return 'person_id' in self.anketa_columns
+
+    @property
+    def anketa_has_id_q(self) -> bool:
+        return 'id_q' in self.anketa_columns
+
+    @property
+    def anketa_has_status(self) -> bool:
+        return 'status' in self.anketa_columns
+
+    @property
+    def anketa_has_snapshot(self) -> bool:
+        return 'answers' in self.anketa_columns
+
+    @property
+    def answer_has_key(self) -> bool:
+        return 'answer_key' in self.answer_columns
+
+    @property
+    def supports_incremental(self) -> bool:
+        """Запись по отдельным ответам требует Анкета.status и Анкета_ответ.answer_key"""
+        return self.anketa_has_status and self.answer_has_key
+
+    def anketa_table(self) -> Table:
+        """
+        Анкета в том виде, в каком она есть в базе: только найденные столбцы, без клиентских умолчаний
+
+        Настоящая Table (не облегчённая table()), чтобы к ней применялся schema_translate_map.
+        Снимок ответов сохраняет тип JSON: значения (де)сериализует сам столбец.
+        """
+        return Table(Anketa.__tablename__, MetaData(), *[
+            Column(name, Anketa.__table__.c.answers.type) if name == 'answers' else Column(name)
+            for name in sorted(self.anketa_columns)
+        ])
+
+    def answer_table(self, name: str = AnketaAnswer.__tablename__) -> Table:
+        """
+        Анкета_ответ (или представление `name` над ней) с найденными столбцами, как anketa_table
+
+        Args:
+            name: Имя таблицы или представления (например, Анкета_ответ_полный)
+        """
+        return Table(name, MetaData(), *[Column(c) for c in sorted(self.answer_columns)])
+
+
+def _inspect_sync(sync_conn, schema: Optional[str]) -> SchemaCapabilities:
+    insp = inspect(sync_conn)
+
+    def columns(name: str) -> FrozenSet[str]:
+        if not insp.has_table(name, schema=schema):
+            return frozenset()
+        return frozenset(c['name'] for c in insp.get_columns(name, schema=schema))
+
+    unique = False
+    if insp.has_table(Persona.__tablename__, schema=schema):
+        for ix in insp.get_indexes(Persona.__tablename__, schema=schema):
+            if ix.get('unique') and list(ix.get('column_names') or []) == ['user_id']:
+                unique = True
+        for uc in insp.get_unique_constraints(Persona.__tablename__, schema=schema):
+            if list(uc.get('column_names') or []) == ['user_id']:
+                unique = True
+
+    return SchemaCapabilities(
+        dialect=sync_conn.dialect.name,
+        driver=sync_conn.dialect.driver,
+        anketa_columns=columns(Anketa.__tablename__),
+        answer_columns=columns(AnketaAnswer.__tablename__),
+        persona_user_id_unique=unique,
+        answer_view=ANSWER_VIEW in insp.get_view_names(schema=schema),
+    )
+
+
+async def detect_capabilities(session_maker, schema: Optional[str] = None) -> SchemaCapabilities:
+    """
+    Проверяет таблицы схемы через engine фабрики сессий
+
+    Args:
+        session_maker: Фабрика async-сессий SQLAlchemy
+        schema: Схема арендатора (None — общая схема по умолчанию)
+
+    Returns:
+        SchemaCapabilities: Найденные столбцы, индексы и диалект
+    """
+    async with session_maker() as session:
+        conn = await session.connection()
+        caps = await conn.run_sync(_inspect_sync, schema)
+    logger.info(
+        "Schema capabilities (schema=%s): dialect=%s anketa_columns=%s persona_user_id_unique=%s",
+        schema, caps.dialect, sorted(caps.anketa_columns), caps.persona_user_id_unique,
+    )
+    return caps
+
+
+def answers_snapshot(answers: Optional[dict]) -> dict:
+    """Значение Анкета.answers для набора ответов: удалённые ответы (None) отбрасываются"""
+    return {key: value for key, value in (answers or {}).items() if value is not None}
+
+
+# --- Персона ---
+
+class PersonaWriter(ABC):
+    """Возвращает Персона.id пользователей Telegram, при необходимости создавая строки"""
+
+    @abstractmethod
+    async def get_ids(self, session, users: List[Tuple[int, Optional[str]]]) -> Dict[int, int]:
+        """
+        Персона.id для пар (tg_id, username) за столько выражений, сколько позволяет структура
+
+        Args:
+            session: Открытая сессия (транзакция вызывающего)
+            users: Пары (tg_id, username)
+
+        Returns:
+            Dict[int, int]: {tg_id: Персона.id}
+        """
+
+    async def get_id(self, session, tg_id: int, username: str = None) -> int:
+        return (await self.get_ids(session, [(tg_id, username)]))[tg_id]
+
+
+class UpsertPersonaWriter(PersonaWriter):
+    """INSERT ... ON CONFLICT (user_id) DO UPDATE ... RETURNING — один запрос к базе для всех пользователей"""
+
+    def __init__(self, dialect: str):
+        self._insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+
+    async def get_ids(self, session, users: List[Tuple[int, Optional[str]]]) -> Dict[int, int]:
+        stmt = self._insert(Persona).values([
+            {'user_id': tg_id, 'username': (username or '')} for tg_id, username in users
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Persona.user_id],
+            # keep the stored username unless a non-empty one is supplied
+            set_={'username': func.coalesce(func.nullif(stmt.excluded.username, ''), Persona.username)},
+        ).returning(Persona.user_id, Persona.id)
+        return {tg_id: pid for tg_id, pid in (await session.execute(stmt)).all()}
+
+
+class SelectOrInsertPersonaWriter(PersonaWriter):
+    """Нет уникального индекса для ON CONFLICT (или другой диалект): выборка, затем вставка"""
+
+    async def get_ids(self, session, users: List[Tuple[int, Optional[str]]]) -> Dict[int, int]:
+        res = await session.execute(
+            select(Persona.user_id, Persona.id)
+            .where(Persona.user_id.in_([tg_id for tg_id, _ in users]))
+            .order_by(Persona.id.desc())
+        )
+        # ascending ids win: the oldest Персона of a user (duplicates exist without the index)
+        ids = {tg_id: pid for tg_id, pid in res.all()}
+        missing = [{'user_id': tg_id, 'username': (username or '')} for tg_id, username in users if tg_id not in ids]
+        if missing:
+            res = await session.execute(insert(Persona).values(missing).returning(Persona.user_id, Persona.id))
+            ids.update(res.all())
+        return ids
+
+
+# --- Анкета ---
+
+def _first_question_id(answers: dict) -> int:
+    """Подходящее значение id_q для старых структур: первый числовой qid среди ответов"""
+    for k in (answers or {}):
+        _mod, _, rest = str(k).partition(":")
+        qid_token = rest.split(":", 1)[0]
+        if qid_token.isdigit():
+            return int(qid_token)
+    return 0
+
+
+STATUS_IN_PROGRESS = 'in_progress'
+STATUS_COMPLETE = 'complete'
+# прохождение остановлено квотой до конца опроса
+STATUS_SCREENED_OUT = 'screened_out'
+
+
+class AnketaWriter(ABC):
+    """Находит Анкета персоны (очищая её ответы) или создаёт новую"""
+
+    def __init__(self, caps: SchemaCapabilities):
+        self.caps = caps
+        self.table = caps.anketa_table()
+
+    @property
+    @abstractmethod
+    def person_column(self):
+        """Столбец Анкета, в котором хранится Персона.id"""
+
+    def person_filter(self, pid: int):
+        return self.person_column == pid
+
+    @abstractmethod
+    def _values(self, pid: int, answers: dict) -> dict:
+        """Значения столбцов новой строки Анкета персоны (без статуса и снимка ответов)"""
+
+    def _order(self, descending: bool = False) -> list:
+        """
+        ORDER BY строк Анкета персоны, от старых к новым: created_at, затем id
+
+        Перенесённые анкеты сохраняют исходное время прохождения, поэтому импорт никогда
+        не становится последней анкетой.
+
+        Args:
+            descending: От новых к старым
+        """
+        ank_id = self.table.c.id
+        if 'created_at' not in self.caps.anketa_columns:
+            # some legacy schemas don't have created_at
+            return [ank_id.desc() if descending else ank_id]
+        created = self.table.c.created_at
+        if descending:
+            return [created.desc().nulls_last(), ank_id.desc()]
+        return [created.asc().nulls_first(), ank_id]
+
+    def _new_values(self, pid: int, answers: dict, status: Optional[str]) -> dict:
+        values = self._values(pid, answers)
+        if status is not None and self.caps.anketa_has_status:
+            values['status'] = status
+        if self.caps.anketa_has_snapshot:
+            values['answers'] = answers_snapshot(answers)
+        return values
+
+    async def insert(self, session, pid: int, answers: dict, status: Optional[str] = None) -> int:
+        """
+        Новая Анкета для `answers` (её снимок, если столбец есть, — `answers`)
+
+        Returns:
+            int: Анкета.id
+        """
+        values = self._new_values(pid, answers, status)
+        return (await session.execute(insert(self.table).values(**values).returning(self.table.c.id))).scalar_one()
+
+    async def latest(self, session, pid: int) -> Optional[SimpleNamespace]:
+        """Последняя Анкета персоны (id и, если столбец есть, статус) или None"""
+        cols = [self.table.c.id]
+        if self.caps.anketa_has_status:
+            cols.append(self.table.c.status)
+        row = (await session.execute(
+            select(*cols).where(self.person_filter(pid)).order_by(*self._order(descending=True)).limit(1)
+        )).first()
+        if row is None:
+            return None
+        return SimpleNamespace(id=row[0], status=row[1] if len(row) > 1 else None)
+
+    async def set_status(self, session, anketa_id: int, status: str) -> None:
+        if self.caps.anketa_has_status:
+            await session.execute(update(self.table).where(self.table.c.id == anketa_id).values(status=status))
+
+    async def set_snapshots(self, session, snapshots: Dict[int, Optional[dict]], status: Optional[str] = None) -> None:
+        """
+        Сохраняет снимки ответов одним executemany, вместе со статусом, если он задан
+
+        Args:
+            snapshots: {anketa_id: answers}; None — снимок неизвестен (NULL)
+            status: Статус анкет (если столбец есть)
+        """
+        if not snapshots or not self.caps.anketa_has_snapshot:
+            return
+        values = {'answers': bindparam('snapshot', type_=self.table.c.answers.type)}
+        if status is not None and self.caps.anketa_has_status:
+            values['status'] = status
+        await session.execute(
+            update(self.table).where(self.table.c.id == bindparam('ank_id')).values(**values),
+            [{'ank_id': ank_id, 'snapshot': answers_snapshot(answers) if answers is not None else None}
+             for ank_id, answers in snapshots.items()],
+        )
+
+    async def confirm_many(
+        self, session, known: Dict[int, int], status: Optional[str] = None
+    ) -> Dict[int, int]:
+        """
+        Часть закешированных пар {pid: anketa_id}, которая всё ещё есть в базе, — одним выражением
+
+        Со `status` (и столбцом) проверкой служит сам UPDATE статуса (... RETURNING).
+
+        Returns:
+            Dict[int, int]: Подтверждённые пары {pid: anketa_id}
+        """
+        key, ank_id = self.person_column, self.table.c.id
+        # legacy layout: the key is Анкета.id itself
+        cols = [ank_id] if key is ank_id else [ank_id, key]
+        where = (ank_id.in_(list(known.values())), key.in_(list(known)))
+        if status is not None and self.caps.anketa_has_status:
+            stmt = update(self.table).where(*where).values(status=status).returning(*cols)
+        else:
+            stmt = select(*cols).where(*where)
+        rows = (await session.execute(stmt)).all()
+        return {row[-1]: row[0] for row in rows if known.get(row[-1]) == row[0]}
+
+    async def get_or_create_many(
+        self, session, items: List[Tuple[int, dict]], status: Optional[str] = None,
+        known: Optional[Dict[int, int]] = None, clear_answers: bool = True,
+    ) -> Dict[int, Tuple[SimpleNamespace, bool]]:
+        """
+        Последняя Анкета каждой персоны (с очищенными ответами, если не clear_answers=False) или новая
+
+        Число выражений не зависит от len(items). Статус (если задан и столбец есть) и снимок
+        ответов каждого элемента записываются во все анкеты.
+
+        Args:
+            items: Пары (pid, answers)
+            status: Статус анкет
+            known: {pid: anketa_id}, уже проверенные confirm_many с тем же статусом, — без поиска
+            clear_answers: Удалять прежние строки Анкета_ответ переиспользуемых анкет
+
+        Returns:
+            Dict[int, Tuple[SimpleNamespace, bool]]: {pid: (анкета, создана ли)}
+        """
+        key = self.person_column
+        known = known or {}
+        pids = [pid for pid, _answers in items if pid not in known]
+        existing = {}
+        if pids:
+            if 'created_at' in self.caps.anketa_columns:
+                # the latest by creation time (see _order), not the highest id
+                ranked = select(
+                    key.label('pid'), self.table.c.id.label('ank_id'),
+                    func.row_number().over(partition_by=key, order_by=self._order(descending=True)).label('rn'),
+                ).where(key.in_(pids)).subquery()
+                res = await session.execute(select(ranked.c.pid, ranked.c.ank_id).where(ranked.c.rn == 1))
+            else:
+                # some legacy schemas don't have created_at
+                res = await session.execute(
+                    select(key, func.max(self.table.c.id)).where(key.in_(pids)).group_by(key)
+                )
+            existing = {pid: ank_id for pid, ank_id in res.all()}
+            # with the snapshot column the status is set by the snapshot update below
+            if existing and status is not None and self.caps.anketa_has_status and not self.caps.anketa_has_snapshot:
+                await session.execute(
+                    update(self.table).where(self.table.c.id.in_(list(existing.values()))).values(status=status)
+                )
+        existing.update((pid, known[pid]) for pid, _answers in items if pid in known)
+        result: Dict[int, Tuple[SimpleNamespace, bool]] = {}
+        if existing:
+            ids = list(existing.values())
+            if clear_answers:
+                logger.info("DBService: reusing anketa ids=%s - deleting previous answers", ids)
+                await session.execute(delete(AnketaAnswer).where(AnketaAnswer.anketa_id.in_(ids)))
+            await self.set_snapshots(
+                session, {existing[pid]: answers for pid, answers in items if pid in existing}, status=status
+            )
+            for pid, ank_id in existing.items():
+                result[pid] = (SimpleNamespace(id=ank_id), False)
+        new_rows = []
+        for pid, answers in items:
+            if pid in existing:
+                continue
+            new_rows.append(self._new_values(pid, answers, status))
+        if new_rows:
+            if key is self.table.c.id:
+                # legacy layout: the new Анкета.id is the Персона.id itself
+                res = await session.execute(insert(self.table).values(new_rows).returning(key))
+                created = [(ank_id, ank_id) for (ank_id,) in res.all()]
+            else:
+                res = await session.execute(insert(self.table).values(new_rows).returning(key, self.table.c.id))
+                created = res.all()
+            for pid, ank_id in created:
+                logger.info("DBService: created new Анкета id=%s for person_id=%s", ank_id, pid)
+                result[pid] = (SimpleNamespace(id=ank_id), True)
+        return result
+
+    async def create_many(
+        self, session, items: List[Tuple[int, dict, datetime.datetime]], status: Optional[str] = None
+    ) -> List[int]:
+        """
+        Новые Анкета для импорта прошлых прохождений: последняя анкета персоны не переиспользуется,
+        created_at — время прохождения
+
+        Args:
+            items: Тройки (pid, answers, created_at)
+            status: Статус анкет
+
+        Returns:
+            List[int]: Анкета.id в порядке items
+        """
+        if not self.caps.anketa_has_person_id:
+            # legacy layout: one Анкета per person (Анкета.id == Персона.id)
+            raise RuntimeError("several Анкета rows per person need Анкета.person_id")
+        rows = []
+        for pid, answers, created_at in items:
+            values = self._new_values(pid, answers, status)
+            if 'created_at' in self.caps.anketa_columns:
+                values['created_at'] = created_at
+            rows.append(values)
+        if not rows:
+            return []
+        res = await session.execute(insert(self.table).returning(self.table.c.id, sort_by_parameter_order=True), rows)
+        return list(res.scalars().all())
+
+    async def get_or_create(
+        self, session, pid: int, answers: dict, status: Optional[str] = None
+    ) -> Tuple[SimpleNamespace, bool]:
+        """(анкета, создана ли) для одной персоны — см. get_or_create_many"""
+        return (await self.get_or_create_many(session, [(pid, answers)], status))[pid]
+
+    async def find(self, session, pid: int) -> List[dict]:
+        """Все строки Анкета персоны от старых к новым (для диагностики администратором), со снимком ответов, если он есть"""
+        res = await session.execute(select(self.table).where(self.person_filter(pid)).order_by(*self._order()))
+        return [dict(r._mapping) for r in res.fetchall()]
+
+
+class PersonIdAnketaWriter(AnketaWriter):
+    """Текущая структура: Анкета.person_id -> Персона.id"""
+
+    @property
+    def person_column(self):
+        return self.table.c.person_id
+
+    def _values(self, pid: int, answers: dict) -> dict:
+        values = {'person_id': pid}
+        if self.caps.anketa_has_id_q:
+            # same as the ORM default of Anketa.id_q
+            values['id_q'] = 0
+        return values
+
+
+class LegacyIdAnketaWriter(AnketaWriter):
+    """Очень старые структуры без person_id: Анкета.id == Персона.id (возможно, с id_q)"""
+
+    @property
+    def person_column(self):
+        return self.table.c.id
+
+    def _values(self, pid: int, answers: dict) -> dict:
+        values = {'id': pid}
+        if self.caps.anketa_has_id_q:
+            values['id_q'] = _first_question_id(answers)
+        return values
+
+
+# --- Анкета_ответ ---
+
+ANSWER_COLUMNS = ('anketa_id', 'question_id', 'answer_id', 'answer_text')
+
+
+class AnswerWriter(ABC):
+    """Пишет подготовленные строки Анкета_ответ (словари по ANSWER_COLUMNS и answer_key, если
+    столбец есть) одним выражением"""
+
+    @abstractmethod
+    async def write(self, session, rows: List[dict]) -> None:
+        """Вставляет `rows` в транзакции сессии"""
+
+
+class ExecutemanyAnswerWriter(AnswerWriter):
+    """Core INSERT со списком параметров: один executemany без unit of work ORM"""
+
+    async def write(self, session, rows: List[dict]) -> None:
+        if rows:
+            await session.execute(insert(AnketaAnswer.__table__), rows)
+
+
+class CopyAnswerWriter(AnswerWriter):
+    """COPY asyncpg (copy_records_to_table) в соединении и транзакции самой сессии"""
+
+    def __init__(self, schema: Optional[str] = None):
+        self.schema = schema
+
+    async def write(self, session, rows: List[dict]) -> None:
+        if not rows:
+            return
+        columns = list(rows[0])
+        conn = await session.connection()
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            AnketaAnswer.__tablename__,
+            records=[tuple(row[c] for c in columns) for row in rows],
+            columns=columns,
+            schema_name=self.schema,
+        )
+
+
+def select_strategies(
+    caps: SchemaCapabilities, schema: Optional[str] = None
+) -> Tuple[PersonaWriter, AnketaWriter, AnswerWriter]:
+    """
+    Выбирает стратегии записи для найденной структуры
+
+    Args:
+        caps: Возможности схемы
+        schema: Схема арендатора (для COPY)
+
+    Returns:
+        Tuple[PersonaWriter, AnketaWriter, AnswerWriter]: Стратегии Персона, Анкета и Анкета_ответ
+    """
+    if caps.persona_user_id_unique and caps.dialect in ('postgresql', 'sqlite'):
+        persona_writer = UpsertPersonaWriter(caps.dialect)
+    else:
+        persona_writer = SelectOrInsertPersonaWriter()
+    if caps.anketa_has_person_id:
+        anketa_writer = PersonIdAnketaWriter(caps)
+    else:
+        anketa_writer = LegacyIdAnketaWriter(caps)
+    if caps.dialect == 'postgresql' and caps.driver == 'asyncpg':
+        answer_writer = CopyAnswerWriter(schema)
+    else:
+        answer_writer = ExecutemanyAnswerWriter()
+    logger.info(
+        "DBService strategies: %s, %s, %s",
+        type(persona_writer).__name__, type(anketa_writer).__name__, type(answer_writer).__name__,
+    )
+    return persona_writer, anketa_writer, answer_writer
@@ -3,18 +3,28 @@ from aiogram.types import Message, FSInputFile
 from aiogram.filters import Command
 import json
 import tempfile
+from datetime import datetime
 from pathlib import Path
 import os
 import html
 
-from app.database.models import async_session, Persona, Anketa, AnketaAnswer
+from app.database.models import (
+    ANSWER_VIEW, async_session, engine, read_engine, get_read_session_maker, Persona, Anketa, AnketaAnswer,
+)
+from app.database.engine import pool_stats
+from app.database.reporting import answers_from_rows, fetch_rows
+from app.services.db_service import DBService
+from app.services.quota_service import QuotaService
+from app.services.journey_service import JourneyService
+from app.services.search_service import SearchService
+from app.tenants import Tenant
 from sqlalchemy import select, text
 
 router = Router()
 
 
-def _get_admin_ids():
-    """Read ADMIN_IDS from env (comma-separated). Returns set of ints."""
+def _get_admin_ids(tenant: Tenant = None):
+    """Read ADMIN_IDS from env (comma-separated) plus tenant admins. Returns set of ints."""
     raw = os.getenv('ADMIN_IDS', '')
     ids = set()
     for part in [p.strip() for p in raw.split(',') if p.strip()]:
@@ -22,12 +32,40 @@ def _get_admin_ids():
             ids.add(int(part))
         except Exception:
             continue
+    if tenant is not None:
+        ids.update(tenant.admin_ids)
     return ids
 
 
+def _session_maker(db_service: DBService = None):
+    """Session factory of the bot's tenant schema (falls back to the default schema)."""
+    return db_service.session_maker if db_service is not None else async_session
+
+
+def _read_session_maker(db_service: DBService = None):
+    """Read-only session factory (separate pool, replica if configured) of the bot's tenant schema."""
+    return get_read_session_maker(db_service.schema if db_service is not None else None)
+
+
+# Telegram rejects longer messages (4096 characters); leave room for the cut note
+MESSAGE_LIMIT = 4000
+
+
+def _fit_message(lines) -> str:
+    """Join whole lines up to MESSAGE_LIMIT (never cuts an escaped line in half)."""
+    out, size = [], 0
+    for i, line in enumerate(lines):
+        if size + len(line) + 1 > MESSAGE_LIMIT:
+            out.append(f"… ещё строк: {len(lines) - i}")
+            break
+        out.append(line)
+        size += len(line) + 1
+    return '\n'.join(out)
+
+
 @router.message(Command('export_data'))
-async def cmd_export_data(message: Message):
-    admin_ids = _get_admin_ids()
+async def cmd_export_data(message: Message, db_service: DBService = None, tenant: Tenant = None):
+    admin_ids = _get_admin_ids(tenant)
     if not admin_ids:
         await message.reply("Export disabled: ADMIN_IDS not configured.")
         return
@@ -36,31 +74,79 @@ async def cmd_export_data(message: Message):
         await message.reply("У вас нет прав для этой команды.")
         return
 
+    # /export_data 2026-10 — one survey wave: Анкета rows created that month and their answers
+    caps = db_service.capabilities if db_service is not None else None
+    parts = (message.text or '').split()
+    wave = None
+    if len(parts) > 1:
+        try:
+            wave = datetime.strptime(parts[1], '%Y-%m')
+        except ValueError:
+            await message.reply("Использование: /export_data [ГГГГ-ММ]")
+            return
+        if caps is None or 'created_at' not in caps.anketa_columns:
+            await message.reply("Выгрузка по месяцу недоступна: нет столбца Анкета.created_at")
+            return
+
     await message.reply("Готовлю экспорт данных — подождите...")
 
     dump = {}
-    async with async_session() as session:
+    if wave is not None:
+        dump['wave'] = parts[1]
+    truncated = []
+    # reporting pool: the export never takes connections from respondents' saves;
+    # every table is capped at READ_ROW_LIMIT rows and READ_STATEMENT_TIMEOUT_MS
+    async with _read_session_maker(db_service)() as session:
         try:
-            res = await session.execute(select(Persona))
-            dump['persona'] = [{"id": p.id, "user_id": p.user_id, "username": p.username} for p in res.scalars().all()]
+            rows, more = await fetch_rows(session, select(Persona.id, Persona.user_id, Persona.username))
+            dump['persona'] = rows
+            if more:
+                truncated.append('persona')
         except Exception as e:
             dump['persona_error'] = repr(e)
 
+        # detected tables (not raw SQL) so that the tenant's schema_translate_map applies
+        anketa = caps.anketa_table() if caps is not None else None
+        in_wave = []
+        if wave is not None:
+            wave_end = datetime(wave.year + wave.month // 12, wave.month % 12 + 1, 1)
+            in_wave = [anketa.c.created_at >= wave, anketa.c.created_at < wave_end]
         try:
-            res = await session.execute(text('SELECT * FROM "Анкета"'))
-            dump['anketa'] = [dict(r._mapping) for r in res.fetchall()]
+            stmt = select(anketa).where(*in_wave).order_by(anketa.c.id) if anketa is not None else text('SELECT * FROM "Анкета"')
+            rows, more = await fetch_rows(session, stmt)
+            dump['anketa'] = rows
+            if more:
+                truncated.append('anketa')
         except Exception as e:
             dump['anketa_error'] = repr(e)
 
+        # one row per respondent: Анкета.answers already holds the answer set, so only anketas
+        # without the snapshot (saved before the column existed) are exported as Анкета_ответ rows.
+        # The view restores answer_text of compactly stored rows (ANSWER_STORAGE=compact)
         try:
-            res = await session.execute(text('SELECT * FROM "Анкета_ответ"'))
-            dump['anketa_answers'] = [dict(r._mapping) for r in res.fetchall()]
+            if caps is not None:
+                source = caps.answer_table(ANSWER_VIEW if caps.answer_view else AnketaAnswer.__tablename__)
+                stmt = select(source)
+                conditions = in_wave + ([anketa.c.answers.is_(None)] if caps.anketa_has_snapshot else [])
+                if conditions:
+                    stmt = stmt.where(source.c.anketa_id.in_(select(anketa.c.id).where(*conditions)))
+                if wave is not None and 'created_at' in caps.answer_columns:
+                    # answers are never older than their Анкета: lets Postgres skip the partitions
+                    # of earlier months (ANSWER_PARTITIONS)
+                    stmt = stmt.where(source.c.created_at >= wave)
+            else:
+                stmt = text(f'SELECT * FROM "{AnketaAnswer.__tablename__}"')
+            rows, more = await fetch_rows(session, stmt)
+            dump['anketa_answers'] = rows
+            if more:
+                truncated.append('anketa_answers')
         except Exception as e:
             dump['anketa_answers_error'] = repr(e)
+    if truncated:
+        dump['truncated'] = truncated
 
     # Write to temp file and send
     tmp_dir = Path(tempfile.gettempdir())
-    from datetime import datetime
     # human-readable timestamp; colons are not allowed in Windows filenames, replace with hyphens
     ts_display = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
     ts_file = datetime.utcnow().strftime('%Y-%m-%d %H-%M-%S')
@@ -81,9 +167,9 @@ async def cmd_export_data(message: Message):
 
 
 @router.message(Command('check_user'))
-async def cmd_check_user(message: Message):
+async def cmd_check_user(message: Message, db_service: DBService = None, tenant: Tenant = None):
     """Admin helper: /check_user <tg_id> — show Persona and Anketa rows for the tg_id"""
-    admin_ids = _get_admin_ids()
+    admin_ids = _get_admin_ids(tenant)
     if not admin_ids or message.from_user is None or message.from_user.id not in admin_ids:
         await message.reply("Нет прав")
         return
@@ -99,10 +185,20 @@ async def cmd_check_user(message: Message):
         await message.reply("tg_id должен быть целым числом")
         return
 
-    async with async_session() as session:
+    async with _read_session_maker(db_service)() as session:
         try:
-            res = await session.execute(select(Persona).where(Persona.user_id == tg_id))
-            persona = res.scalar_one_or_none()
+            persona = None
+            ident = db_service.identity_cache.get(tg_id) if db_service is not None else None
+            if ident is not None:
+                # primary key lookup; the cached id may be stale (TTL), then search by user_id
+                persona = await session.get(Persona, ident.persona_id)
+                if persona is not None and persona.user_id != tg_id:
+                    persona = None
+            if persona is None:
+                res = await session.execute(select(Persona).where(Persona.user_id == tg_id))
+                persona = res.scalar_one_or_none()
+                if persona is not None and db_service is not None:
+                    db_service.identity_cache.put(tg_id, persona.id, persona.username)
         except Exception as e:
             await message.reply(f"Ошибка при поиске Персона: {html.escape(str(e))}")
             return
@@ -111,42 +207,158 @@ async def cmd_check_user(message: Message):
             await message.reply(f"Персона с tg_id={tg_id} не найдена в таблице Персона")
             return
 
-        # find анкеты for this persona id ( Анкета.id may match persona.id in legacy schema )
+        # Анкета is linked by person_id or, in legacy layouts, by Анкета.id == Персона.id —
+        # the layout was detected at startup (DBService.detect_schema)
         try:
-            pid = getattr(persona, 'id', None)
-            anketas = []
-            # always try by id
-            try:
-                res = await session.execute(text('SELECT * FROM "Анкета" WHERE "id" = :pid'), {'pid': pid})
-                anketas.extend([dict(r._mapping) for r in res.fetchall()])
-            except Exception:
-                # ignore errors for id-based query (shouldn't normally happen)
-                pass
-
-            # try by person_id if that column exists (may raise if column missing) — ignore if not present
-            try:
-                res = await session.execute(text('SELECT * FROM "Анкета" WHERE "person_id" = :pid'), {'pid': pid})
-                anketas.extend([dict(r._mapping) for r in res.fetchall()])
-            except Exception:
-                # column may not exist in legacy schema; that's fine — we already have id-based results
-                pass
-
-            # dedupe by anketa id (in case both queries returned same row)
-            seen = set()
-            deduped = []
-            for a in anketas:
-                aid = a.get('id')
-                if aid in seen:
-                    continue
-                seen.add(aid)
-                deduped.append(a)
-            anketas = deduped
+            if db_service is None:
+                db_service = DBService(_session_maker(db_service))
+            if db_service.anketa_writer is None:
+                await db_service.detect_schema()
+            anketas = await db_service.anketa_writer.find(session, persona.id)
         except Exception as e:
             await message.reply(f"Ошибка при чтении Анкета: {html.escape(str(e))}")
             return
 
+        snapshots = [a.pop('answers', None) for a in anketas]
         reply_lines = [f"Персона id={persona.id} user_id={persona.user_id} username={persona.username}", f"Анкета найдено: {len(anketas)}"]
         for a in anketas:
             reply_lines.append(str(a))
 
-        await message.reply('\n'.join(reply_lines[:50]))
+        if anketas:
+            # answers of the latest Анкета: its snapshot, or Анкета_ответ rows if it has none
+            latest, answers = anketas[-1], snapshots[-1]
+            if answers is None:
+                caps = db_service.capabilities
+                source = caps.answer_table(ANSWER_VIEW if caps.answer_view else AnketaAnswer.__tablename__)
+                try:
+                    rows, _more = await fetch_rows(
+                        session, select(source).where(source.c.anketa_id == latest['id']).order_by(source.c.id)
+                    )
+                    answers = answers_from_rows(rows)
+                except Exception as e:
+                    await message.reply(f"Ошибка при чтении Анкета_ответ: {html.escape(str(e))}")
+                    return
+            reply_lines.append(f"Ответы анкеты {latest['id']} ({len(answers)}):")
+            for key, value in answers.items():
+                if isinstance(value, list):
+                    value = '; '.join(str(v) for v in value)
+                reply_lines.append(f"{html.escape(str(key))}: {html.escape(str(value))}")
+
+        await message.reply(_fit_message(reply_lines))
+
+
+@router.message(Command('quotas'))
+async def cmd_quotas(message: Message, quota_service: QuotaService = None, tenant: Tenant = None):
+    """Admin helper: /quotas — filled/limit per quota cell (in-memory counters)"""
+    admin_ids = _get_admin_ids(tenant)
+    if not admin_ids or message.from_user is None or message.from_user.id not in admin_ids:
+        await message.reply("Нет прав")
+        return
+
+    if quota_service is None:
+        await message.reply("Квоты не настроены (QUOTAS_FILE).")
+        return
+
+    lines = ["Квоты (заполнено/лимит):"]
+    if quota_service.is_closed():
+        # before the cells: a long list is cut at the message limit
+        lines.append("Набор закрыт: новые прохождения не начинаются.")
+    for dim, cell, count, limit, pending in quota_service.snapshot():
+        mark = " — заполнено" if limit is not None and count >= limit else ""
+        unflushed = f" (не сохранено: {pending})" if pending else ""
+        lines.append(f"{html.escape(dim)} · {html.escape(cell)}: {count}/{limit if limit is not None else '∞'}{mark}{unflushed}")
+    await message.reply(_fit_message(lines))
+
+
+@router.message(Command('funnel'))
+async def cmd_funnel(message: Message, journey_service: JourneyService = None, tenant: Tenant = None):
+    """Admin helper: /funnel — per-step reach and median answer time from the journey log"""
+    admin_ids = _get_admin_ids(tenant)
+    if not admin_ids or message.from_user is None or message.from_user.id not in admin_ids:
+        await message.reply("Нет прав")
+        return
+
+    if journey_service is None:
+        await message.reply("Журнал прохождения выключен (JOURNEY_ENABLED).")
+        return
+
+    starts = journey_service.starts
+    lines = [f"Воронка: стартов {starts}"]
+    if journey_service.dropped:
+        # before the steps: a long funnel is cut at the message limit
+        lines.append(f"Потеряно событий при переполнении буфера: {journey_service.dropped}")
+    for step, reach, median in journey_service.funnel():
+        share = f" ({reach * 100 // starts}%)" if starts else ""
+        dwell = f", медиана {median:.1f} с" if median is not None else ""
+        lines.append(f"{html.escape(step)}: {reach}{share}{dwell}")
+    await message.reply(_fit_message(lines))
+
+
+@router.message(Command('dbstats'))
+async def cmd_dbstats(message: Message, db_service: DBService = None, tenant: Tenant = None):
+    """Admin helper: /dbstats — connection pool occupancy, checkout wait times and the identity cache"""
+    admin_ids = _get_admin_ids(tenant)
+    if not admin_ids or message.from_user is None or message.from_user.id not in admin_ids:
+        await message.reply("Нет прав")
+        return
+
+    stats = pool_stats(engine)
+    lines = [f"Пул соединений: {stats['pool']} ({engine.dialect.name})"]
+    if 'size' in stats:
+        lines.append(f"Размер {stats['size']}, занято {stats['checked_out']}, свободно {stats['idle']}, overflow {stats['overflow']}")
+    if 'checkouts' in stats:
+        lines.append(
+            f"Выдач соединения: {stats['checkouts']}; ожидание среднее {stats['avg_wait_ms']:.1f} мс, "
+            f"p95 {stats['p95_wait_ms']:.1f} мс, максимум {stats['max_wait_ms']:.1f} мс"
+        )
+        if stats['timeouts']:
+            lines.append(f"Таймаутов ожидания пула: {stats['timeouts']}")
+    if read_engine is not engine:
+        read = pool_stats(read_engine)
+        if 'size' in read:
+            lines.append(f"Пул чтения: размер {read['size']}, занято {read['checked_out']}, свободно {read['idle']}")
+    if db_service is not None:
+        ident = db_service.identity_cache.stats()
+        lines.append(
+            f"Кеш идентификаторов: {ident['size']}/{ident['max_size']}, попаданий {ident['hit_ratio']:.0%} "
+            f"({ident['hits']} из {ident['hits'] + ident['misses']}), вытеснено {ident['evictions']}"
+        )
+    await message.reply('\n'.join(lines))
+
+
+SEARCH_PAGE_SIZE = 10
+
+
+@router.message(Command('search'))
+async def cmd_search(message: Message, search_service: SearchService = None, tenant: Tenant = None):
+    """Admin helper: /search <terms> [#page] — ranked search over free-text "other" answers"""
+    admin_ids = _get_admin_ids(tenant)
+    if not admin_ids or message.from_user is None or message.from_user.id not in admin_ids:
+        await message.reply("Нет прав")
+        return
+
+    parts = (message.text or '').split()[1:]
+    page = 1
+    if parts and parts[-1].startswith('#') and parts[-1][1:].isdigit():
+        page = max(int(parts.pop()[1:]), 1)
+    query = ' '.join(parts)
+    if not query:
+        await message.reply("Использование: /search <слова> [#страница]")
+        return
+    if search_service is None:
+        await message.reply("Поиск недоступен.")
+        return
+
+    total, hits = search_service.search(query, page=page, page_size=SEARCH_PAGE_SIZE)
+    if not hits:
+        await message.reply(f"Ничего не найдено по запросу «{html.escape(query)}»" if total == 0 else "Страница пуста.")
+        return
+
+    pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    lines = [f"Найдено: {total} (стр. {page}/{pages})"]
+    for i, hit in enumerate(hits, start=(page - 1) * SEARCH_PAGE_SIZE + 1):
+        snippet = hit.text if len(hit.text) <= 300 else hit.text[:297] + '...'
+        lines.append(f"{i}. <b>{html.escape(hit.question_key)}</b> · tg_id={hit.user_id} · анкета {hit.anketa_id}\n{html.escape(snippet)}")
+    if page < pages:
+        lines.append(f"Дальше: /search {html.escape(query)} #{page + 1}")
+    await message.reply('\n\n'.join(lines))
@@ -10,7 +10,10 @@ from app.config import Config
 from app.services.survey_service import SurveyService
 from app.ui.keyboards import KeyboardFactory
 from app.ui.message_builder import MessageBuilder
-from app.handlers.question import ask_question
+from app.services.quota_service import QuotaService
+from app.services.journey_service import JourneyService
+from app.services.answer_buffer import AnswerBuffer
+from app.handlers.question import ask_question, QUOTA_FULL_TEXT
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from aiogram import F
 
@@ -38,8 +41,20 @@ async def cmd_start(message: Message, state: FSMContext,
 async def cb_start_survey(callback: CallbackQuery, state: FSMContext,
                           survey_service: SurveyService = None,
                           keyboard_factory: KeyboardFactory = None,
-                          message_builder: MessageBuilder = None):
+                          message_builder: MessageBuilder = None,
+                          quota_service: QuotaService = None,
+                          journey_service: JourneyService = None,
+                          answer_buffer: AnswerBuffer = None):
     """Callback для запуска опроса из приветственного сообщения"""
+    # Все ячейки квоты заполнены — новые прохождения не начинаем
+    if quota_service is not None and quota_service.is_closed():
+        try:
+            await callback.answer()
+        except Exception:
+            pass
+        await callback.message.answer(QUOTA_FULL_TEXT)
+        return
+
     # Инициализируем состояние опроса и отправляем первый вопрос
     # Сначала очистим предыдущее состояние, чтобы не осталось флагов вроде processing_answer
     try:
@@ -61,7 +76,11 @@ async def cb_start_survey(callback: CallbackQuery, state: FSMContext,
         await callback.message.delete()
     except Exception:
         pass
-    await ask_question(callback.message, state, survey_service, keyboard_factory, message_builder)
+    if journey_service is not None:
+        journey_service.start(callback.from_user.id)
+    if answer_buffer is not None:
+        answer_buffer.begin(callback.from_user.id)
+    await ask_question(callback.message, state, survey_service, keyboard_factory, message_builder, journey_service)
 
 
 
@@ -102,10 +121,17 @@ async def cmd_survey(message: Message, state: FSMContext,
 async def cmd_newtry(message: Message, state: FSMContext,
                      survey_service: SurveyService = None,
                      keyboard_factory: KeyboardFactory = None,
-                     message_builder: MessageBuilder = None):
+                     message_builder: MessageBuilder = None,
+                     quota_service: QuotaService = None,
+                     journey_service: JourneyService = None,
+                     answer_buffer: AnswerBuffer = None):
     """
     /newtry — начать новый проход опроса: удалить предыдущие вопросы (если были) и сбросить ответы.
     """
+    if quota_service is not None and quota_service.is_closed():
+        await message.answer(QUOTA_FULL_TEXT)
+        return
+
     # Сообщим пользователю, что начинаем новую попытку
     try:
         await message.answer("Начинаю новую попытку прохождения опроса...")
@@ -147,8 +173,12 @@ async def cmd_newtry(message: Message, state: FSMContext,
     })
 
     # Отправляем первый вопрос нового прохождения и уведомляем пользователя при ошибке
+    if journey_service is not None and message.from_user is not None:
+        journey_service.start(message.from_user.id)
+    if answer_buffer is not None and message.from_user is not None:
+        answer_buffer.begin(message.from_user.id)
     try:
-        await ask_question(message, state, survey_service, keyboard_factory, message_builder)
+        await ask_question(message, state, survey_service, keyboard_factory, message_builder, journey_service)
     except Exception:
         try:
             await message.answer("Не удалось начать новую попытку — попробуйте ещё раз или напишите /start")
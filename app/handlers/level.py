@@ -10,6 +10,9 @@ from app.data.encoder import get_callback_data
 from app.services.survey_service import SurveyService
 from app.ui.keyboards import KeyboardFactory
 from app.ui.message_builder import MessageBuilder
+from app.services.db_service import DBService
+from app.services.journey_service import JourneyService
+from app.services.answer_buffer import AnswerBuffer
 from app.handlers.question import handle_next_question, ask_question
 
 logger = logging.getLogger(__name__)
@@ -24,7 +27,10 @@ async def handle_level_option_select(
     state: FSMContext, 
     survey_service: SurveyService = None,
     keyboard_factory: KeyboardFactory = None,
-    message_builder: MessageBuilder = None
+    message_builder: MessageBuilder = None,
+    db_service: DBService = None,
+    journey_service: JourneyService = None,
+    answer_buffer: AnswerBuffer = None
 ):
     """
     Обработчик выбора варианта для уровня вопроса
@@ -81,19 +87,23 @@ async def handle_level_option_select(
             answers_key = f"{module}:{qid}:level_{level_index}"
             answers[answers_key] = chosen_text
             await state.update_data(answers=answers)
+            if journey_service is not None:
+                journey_service.answered(callback.from_user.id, answers_key)
 
             # Переходим на следующий уровень или к следующему вопросу
             next_level = level_index + 1
             next_level_obj = survey_service.get_level(module, qid, next_level)
             if next_level_obj:
+                if answer_buffer is not None:
+                    answer_buffer.record(callback.from_user.id, answers, username=callback.from_user.username)
                 await state.update_data(current_level=next_level)
-                await ask_question(callback.message, state, survey_service, keyboard_factory, message_builder)
+                await ask_question(callback.message, state, survey_service, keyboard_factory, message_builder, journey_service)
                 await callback.answer()
                 return
             else:
                 await state.update_data(current_level=0)
                 await callback.answer()
-                await handle_next_question(callback, state, survey_service, keyboard_factory, message_builder)
+                await handle_next_question(callback, state, survey_service, keyboard_factory, message_builder, db_service, journey_service, answer_buffer)
         except Exception as e:
             logger.exception("handle_level_option_select error: %s", e)
             await callback.answer("Ошибка обработки ответа")
\ No newline at end of file
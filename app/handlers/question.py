@@ -10,6 +10,9 @@ from app.states.survey_states import SurveyStates
 from app.data.encoder import get_callback_data
 from app.services.survey_service import SurveyService
 from app.services.db_service import DBService
+from app.services.quota_service import QuotaService
+from app.services.journey_service import JourneyService
+from app.services.answer_buffer import AnswerBuffer
 from app.ui.keyboards import KeyboardFactory
 from app.ui.message_builder import MessageBuilder
 
@@ -20,6 +23,8 @@ question_lock = Lock()
 # Temporary diagnostic flag: when True, perform synchronous DB save at survey finish
 # so exceptions surface in the main handler and appear in logs. Turn off after debugging.
 TEMP_SYNC_SAVE = True
+# Сообщение респонденту, чья ячейка квоты (возраст/пол) уже заполнена
+QUOTA_FULL_TEXT = "Спасибо за интерес к проекту! Набор участников вашей группы уже завершён."
 
 
 async def ask_question(
@@ -27,7 +32,8 @@ async def ask_question(
     state: FSMContext,
     survey_service: SurveyService = None,
     keyboard_factory: KeyboardFactory = None,
-    message_builder: MessageBuilder = None
+    message_builder: MessageBuilder = None,
+    journey_service: JourneyService = None
 ):
     """Отправляет текущий вопрос пользователю."""
     logger.debug("ask_question: start; user=%s", message.from_user.id if message.from_user else None)
@@ -51,6 +57,11 @@ async def ask_question(
         logger.error("ask_question: question not found: %s %s", module, qid)
         return
 
+    # Журнал прохождения: шаг в формате ключа ответа (в личном чате chat.id == id пользователя)
+    if journey_service is not None:
+        step = f"{module}:{qid}:level_{current_level}" if getattr(question, "levels", None) else f"{module}:{qid}"
+        journey_service.shown(message.chat.id, step)
+
     # Уровни внутри вопроса
     if getattr(question, "levels", None):
         level = survey_service.get_level(module, qid, current_level)
@@ -138,16 +149,164 @@ async def ask_question(
     logger.debug("ask_question: sent question %s:%s", module, qid)
 
 
+async def _save_results(db_service: DBService, answer_buffer: AnswerBuffer, user_id: int, results: dict, username: str):
+    """Итоговая запись опроса: статус complete для инкрементального режима, иначе сохранение целиком"""
+    if answer_buffer is not None:
+        return await answer_buffer.finish(user_id, results, username=username)
+    return await db_service.save_to_anketa_schema(user_id, results, username=username)
+
+
+async def _finish_survey(message_or_callback, results: dict, db_service: DBService = None,
+                         answer_buffer: AnswerBuffer = None):
+    """Запись результатов опроса и благодарность респонденту (вызывается после question_lock)"""
+    # Попробуем сохранить результаты в БД в фоне (если инжектирован db_service).
+    # Сохранение в фоне предотвращает блокировку обработчика и лаг в клиенте.
+    try:
+        user_info = None
+        if isinstance(message_or_callback, CallbackQuery):
+            user_info = getattr(message_or_callback.from_user, 'id', None)
+        else:
+            user_info = getattr(message_or_callback.from_user, 'id', None)
+        # Diagnostic: log db_service value to help debug missing saves
+        try:
+            logger.info("_finish_survey: db_service=%s for user=%s", repr(db_service), user_info)
+        except Exception:
+            logger.debug("_finish_survey: could not repr db_service for user=%s", user_info)
+
+        # If db_service is missing, notify admins (if configured) so we can detect injection issues;
+        # otherwise, schedule background save as before.
+        if db_service is None:
+            try:
+                raw = os.getenv('ADMIN_IDS', '')
+                admin_ids = [int(p.strip()) for p in raw.split(',') if p.strip().isdigit()]
+            except Exception:
+                admin_ids = []
+            try:
+                bot_obj = None
+                try:
+                    bot_obj = message_or_callback.bot
+                except Exception:
+                    bot_obj = None
+                if bot_obj and admin_ids:
+                    for aid in admin_ids:
+                        try:
+                            await bot_obj.send_message(aid, f"Diagnostic: db_service is None when saving survey for user {user_info}")
+                        except Exception:
+                            logger.exception("_finish_survey: failed to notify admin %s", aid)
+                else:
+                    logger.info("_finish_survey: cannot notify admins (no bot or no ADMIN_IDS configured)")
+            except Exception:
+                logger.exception("_finish_survey: admin notification failed")
+        elif user_info is not None:
+            try:
+                # schedule background save to the project's Russian schema; don't await to avoid blocking
+                username = None
+                try:
+                    username = getattr(message_or_callback.from_user, 'username', None)
+                except Exception:
+                    username = None
+
+                # Provide additional diagnostic logs about db_service and results
+                try:
+                    logger.info("_finish_survey: db_service_id=%s db_service_type=%s for user=%s",
+                                id(db_service) if db_service is not None else None,
+                                type(db_service).__name__ if db_service is not None else None,
+                                user_info)
+                except Exception:
+                    logger.debug("_finish_survey: could not log db_service id/type for user=%s", user_info)
+
+                # show a compact dump of results for debugging (truncated)
+                try:
+                    sample = dict(list(results.items())[:10])
+                    logger.debug("_finish_survey: results sample for user=%s: %s", user_info, repr(sample)[:1000])
+                except Exception:
+                    logger.debug("_finish_survey: could not produce results sample for user=%s", user_info)
+
+                if TEMP_SYNC_SAVE:
+                    # Synchronous save for diagnostics: await the save so exceptions are visible
+                    logger.info("_finish_survey: TEMP_SYNC_SAVE enabled - performing synchronous save for user=%s", user_info)
+                    try:
+                        ank = await _save_results(db_service, answer_buffer, user_info, results, username or '')
+                        logger.info("_finish_survey: sync save succeeded for user=%s anketa_id=%s rows_saved=%s",
+                                    user_info, getattr(ank, 'id', None), getattr(ank, 'rows_saved', 'unknown'))
+                    except Exception:
+                        logger.exception("_finish_survey: sync save failed for user=%s", user_info)
+                else:
+                    async def _bg_save():
+                        logger.info("_finish_survey: background save started for user=%s", user_info)
+                        try:
+                            ank = await _save_results(db_service, answer_buffer, user_info, results, username or '')
+                            logger.info("_finish_survey: background save succeeded for user=%s anketa_id=%s", user_info, getattr(ank, 'id', None))
+                        except Exception:
+                            logger.exception("_finish_survey: background save failed for user=%s", user_info)
+
+                    logger.info("_finish_survey: scheduling background save task for user=%s", user_info)
+                    task = asyncio.create_task(_bg_save())
+                    logger.info("_finish_survey: scheduled background save task=%s for user=%s", repr(task), user_info)
+                    # attach a done callback to log unhandled exceptions explicitly
+                    def _on_done(t):
+                        try:
+                            exc = t.exception()
+                            if exc:
+                                logger.exception("_finish_survey: background save task raised", exc_info=exc)
+                        except asyncio.CancelledError:
+                            logger.info("_finish_survey: background save task cancelled for user=%s", user_info)
+                        except Exception:
+                            # exception already logged in task, ignore
+                            pass
+
+                    try:
+                        task.add_done_callback(_on_done)
+                    except Exception:
+                        logger.debug("_finish_survey: could not add done callback to save task for user=%s", user_info)
+            except Exception:
+                logger.exception("_finish_survey: failed to schedule DB save for user=%s", user_info)
+    except Exception:
+        logger.exception("_finish_survey: error while attempting to schedule save to DB")
+
+    # Не показываем пользователю детализированный дамп ответов (в виде ключей modul:qid).
+    # Вместо этого отправляем краткое подтверждение. Полные результаты логируем для администратора/отладки.
+    try:
+        logger.info("_finish_survey: survey results for user=%s: %s", user_info, results)
+    except Exception:
+        logger.info("_finish_survey: survey results: %s", results)
+    text = "Благодарим за участие в проекте «Город для всех»! 🌆\n" \
+    "Ваш вклад поможет нам создавать решения, которые улучшат жизнь людей с ОВЗ.\n" \
+    "Следите за обновлениями — вместе мы сделаем город доступнее!\n" \
+    "Если у вас есть дополнительные комментарии или предложения, вы всегда можете связаться с нами. Группа в VK: https://vk.com/city_for_everyone?from=groups"
+    if isinstance(message_or_callback, CallbackQuery):
+        # Не удаляем предыдущие сообщения (по требованию пользователя) — просто ответим
+        try:
+            # Убедимся, что callback-ack отправлен прежде чем делать тяжёлые операции
+            try:
+                await message_or_callback.answer()
+            except Exception:
+                pass
+            await message_or_callback.message.answer(text)
+        except Exception:
+            try:
+                await message_or_callback.answer(text)
+            except Exception:
+                logger.exception("_finish_survey: failed to deliver finish text for callback")
+    else:
+        # message_or_callback — Message: используем обычный answer
+        await message_or_callback.answer(text)
+    logger.info("_finish_survey: survey finished for user")
+
+
 async def handle_next_question(
     message_or_callback,
     state: FSMContext,
     survey_service: SurveyService = None,
     keyboard_factory: KeyboardFactory = None,
     message_builder: MessageBuilder = None,
-    db_service: DBService = None
+    db_service: DBService = None,
+    journey_service: JourneyService = None,
+    answer_buffer: AnswerBuffer = None
 ):
     """Вычисляет и отправляет следующий вопрос."""
     logger.info("handle_next_question: invoked for user (callback?=%s)", isinstance(message_or_callback, CallbackQuery))
+    results = None
     async with question_lock:
         data = await state.get_data()
         module = data.get("current_module")
@@ -162,112 +321,11 @@ async def handle_next_question(
         next_module, next_qid = survey_service.get_next_question(module, qid, last_answer)
 
         if next_module is None and next_qid is None:
-            # конец опроса
+            # конец опроса: state очищается под блокировкой, а запись и ответ респонденту идут
+            # после неё — сохранение не задерживает обработчики других пользователей
             results = answers
-            # Попробуем сохранить результаты в БД в фоне (если инжектирован db_service).
-            # Сохранение в фоне предотвращает блокировку обработчика и лаг в клиенте.
-            try:
-                user_info = None
-                if isinstance(message_or_callback, CallbackQuery):
-                    user_info = getattr(message_or_callback.from_user, 'id', None)
-                else:
-                    user_info = getattr(message_or_callback.from_user, 'id', None)
-                # Diagnostic: log db_service value to help debug missing saves
-                try:
-                    logger.info("handle_next_question: db_service=%s for user=%s", repr(db_service), user_info)
-                except Exception:
-                    logger.debug("handle_next_question: could not repr db_service for user=%s", user_info)
-
-                # If db_service is missing, notify admins (if configured) so we can detect injection issues;
-                # otherwise, schedule background save as before.
-                if db_service is None:
-                    try:
-                        raw = os.getenv('ADMIN_IDS', '')
-                        admin_ids = [int(p.strip()) for p in raw.split(',') if p.strip().isdigit()]
-                    except Exception:
-                        admin_ids = []
-                    try:
-                        bot_obj = None
-                        try:
-                            bot_obj = message_or_callback.bot
-                        except Exception:
-                            bot_obj = None
-                        if bot_obj and admin_ids:
-                            for aid in admin_ids:
-                                try:
-                                    await bot_obj.send_message(aid, f"Diagnostic: db_service is None when saving survey for user {user_info}")
-                                except Exception:
-                                    logger.exception("handle_next_question: failed to notify admin %s", aid)
-                        else:
-                            logger.info("handle_next_question: cannot notify admins (no bot or no ADMIN_IDS configured)")
-                    except Exception:
-                        logger.exception("handle_next_question: admin notification failed")
-                elif user_info is not None:
-                    try:
-                        # schedule background save to the project's Russian schema; don't await to avoid blocking
-                        username = None
-                        try:
-                            username = getattr(message_or_callback.from_user, 'username', None)
-                        except Exception:
-                            username = None
-
-                        # Provide additional diagnostic logs about db_service and results
-                        try:
-                            logger.info("handle_next_question: db_service_id=%s db_service_type=%s for user=%s",
-                                        id(db_service) if db_service is not None else None,
-                                        type(db_service).__name__ if db_service is not None else None,
-                                        user_info)
-                        except Exception:
-                            logger.debug("handle_next_question: could not log db_service id/type for user=%s", user_info)
-
-                        # show a compact dump of results for debugging (truncated)
-                        try:
-                            sample = dict(list(results.items())[:10])
-                            logger.debug("handle_next_question: results sample for user=%s: %s", user_info, repr(sample)[:1000])
-                        except Exception:
-                            logger.debug("handle_next_question: could not produce results sample for user=%s", user_info)
-
-                        if TEMP_SYNC_SAVE:
-                            # Synchronous save for diagnostics: await the save so exceptions are visible
-                            logger.info("handle_next_question: TEMP_SYNC_SAVE enabled - performing synchronous save for user=%s", user_info)
-                            try:
-                                ank = await db_service.save_to_anketa_schema(user_info, results, username=(username or ''))
-                                logger.info("handle_next_question: sync save succeeded for user=%s anketa_id=%s rows_saved=%s",
-                                            user_info, getattr(ank, 'id', None), getattr(ank, 'rows_saved', 'unknown'))
-                            except Exception:
-                                logger.exception("handle_next_question: sync save failed for user=%s", user_info)
-                        else:
-                            async def _bg_save():
-                                logger.info("handle_next_question: background save started for user=%s", user_info)
-                                try:
-                                    ank = await db_service.save_to_anketa_schema(user_info, results, username=(username or ''))
-                                    logger.info("handle_next_question: background save succeeded for user=%s anketa_id=%s", user_info, getattr(ank, 'id', None))
-                                except Exception:
-                                    logger.exception("handle_next_question: background save failed for user=%s", user_info)
-
-                            logger.info("handle_next_question: scheduling background save task for user=%s", user_info)
-                            task = asyncio.create_task(_bg_save())
-                            logger.info("handle_next_question: scheduled background save task=%s for user=%s", repr(task), user_info)
-                            # attach a done callback to log unhandled exceptions explicitly
-                            def _on_done(t):
-                                try:
-                                    exc = t.exception()
-                                    if exc:
-                                        logger.exception("handle_next_question: background save task raised", exc_info=exc)
-                                except asyncio.CancelledError:
-                                    logger.info("handle_next_question: background save task cancelled for user=%s", user_info)
-                                except Exception:
-                                    # exception already logged in task, ignore
-                                    pass
-
-                            try:
-                                task.add_done_callback(_on_done)
-                            except Exception:
-                                logger.debug("handle_next_question: could not add done callback to save task for user=%s", user_info)
-                    except Exception:
-                        logger.exception("handle_next_question: failed to schedule DB save for user=%s", user_info)
-            except Exception:
-                logger.exception("handle_next_question: error while attempting to schedule save to DB")
+            if journey_service is not None and message_or_callback.from_user is not None:
+                journey_service.finish(message_or_callback.from_user.id)
 
             # Очищаем state (и логируем возможные ошибки)
             try:
@@ -275,54 +333,35 @@ async def handle_next_question(
                 logger.info("handle_next_question: state cleared for user")
             except Exception as e:
                 logger.exception("handle_next_question: failed to clear state: %s", e)
-            # Не показываем пользователю детализированный дамп ответов (в виде ключей modul:qid).
-            # Вместо этого отправляем краткое подтверждение. Полные результаты логируем для администратора/отладки.
-            try:
-                logger.info("handle_next_question: survey results for user=%s: %s", user_info, results)
-            except Exception:
-                logger.info("handle_next_question: survey results: %s", results)
-            text = "Благодарим за участие в проекте «Город для всех»! 🌆\n" \
-            "Ваш вклад поможет нам создавать решения, которые улучшат жизнь людей с ОВЗ.\n" \
-            "Следите за обновлениями — вместе мы сделаем город доступнее!\n" \
-            "Если у вас есть дополнительные комментарии или предложения, вы всегда можете связаться с нами. Группа в VK: https://vk.com/city_for_everyone?from=groups"
-            if isinstance(message_or_callback, CallbackQuery):
-                # Не удаляем предыдущие сообщения (по требованию пользователя) — просто ответим
+        else:
+            # Инкрементальный режим: ответы уходят в буфер записи, не дожидаясь конца опроса
+            if answer_buffer is not None and message_or_callback.from_user is not None:
                 try:
-                    # Убедимся, что callback-ack отправлен прежде чем делать тяжёлые операции
-                    try:
-                        await message_or_callback.answer()
-                    except Exception:
-                        pass
-                    await message_or_callback.message.answer(text)
+                    answer_buffer.record(message_or_callback.from_user.id, answers,
+                                         username=message_or_callback.from_user.username)
                 except Exception:
-                    try:
-                        await message_or_callback.answer(text)
-                    except Exception:
-                        logger.exception("handle_next_question: failed to deliver finish text for callback")
-            else:
-                # message_or_callback — Message: используем обычный answer
-                await message_or_callback.answer(text)
-            logger.info("handle_next_question: survey finished for user")
-            return
+                    logger.exception("handle_next_question: failed to buffer answers")
 
-        # Гарантируем очистку флага обработки перед отправкой следующего вопроса
-        try:
-            await state.update_data(processing_answer=False)
-        except Exception:
-            logger.debug("handle_next_question: could not clear processing_answer flag before next question")
+            # Гарантируем очистку флага обработки перед отправкой следующего вопроса
+            try:
+                await state.update_data(processing_answer=False)
+            except Exception:
+                logger.debug("handle_next_question: could not clear processing_answer flag before next question")
 
-        # обновляем state
-        await state.update_data({
-            "current_module": next_module,
-            "current_question_id": next_qid,
-            "current_level": 0,
-            "selected_options": []
-        })
+            # обновляем state
+            await state.update_data({
+                "current_module": next_module,
+                "current_question_id": next_qid,
+                "current_level": 0,
+                "selected_options": []
+            })
 
-        # отправляем следующий вопрос
-        target_msg = message_or_callback.message if isinstance(message_or_callback, CallbackQuery) else message_or_callback
-        await ask_question(target_msg, state, survey_service, keyboard_factory, message_builder)
-        logger.debug("handle_next_question: moved to %s:%s", next_module, next_qid)
+            # отправляем следующий вопрос
+            target_msg = message_or_callback.message if isinstance(message_or_callback, CallbackQuery) else message_or_callback
+            await ask_question(target_msg, state, survey_service, keyboard_factory, message_builder, journey_service)
+            logger.debug("handle_next_question: moved to %s:%s", next_module, next_qid)
+    if results is not None:
+        await _finish_survey(message_or_callback, results, db_service, answer_buffer)
 
 
 @router.callback_query(SurveyStates.in_progress, F.data.startswith("single:"))
@@ -332,7 +371,10 @@ async def handle_single_option(
     survey_service: SurveyService = None,
     keyboard_factory: KeyboardFactory = None,
     message_builder: MessageBuilder = None,
-    db_service: DBService = None
+    db_service: DBService = None,
+    quota_service: QuotaService = None,
+    journey_service: JourneyService = None,
+    answer_buffer: AnswerBuffer = None
 ):
     """Обработка single-option"""
     logger.debug("handle_single_option: enter user=%s data=%s", callback.from_user.id if callback.from_user else None, callback.data)
@@ -348,6 +390,7 @@ async def handle_single_option(
         return
 
     should_advance = False
+    quota_full = False
     # Ensure only one handler runs the critical section at a time
     async with question_lock:
         # Re-read state inside the lock to avoid races
@@ -417,16 +460,26 @@ async def handle_single_option(
                 pass
 
             logger.info("handle_single_option: saved %s -> %s", answers_key, chosen_value)
+            if journey_service is not None:
+                journey_service.answered(callback.from_user.id, answers_key)
+
+            # Квота: ответ попал в уже заполненную ячейку — дальше не идём
+            if quota_service is not None and quota_service.is_quota_key(answers_key):
+                full_dim = quota_service.check(answers)
+                if full_dim:
+                    logger.info("handle_single_option: quota %s is full for user=%s", full_dim, callback.from_user.id if callback.from_user else None)
+                    quota_full = True
+
+            if not quota_full:
+                # For debugging: see what the survey service computes as next
+                try:
+                    next_mod, next_q = survey_service.get_next_question(module, qid, chosen_value)
+                    logger.info("handle_single_option: next -> %s:%s", next_mod, next_q)
+                except Exception:
+                    logger.exception("handle_single_option: get_next_question failed")
 
-            # For debugging: see what the survey service computes as next
-            try:
-                next_mod, next_q = survey_service.get_next_question(module, qid, chosen_value)
-                logger.info("handle_single_option: next -> %s:%s", next_mod, next_q)
-            except Exception:
-                logger.exception("handle_single_option: get_next_question failed")
-
-            # Indicate that we should advance the survey after releasing lock
-            should_advance = True
+                # Indicate that we should advance the survey after releasing lock
+                should_advance = True
         except Exception as e:
             logger.exception("handle_single_option error: %s", e)
             try:
@@ -439,6 +492,24 @@ async def handle_single_option(
                 await state.update_data(processing_answer=False)
             except Exception:
                 logger.debug("handle_single_option: could not clear processing_answer flag in finally")
+    if quota_full:
+        user_id = callback.from_user.id if callback.from_user else None
+        if journey_service is not None and user_id is not None:
+            journey_service.finish(user_id)
+        try:
+            await state.clear()
+            await callback.message.answer(QUOTA_FULL_TEXT)
+        except Exception:
+            logger.exception("handle_single_option: failed to finish survey on full quota")
+        # Инкрементальный режим: проход закрывается, уже записанная анкета помечается screened_out
+        if answer_buffer is not None and user_id is not None:
+            try:
+                await answer_buffer.discard(user_id)
+                if db_service is not None:
+                    await db_service.close_partial(user_id)
+            except Exception:
+                logger.exception("handle_single_option: failed to close partial anketa on full quota for user=%s", user_id)
+        return
     # Outside the lock — advance the survey if needed
     if should_advance:
         # pass through db_service when calling internal helper so it doesn't rely on middleware
@@ -455,7 +526,7 @@ async def handle_single_option(
                         callback.from_user.id if callback.from_user else None)
         except Exception:
             logger.debug("handle_single_option: could not log db_service before advancing")
-        await handle_next_question(callback, state, survey_service, keyboard_factory, message_builder, db_service)
+        await handle_next_question(callback, state, survey_service, keyboard_factory, message_builder, db_service, journey_service, answer_buffer)
 
 
 @router.callback_query(SurveyStates.in_progress, F.data.startswith("multi:"))
@@ -540,7 +611,9 @@ async def handle_multi_submit(
     survey_service: SurveyService = None,
     keyboard_factory: KeyboardFactory = None,
     message_builder: MessageBuilder = None,
-    db_service: DBService = None
+    db_service: DBService = None,
+    journey_service: JourneyService = None,
+    answer_buffer: AnswerBuffer = None
 ):
     """Подтверждение multi-select"""
     logger.debug("handle_multi_submit: enter user=%s", callback.from_user.id if callback.from_user else None)
@@ -588,6 +661,8 @@ async def handle_multi_submit(
         answers_key = f"{module}:{qid}"
         # Сохраняем выбранные опции как список (чтобы совместимость с логикой осталась)
         answers[answers_key] = chosen_texts
+        if journey_service is not None:
+            journey_service.answered(callback.from_user.id, answers_key)
 
         # Проверим, выбран ли вариант "Другой..." — если да, запросим текст у пользователя
         other_selected = False
@@ -625,7 +700,7 @@ async def handle_multi_submit(
         await callback.answer()
         logger.info("handle_multi_submit: saved %s -> %s", answers_key, chosen_texts)
         try:
-            await handle_next_question(callback, state, survey_service, keyboard_factory, message_builder, db_service)
+            await handle_next_question(callback, state, survey_service, keyboard_factory, message_builder, db_service, journey_service, answer_buffer)
         except Exception as e:
             logger.exception("handle_multi_submit error: %s", e)
             await callback.answer("Ошибка обработки")
@@ -648,7 +723,9 @@ async def handle_text_during_survey(
     survey_service: SurveyService = None,
     keyboard_factory: KeyboardFactory = None,
     message_builder: MessageBuilder = None,
-    db_service: DBService = None
+    db_service: DBService = None,
+    journey_service: JourneyService = None,
+    answer_buffer: AnswerBuffer = None
 ):
     """Обработка текстового ввода во время опроса — используется для варианта "Другой вариант" в мультивыборе"""
     data = await state.get_data()
@@ -684,6 +761,8 @@ async def handle_text_during_survey(
         answers[awaiting] = chosen_texts
         await state.update_data(answers=answers, awaiting_custom_for=None, selected_options=[])
         logger.info("handle_text_during_survey: saved custom for %s -> %s", awaiting, text)
+        if journey_service is not None and message.from_user is not None:
+            journey_service.answered(message.from_user.id, f"{awaiting}:custom_answer")
     except Exception as e:
         logger.exception("handle_text_during_survey: failed to save custom answer: %s", e)
         await message.answer("Не удалось сохранить ваш вариант — попробуйте ещё раз.")
@@ -702,6 +781,6 @@ async def handle_text_during_survey(
             db_service = locals().get('db_service', None)
         except Exception:
             db_service = None
-        await handle_next_question(message, state, survey_service, keyboard_factory, message_builder, db_service)
+        await handle_next_question(message, state, survey_service, keyboard_factory, message_builder, db_service, journey_service, answer_buffer)
     except Exception as e:
         logger.exception("handle_text_during_survey: failed to advance survey: %s", e)
\ No newline at end of file
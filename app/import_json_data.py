@@ -1,3 +1,4 @@
+import hashlib
 import json
 import psycopg2
 import os
@@ -70,7 +71,7 @@ def import_json_data(json_file: str = None):
         if options_scale:
             print("📊 Импорт шкалы оценок...")
             for opt in options_scale:
-                cur.execute('INSERT INTO "Ответ" (text) VALUES (%s) RETURNING id', (opt,))
+                cur.execute('INSERT INTO "Ответ" (text, label) VALUES (%s, %s) RETURNING id', (opt, opt))
                 scale_answer_ids[opt] = cur.fetchone()[0]
                 answer_count += 1
 
@@ -97,7 +98,8 @@ def import_json_data(json_file: str = None):
                     parts = []
                     for key, value in q['if'].items():
                         target_old_id = value.get('id')
-                        target_new_id = next((nid for (mod, oid), nid in question_id_mapping.items() if oid == target_old_id), None)
+                        # переходы в JSON всегда внутри текущего модуля
+                        target_new_id = question_id_mapping.get((module_name, target_old_id))
                         if target_new_id:
                             parts.append(f"{key}:{target_new_id}")
                     condition_text = ";".join(parts) if parts else None
@@ -115,7 +117,7 @@ def import_json_data(json_file: str = None):
                 if 'options' in q:
                     representative_group_row_id = None
                     for option_text in q['options']:
-                        cur.execute('INSERT INTO "Ответ" (text) VALUES (%s) RETURNING id', (option_text,))
+                        cur.execute('INSERT INTO "Ответ" (text, label) VALUES (%s, %s) RETURNING id', (option_text, option_text))
                         answer_id = cur.fetchone()[0]
                         answer_count += 1
                         # group_id column stores logical group identifier (use question id)
@@ -138,7 +140,8 @@ def import_json_data(json_file: str = None):
                         level_text = " | ".join(level_text_parts)
                         for scale_option in options_scale:
                             full_level_text = f"{level_text} - {scale_option}"
-                            cur.execute('INSERT INTO "Ответ" (text) VALUES (%s) RETURNING id', (full_level_text,))
+                            # label — то, что бот сохраняет в ответе уровня (вариант шкалы)
+                            cur.execute('INSERT INTO "Ответ" (text, label) VALUES (%s, %s) RETURNING id', (full_level_text, scale_option))
                             answer_id = cur.fetchone()[0]
                             answer_count += 1
                             # group_id for levels use new_id + 1000 as logical group identifier
@@ -152,6 +155,15 @@ def import_json_data(json_file: str = None):
                         _ = cur.fetchone()[0]
                         question_answer_count += 1
 
+        # Обновляем версию опроса — запущенные боты подхватят новый опрос при следующем опросе версии
+        with open(json_file, 'rb') as f:
+            checksum = hashlib.sha256(f.read()).hexdigest()
+        cur.execute("""
+            INSERT INTO "Версия_опроса" (id, version, checksum, updated_at) VALUES (1, 1, %s, now())
+            ON CONFLICT (id) DO UPDATE
+            SET version = "Версия_опроса".version + 1, checksum = EXCLUDED.checksum, updated_at = now()
+        """, (checksum,))
+
         conn.commit()
 
         # Статистика
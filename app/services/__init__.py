@@ -2,8 +2,22 @@
 
 from .image_service import ImageService
 from .survey_service import SurveyService
+from .survey_provider import SurveyProvider
+from .quota_service import QuotaService
+from .journey_service import JourneyService
+from .search_service import SearchService
+from .answer_buffer import AnswerBuffer
+from .identity_cache import IdentityCache
+from .answer_catalog import AnswerCatalog
 
 __all__ = [
     "ImageService",
     "SurveyService",
+    "SurveyProvider",
+    "QuotaService",
+    "JourneyService",
+    "SearchService",
+    "AnswerBuffer",
+    "IdentityCache",
+    "AnswerCatalog",
 ]
\ No newline at end of file
@@ -0,0 +1,240 @@
+"""Инкрементальное сохранение ответов: небольшой буфер на пользователя со сбросом по таймеру/размеру"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class _Run:
+    """Состояние текущего прохождения одного пользователя"""
+
+    __slots__ = ("snapshot", "pending", "fresh", "first", "deferred", "complete_answers", "completed",
+                 "username", "touched", "lock")
+
+    def __init__(self):
+        # ответы, уже отданные в запись (ключ -> значение)
+        self.snapshot: Dict[str, object] = {}
+        # изменения, ещё не записанные в БД (None — ответ удалён)
+        self.pending: Dict[str, object] = {}
+        # первая запись прохода очищает прежние ответы анкеты
+        self.fresh = True
+        self.first = False
+        # повторное прохождение поверх завершённой анкеты: пишется целиком при завершении
+        self.deferred = False
+        # все ответы завершённого опроса, пока анкета не переведена в complete
+        self.complete_answers: Optional[dict] = None
+        # анкета, уже переведённая в complete этим проходом
+        self.completed = None
+        self.username: Optional[str] = None
+        # время последнего ответа (monotonic)
+        self.touched = time.monotonic()
+        self.lock = asyncio.Lock()
+
+
+class AnswerBuffer:
+    """
+    Буфер ответов для SAVE_MODE=incremental.
+
+    Анкета создаётся при первой записи со статусом in_progress, каждый ответ
+    дописывается (или заменяется по ключу) в `Анкета_ответ`. Изменения копятся
+    по пользователю и сбрасываются, когда их набралось `max_pending` или по
+    таймеру; завершение опроса — последний сброс и смена статуса на complete.
+    Повторное прохождение не трогает завершённую анкету до своего завершения:
+    его ответы копятся в буфере и записываются последним сбросом.
+    """
+
+    def __init__(self, db_service, max_pending: int = 5, flush_interval: float = 10.0,
+                 run_ttl: float = 86400.0):
+        """
+        Args:
+            db_service: DBService, через который идут записи (save_partial)
+            max_pending: Сколько изменённых ответов пользователя копить до немедленного сброса
+            flush_interval: Период фонового сброса в секундах
+            run_ttl: Через сколько секунд без ответов проход считается брошенным и забывается
+        """
+        self.db_service = db_service
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.run_ttl = run_ttl
+        # проходы в порядке активности: брошенные не доходят до finish(), их вытесняет _evict_stale
+        self._runs: "OrderedDict[int, _Run]" = OrderedDict()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def begin(self, tg_id: int) -> None:
+        """Начало нового прохождения: первая запись очистит ответы прошлого прохода"""
+        self._runs.pop(tg_id, None)
+        self._runs[tg_id] = _Run()
+
+    async def discard(self, tg_id: int) -> bool:
+        """
+        Забывает проход, закончившийся раньше времени: несброшенные изменения не записываются
+
+        Ждёт идущую запись прохода, поэтому после возврата буфер в анкету больше не пишет.
+
+        Returns:
+            bool: Проход уже что-то записал в анкету
+        """
+        run = self._runs.pop(tg_id, None)
+        if run is None:
+            return False
+        async with run.lock:
+            run.pending.clear()
+        return not run.fresh
+
+    async def _evict_stale(self) -> int:
+        """
+        Сбрасывает и забывает проходы без ответов дольше run_ttl
+
+        Проход, чей сброс не удался, остаётся в буфере до следующей попытки.
+
+        Returns:
+            int: Сколько проходов забыто
+        """
+        deadline = time.monotonic() - self.run_ttl
+        evicted = 0
+        for tg_id, run in list(self._runs.items()):
+            if run.touched > deadline:
+                break
+            if (run.pending and not run.deferred) or run.complete_answers is not None:
+                try:
+                    await self._flush_run(tg_id, run)
+                except Exception:
+                    logger.exception("AnswerBuffer: flush of stale run failed for tg_id=%s, will retry", tg_id)
+                    continue
+            if self._runs.get(tg_id) is run:
+                self._runs.pop(tg_id)
+                evicted += 1
+        return evicted
+
+    def record(self, tg_id: int, answers: dict, username: str = None) -> None:
+        """
+        Запоминает изменения ответов пользователя относительно уже записанных
+
+        Набралось `max_pending` изменений — запись уходит в фоновую задачу,
+        обработчик её не ждёт.
+
+        Args:
+            tg_id: Telegram id пользователя
+            answers: Все ответы текущего прохода (словарь из FSM state)
+            username: Имя пользователя для Персона
+        """
+        run = self._diff(tg_id, answers, username)
+        if len(run.pending) >= self.max_pending and not run.deferred:
+            task = asyncio.create_task(self._flush_run_logged(tg_id, run))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def finish(self, tg_id: int, answers: dict, username: str = None):
+        """
+        Завершение опроса: сбрасывает остаток изменений и переводит анкету в complete
+
+        При ошибке завершение повторит фоновый сброс.
+
+        Returns:
+            Анкета (id, rows_saved, status)
+        """
+        run = self._diff(tg_id, answers, username)
+        run.complete_answers = dict(answers or {})
+        return await self._flush_run(tg_id, run)
+
+    def _diff(self, tg_id: int, answers: dict, username: Optional[str]) -> _Run:
+        run = self._runs.get(tg_id)
+        if run is None:
+            # прохождение начато до перезапуска бота: запишем всё заново
+            run = self._runs[tg_id] = _Run()
+        else:
+            self._runs.move_to_end(tg_id)
+        run.touched = time.monotonic()
+        if username:
+            run.username = username
+        answers = answers or {}
+        for key, value in answers.items():
+            if key not in run.snapshot or run.snapshot[key] != value:
+                run.pending[key] = _copy(value)
+        for key in run.snapshot:
+            if key not in answers:
+                run.pending[key] = None
+        run.snapshot = {k: _copy(v) for k, v in answers.items()}
+        return run
+
+    async def _flush_run(self, tg_id: int, run: _Run):
+        async with run.lock:
+            if run.completed is not None and not run.pending:
+                # завершение уже записал фоновый сброс, стоявший в очереди раньше
+                return run.completed
+            complete = run.complete_answers is not None
+            if not run.pending and not complete:
+                return None
+            changes, run.pending = run.pending, {}
+            try:
+                ank, first = await self.db_service.save_partial(
+                    tg_id, changes, run.username,
+                    fresh=run.fresh, complete=complete, first=run.first,
+                    # snapshot уже включает changes: это всё, что будет записано после сброса
+                    answers=run.complete_answers if complete else run.snapshot,
+                )
+            except Exception:
+                # вернём изменения в буфер (более новые значения, пришедшие за время записи, важнее)
+                changes.update(run.pending)
+                run.pending = changes
+                raise
+            if getattr(ank, 'deferred', False):
+                # ничего не записано: прежние ответы заменит весь набор при завершении
+                changes.update(run.pending)
+                run.pending = changes
+                run.deferred = True
+                return ank
+            run.fresh = False
+            run.first = first
+            if complete:
+                run.completed = ank
+                if self._runs.get(tg_id) is run:
+                    self._runs.pop(tg_id)
+            return ank
+
+    async def _flush_run_logged(self, tg_id: int, run: _Run) -> None:
+        try:
+            await self._flush_run(tg_id, run)
+        except Exception:
+            logger.exception("AnswerBuffer: flush failed for tg_id=%s, will retry", tg_id)
+
+    async def flush(self) -> None:
+        """Сбрасывает накопленные изменения всех пользователей"""
+        for tg_id, run in list(self._runs.items()):
+            if (run.pending and not run.deferred) or run.complete_answers is not None:
+                await self._flush_run_logged(tg_id, run)
+
+    def start_flushing(self) -> None:
+        """Запускает периодический сброс буфера"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Останавливает фоновый сброс и сбрасывает остаток"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            evicted = await self._evict_stale()
+            if evicted:
+                logger.info("AnswerBuffer: forgot %s abandoned runs", evicted)
+
+
+def _copy(value):
+    # multi-select хранится списком, который обработчики меняют на месте
+    return list(value) if isinstance(value, list) else value
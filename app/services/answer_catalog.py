@@ -0,0 +1,169 @@
+"""Каталог вариантов ответа: (модуль, вопрос, уровень, вариант) -> Ответ.id в памяти процесса"""
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import select
+
+from app.database.models import async_session, SurveyVersion
+from app.services.survey_provider import (
+    LEVEL_GROUP_OFFSET,
+    fetch_survey_rows,
+    local_question_ids,
+    split_level_answer,
+)
+
+logger = logging.getLogger(__name__)
+
+CatalogKey = Tuple[str, int, Optional[int]]
+
+
+def build_answer_catalog(modules, questions, answers, options_scale) -> Dict[CatalogKey, Dict[str, int]]:
+    """
+    Собирает каталог из строк fetch_survey_rows
+
+    Варианты вопроса адресуются ключом (модуль, номер вопроса, None), варианты уровня —
+    (модуль, номер вопроса, номер уровня): в Ответ уровень хранится составной строкой
+    ("height: 2-4 см - 4 - сложно"), а бот сохраняет только вариант шкалы ("4 - сложно").
+
+    Returns:
+        {ключ: {текст варианта: Ответ.id}}
+    """
+    module_names = {mid: name for mid, name in modules}
+    local_ids = local_question_ids(questions)
+    question_keys = {
+        row.id: (module_names.get(row.module_id) or f"modul_{row.module_id}", local_ids[row.id])
+        for row in questions
+    }
+    catalog: Dict[CatalogKey, Dict[str, int]] = {}
+    level_numbers: Dict[int, Dict[str, int]] = {}
+    for question_id, group_id, answer_id, text in answers:
+        if question_id not in question_keys:
+            continue
+        module, qid = question_keys[question_id]
+        if group_id == question_id + LEVEL_GROUP_OFFSET:
+            level_text, opt = split_level_answer(text, options_scale)
+            # номер уровня — порядок первого появления, как в build_survey_data
+            levels = level_numbers.setdefault(question_id, {})
+            level = levels.setdefault(level_text, len(levels))
+            catalog.setdefault((module, qid, level), {}).setdefault(opt, answer_id)
+        else:
+            catalog.setdefault((module, qid, None), {}).setdefault(text, answer_id)
+    return catalog
+
+
+def answer_labels(answers, options_scale) -> Dict[int, str]:
+    """
+    Ответ.id -> текст, который бот сохраняет для этого варианта (Ответ.label)
+
+    Для вариантов вопроса это Ответ.text, для уровней — вариант шкалы без текста уровня.
+    """
+    labels: Dict[int, str] = {}
+    for question_id, group_id, answer_id, text in answers:
+        if group_id == question_id + LEVEL_GROUP_OFFSET:
+            labels[answer_id] = split_level_answer(text, options_scale)[1]
+        else:
+            labels[answer_id] = text
+    return labels
+
+
+def catalog_key(answer_key: str) -> Optional[CatalogKey]:
+    """Ключ каталога для ключа ответа "modul_1:5" / "modul_1:5:level_0" (None — свободный ответ и т.п.)"""
+    parts = str(answer_key).split(":")
+    if len(parts) < 2 or not parts[1].isdigit():
+        return None
+    if len(parts) == 2:
+        return parts[0], int(parts[1]), None
+    if len(parts) == 3 and parts[2].startswith("level_") and parts[2][6:].isdigit():
+        return parts[0], int(parts[1]), int(parts[2][6:])
+    return None
+
+
+class AnswerCatalog:
+    """
+    Соответствие вариантов ответа строкам `Ответ`, загружаемое один раз при старте.
+
+    Позволяет проставить answer_id каждой строке Анкета_ответ без запроса при сохранении.
+    Как и SurveyProvider, следит за строкой `Версия_опроса` (её меняют триггеры таблиц опроса)
+    и пересобирается при смене версии.
+    """
+
+    def __init__(self, session_maker=async_session, poll_interval: float = 60.0):
+        """
+        Args:
+            session_maker: Фабрика async-сессий SQLAlchemy
+            poll_interval: Период опроса строки версии в секундах
+        """
+        self.session_maker = session_maker
+        self.poll_interval = poll_interval
+        self.version: Optional[Tuple[Any, Any]] = None
+        self.loaded = False
+        self._catalog: Dict[CatalogKey, Dict[str, int]] = {}
+        self._labels: Dict[int, str] = {}
+        self._poll_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return sum(len(options) for options in self._catalog.values())
+
+    def resolve(self, answer_key: str, text: Any) -> Optional[int]:
+        """Ответ.id варианта `text` вопроса `answer_key` или None (свободный текст, нет в каталоге)"""
+        if not isinstance(text, str):
+            return None
+        key = catalog_key(answer_key)
+        if key is None:
+            return None
+        options = self._catalog.get(key)
+        return options.get(text) if options else None
+
+    def label(self, answer_id: int) -> Optional[str]:
+        """Текст, который бот сохраняет для варианта Ответ.id (None — не вариант опроса)"""
+        return self._labels.get(answer_id)
+
+    async def load(self) -> None:
+        """Читает таблицы опроса и пересобирает каталог"""
+        async with self.session_maker() as session:
+            version_row, modules, questions, answers, scale = await fetch_survey_rows(session)
+        self._catalog = build_answer_catalog(modules, questions, answers, scale)
+        self._labels = answer_labels(answers, scale)
+        self.version = (version_row[0], version_row[1]) if version_row is not None else None
+        # пустые таблицы опроса: DBService ищет answer_id по тексту, как раньше
+        self.loaded = bool(self._catalog)
+        logger.info("AnswerCatalog: loaded %s options for %s questions/levels, version=%s",
+                    len(self), len(self._catalog), self.version)
+
+    async def refresh(self) -> bool:
+        """Пересобирает каталог при смене версии опроса; True — каталог перезагружен"""
+        async with self.session_maker() as session:
+            row = (await session.execute(
+                select(SurveyVersion.version, SurveyVersion.checksum).where(SurveyVersion.id == 1)
+            )).first()
+        version = (row[0], row[1]) if row is not None else None
+        if self.loaded and version == self.version:
+            return False
+        await self.load()
+        return True
+
+    def start_polling(self) -> None:
+        """Запускает фоновую задачу опроса версии"""
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = asyncio.create_task(self._poll_loop())
+
+    async def stop_polling(self) -> None:
+        """Останавливает фоновую задачу опроса версии"""
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            try:
+                await self._poll_task
+            except asyncio.CancelledError:
+                pass
+            self._poll_task = None
+
+    async def _poll_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if await self.refresh():
+                    logger.info("AnswerCatalog: reloaded, version=%s", self.version)
+            except Exception:
+                # БД может быть временно недоступна — продолжаем со старым каталогом
+                logger.exception("AnswerCatalog: version poll failed, keeping cached catalog")
@@ -1,238 +1,476 @@
+import asyncio
+import contextlib
 import json
 import logging
-from sqlalchemy import select
+from types import SimpleNamespace
+from sqlalchemy import bindparam, delete, func, insert, select, update
 from app.database.models import (
+    WRITE_OPTIONS,
     async_session,
-    Persona,
-    Anketa,
+    sqlite_write_lock,
+    write_session,
     AnketaAnswer,
+    AnketaAnswerHistory,
+    Otvet,
+    Persona,
 )
+from app.database.group_commit import GroupCommitWriter
+from app.database.schema import (
+    STATUS_COMPLETE,
+    STATUS_IN_PROGRESS,
+    STATUS_SCREENED_OUT,
+    detect_capabilities,
+    select_strategies,
+)
+from app.services.answer_catalog import AnswerCatalog
+from app.services.identity_cache import IdentityCache
 
 logger = logging.getLogger(__name__)
 
+# Анкета_ответ columns that make up an answer row (compared when a new answer set replaces the stored one)
+ANSWER_FIELDS = ('question_id', 'answer_id', 'answer_text', 'answer_key')
+
 
 class DBService:
     """Сервис для сохранения результатов опроса в БД (sqlite/postgres через SQLAlchemy async)."""
 
-    def __init__(self, session_maker=async_session):
+    def __init__(self, session_maker=async_session, schema: str = None,
+                 group_commit: bool = False, commit_batch: int = 64, commit_window: float = 0.005,
+                 identity_cache: IdentityCache = None, answer_history: bool = False,
+                 answer_catalog: AnswerCatalog = None, compact_answers: bool = False):
         self.session_maker = session_maker
+        self.schema = schema
+        # tg_id -> Персона.id / Анкета.id of committed saves (per schema: ids differ between tenants)
+        self.identity_cache = identity_cache if identity_cache is not None else IdentityCache()
+        # keep superseded answer rows in Анкета_ответ_история
+        self.answer_history = answer_history
+        # answer_id without a query per save (falls back to Ответ.text lookups until loaded)
+        self.answer_catalog = answer_catalog
+        # catalogued answers are stored as answer_id only (answer_text NULL)
+        self.compact_answers = compact_answers
+        # SQLite: saves go through one writer task that commits them in batches
+        self.group_commit = group_commit
+        self.commit_batch = commit_batch
+        self.commit_window = commit_window
+        self.writer = None
+        # detected once (detect_schema) — see app/database/schema.py
+        self.capabilities = None
+        self.persona_writer = None
+        self.anketa_writer = None
+        self.answer_writer = None
+        self._commit_listeners = []
+        self._locks = {}
+        self._lock_users = {}
+
+    def add_commit_listener(self, callback):
+        """Register an async callback(tg_id, anketa_id, answers, created) awaited after a save commits.
+
+        `created` is True when the save created a new Анкета (first completion) and False
+        when an existing one was overwritten (re-submission).
+        """
+        self._commit_listeners.append(callback)
+
+    async def _notify_commit(self, tg_id: int, anketa_id, answers: dict, created: bool):
+        for callback in self._commit_listeners:
+            try:
+                await callback(tg_id, anketa_id, answers, created)
+            except Exception:
+                # listeners (counters, indexes) must never fail an already committed save
+                logger.exception("DBService: commit listener %r failed for tg_id=%s", callback, tg_id)
+
+    async def detect_schema(self):
+        """Inspect the table layout once and pick the matching write strategies."""
+        self.capabilities = await detect_capabilities(self.session_maker, self.schema)
+        self.persona_writer, self.anketa_writer, self.answer_writer = select_strategies(self.capabilities, self.schema)
+        if self.group_commit and self.capabilities.dialect == 'sqlite' and self.writer is None:
+            self.writer = GroupCommitWriter(
+                self.session_maker.kw['bind'].execution_options(**WRITE_OPTIONS),
+                max_batch=self.commit_batch,
+                window=self.commit_window,
+                lock=sqlite_write_lock,
+            )
+            logger.info("DBService: SQLite group commit enabled (batch<=%s, window=%.1f ms)",
+                        self.commit_batch, self.commit_window * 1000)
+        return self.capabilities
+
+    async def close(self):
+        """Commit queued saves and release the group-commit connection."""
+        if self.writer is not None:
+            await self.writer.close()
+
+    @contextlib.asynccontextmanager
+    async def _user_lock(self, tg_id: int):
+        """Serialize saves of the same user within the process (double-tap on the last answer etc.)"""
+        lock = self._locks.get(tg_id)
+        if lock is None:
+            lock = self._locks[tg_id] = asyncio.Lock()
+        self._lock_users[tg_id] = self._lock_users.get(tg_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[tg_id] -= 1
+            if not self._lock_users[tg_id]:
+                del self._lock_users[tg_id]
+                del self._locks[tg_id]
+
+    async def _write(self, fn, item):
+        """fn(session, [item])[0] in a committed transaction: a group-commit batch or a session of its own."""
+        if self.writer is not None:
+            return await self.writer.submit(fn, item)
+        async with write_session(self.session_maker) as session:
+            result = (await fn(session, [item]))[0]
+            await session.commit()
+        return result
 
+    @staticmethod
+    def _prepare_answer_rows(anketa_id: int, answers: dict, with_key: bool = False, resolve=None):
+        """One pass over answers: Анкета_ответ rows (json.dumps once per value), answer_key if requested,
+        answer_id from resolve(key, value) if given."""
+        rows = []
+        for key, val in (answers or {}).items():
+            if val is None:
+                # removed answer (incremental mode): nothing to insert
+                continue
+            qid = None
+            parts = str(key).split(":", 2)
+            # key may include extra parts (e.g. 'modul_1:27:level_0') — qid is the second token
+            if len(parts) > 1 and parts[1].isdigit():
+                qid = int(parts[1])
+
+            # Если значение — список (multi-select), создаём запись на каждый элемент
+            for v in (val if isinstance(val, list) else [val]):
+                row = {
+                    'anketa_id': anketa_id,
+                    'question_id': qid,
+                    'answer_id': resolve(key, v) if resolve is not None else None,
+                    'answer_text': v if isinstance(v, str) else json.dumps(v, ensure_ascii=False),
+                }
+                if with_key:
+                    row['answer_key'] = str(key)
+                rows.append(row)
+        return rows
+
+    async def _write_answers_many(self, session, items, replace: dict = None, created_at: dict = None) -> list:
+        """Write Анкета_ответ rows for (anketa_id, answers) pairs; returns row counts.
+
+        `replace` — {anketa_id: None (the whole answer set) or answer keys}: the stored rows in that
+        scope are brought to the new ones by a diff (see _diff_answers). Rows of other anketas are
+        just inserted, all in one bulk statement. `created_at` — {anketa_id: time} for every item
+        (imports), instead of the column default.
+        """
+        with_key = self.capabilities.answer_has_key
+        catalog = self.answer_catalog if self.answer_catalog is not None and self.answer_catalog.loaded else None
+        per_item = [
+            self._prepare_answer_rows(anketa_id, answers, with_key=with_key,
+                                      resolve=catalog.resolve if catalog is not None else None)
+            for anketa_id, answers in items
+        ]
+        rows = [row for item_rows in per_item for row in item_rows]
+        if created_at is not None and 'created_at' in self.capabilities.answer_columns:
+            for row in rows:
+                row['created_at'] = created_at[row['anketa_id']]
+        if catalog is not None and self.compact_answers and self.capabilities.answer_view:
+            # a resolved answer's text is its Ответ.label: Анкета_ответ_полный restores it
+            for row in rows:
+                if row['answer_id'] is not None:
+                    row['answer_text'] = None
+        # No catalog: populate answer_id from Ответ.text where the stored text matches an answer option
+        texts = {row['answer_text'] for row in rows if row['answer_text'] is not None} if catalog is None else None
+        if texts:
+            res = await session.execute(select(Otvet.id, Otvet.text).where(Otvet.text.in_(list(texts))))
+            text_to_id = {rtext: rid for rid, rtext in res.fetchall()}
+            for row in rows:
+                row['answer_id'] = text_to_id.get(row['answer_text'])
+        if replace:
+            rows = await self._diff_answers(session, rows, replace)
+        await self.answer_writer.write(session, rows)
+        return [len(item_rows) for item_rows in per_item]
+
+    async def _diff_answers(self, session, rows: list, replace: dict) -> list:
+        """Bring the stored answers of `replace` anketas to `rows`; returns the rows still to insert.
+
+        Identical rows are left alone (keeping their id and created_at), a changed answer updates
+        its row in place, rows without a counterpart are deleted: one SELECT, one DELETE and one
+        executemany UPDATE for the whole batch. Rows are matched by answer_key (question_id in
+        layouts without it).
+        """
+        columns = self.capabilities.answer_columns
+        fields = [f for f in ANSWER_FIELDS if f in columns]
+        group = 'answer_key' if 'answer_key' in columns else 'question_id'
+        table = AnketaAnswer.__table__
+        res = await session.execute(
+            select(table.c.id, table.c.anketa_id, *[table.c[c] for c in fields + ['created_at'] if c in columns])
+            .where(table.c.anketa_id.in_(list(replace)))
+            .order_by(table.c.id)
+        )
+        stored = {}
+        for row in res.mappings():
+            keys = replace[row['anketa_id']]
+            if keys is None or row['answer_key'] in keys:
+                stored.setdefault((row['anketa_id'], row[group]), []).append(dict(row))
+        incoming, inserts = {}, []
+        for row in rows:
+            if row['anketa_id'] in replace:
+                incoming.setdefault((row['anketa_id'], row[group]), []).append(row)
+            else:
+                inserts.append(row)
+
+        updates, stale, unchanged = [], [], 0
+        for slot in stored.keys() | incoming.keys():
+            old, changed = stored.get(slot, []), []
+            for row in incoming.get(slot, []):
+                same = next((o for o in old if all(o[f] == row[f] for f in fields)), None)
+                if same is None:
+                    changed.append(row)
+                else:
+                    old.remove(same)
+                    unchanged += 1
+            updates.extend(zip(old, changed))
+            stale.extend(old[len(changed):])
+            inserts.extend(changed[len(old):])
+
+        superseded = [o for o, _row in updates] + stale
+        if superseded and self.answer_history:
+            await session.execute(insert(AnketaAnswerHistory), [
+                {'answer_row_id': o['id'], 'anketa_id': o['anketa_id'], 'created_at': o.get('created_at'),
+                 **{f: o[f] for f in fields}}
+                for o in superseded
+            ])
+        if stale:
+            await session.execute(delete(table).where(table.c.id.in_([o['id'] for o in stale])))
+        if updates:
+            values = {f: bindparam(f'new_{f}') for f in fields}
+            if 'created_at' in columns:
+                # the answer was given now; unchanged rows keep their time
+                values['created_at'] = func.now()
+            await session.execute(
+                update(table).where(table.c.id == bindparam('row_id')).values(**values),
+                [{'row_id': o['id'], **{f'new_{f}': row[f] for f in fields}} for o, row in updates],
+            )
+        logger.debug("DBService: answers diff for anketa ids=%s: %s unchanged, %s updated, %s deleted, %s new",
+                     list(replace), unchanged, len(updates), len(stale), len(inserts))
+        return inserts
+
+    async def _save_batch(self, session, items) -> list:
+        """Full saves for (tg_id, answers, username, identity) items of different users inside the
+        caller's transaction: a fixed number of statements however many items. Returns [(anketa, created)].
+
+        `identity` is the IdentityCache entry (or None): when its Анкета still exists the Персона
+        upsert and the Анкета lookup are skipped (re-submissions, /newtry).
+        """
+        cached = {tg_id: ident for tg_id, _answers, _username, ident in items
+                  if ident is not None and ident.anketa_id is not None}
+        confirmed = {}
+        if cached:
+            confirmed = await self.anketa_writer.confirm_many(
+                session, {ident.persona_id: ident.anketa_id for ident in cached.values()}, status=STATUS_COMPLETE
+            )
+        pids = {tg_id: ident.persona_id for tg_id, ident in cached.items() if ident.persona_id in confirmed}
+        # the upsert also stores a changed username
+        users = [(tg_id, username) for tg_id, _answers, username, _ident in items
+                 if tg_id not in pids or (username and username != cached[tg_id].username)]
+        if users:
+            pids.update(await self.persona_writer.get_ids(session, users))
+        anketas = await self.anketa_writer.get_or_create_many(
+            session, [(pids[tg_id], answers) for tg_id, answers, _username, _ident in items],
+            status=STATUS_COMPLETE, known=confirmed, clear_answers=False,
+        )
+        results = [anketas[pids[tg_id]] for tg_id, _answers, _username, _ident in items]
+        # a re-submission rewrites only the answers that changed
+        counts = await self._write_answers_many(
+            session, [(ank.id, item[1]) for (ank, _created), item in zip(results, items)],
+            replace={ank.id: None for ank, created in results if not created},
+        )
+        for (ank, _created), count, item in zip(results, counts, items):
+            ank.rows_saved = count
+            ank.person_id = pids[item[0]]
+        return results
 
     async def save_to_anketa_schema(self, tg_id: int, answers: dict, username: str = None):
         """Сохранить ответы в схему `Анкета`/`Анкета_ответ` (русские таблицы).
 
-        Логика:
-        - Найти или создать Persona по tg_id (User_id)
-        - Создать запись в Анкета (проход)
-        - Для каждой пары вопрос-ответ создать запись в Анкета_ответ
+        Логика (одна транзакция):
+        - Найти или создать Persona по tg_id (User_id) — upsert
+        - Найти последнюю Анкета персоны или создать новую
+        - Записать ответы в Анкета_ответ; у существующей анкеты меняются только отличающиеся
+          строки (вставка новых, обновление изменённых, удаление лишних)
+        - Записать снимок всего набора ответов в Анкета.answers (если колонка есть)
         """
         try:
-            # ensure person — persist separately so later rollbacks won't remove it
-            person = None
-            if 'Persona' in globals():
-                async with self.session_maker() as session:
-                    person = await session.scalar(select(Persona).where(Persona.user_id == tg_id))
-                    if not person:
-                        person = Persona(user_id=tg_id, username=(username or ''))
-                        session.add(person)
-                        await session.commit()
-                        # reload to obtain assigned id
-                        person = await session.scalar(select(Persona).where(Persona.user_id == tg_id))
-
-            # create anketa and answers in a separate session
-            async with self.session_maker() as session:
-                from sqlalchemy import text
-                from types import SimpleNamespace
-
-                ank = None
+            if self.anketa_writer is None:
+                await self.detect_schema()
+            async with self._user_lock(tg_id):
                 try:
-                    # If this person already has an Анкета, reuse it and delete previous answers
-                    pid_local = getattr(person, 'id', None) if person is not None else None
-                    existing_ank = None
-                    if pid_local is not None:
-                        try:
-                            # use execute + scalars() to reliably get ORM object (works in async session)
-                            # Order by id desc — some legacy schemas don't have created_at
-                            res = await session.execute(
-                                select(Anketa).where(Anketa.person_id == pid_local).order_by(Anketa.id.desc()).limit(1)
-                            )
-                            existing_ank = res.scalars().first()
-                            logger.debug("DBService: existing_ank lookup for person_id=%s -> %s", pid_local, getattr(existing_ank, 'id', None))
-                        except Exception:
-                            # If select fails for some legacy schema, ignore and proceed to create
-                            logger.debug("DBService: existing_ank lookup failed for person_id=%s", pid_local, exc_info=True)
-                            existing_ank = None
-
-                        # Fallback: some very old layouts may not have person_id column and use Анкета.id == Персона.id
-                        if existing_ank is None:
-                            try:
-                                res2 = await session.execute(
-                                    select(Anketa).where(Anketa.id == pid_local).order_by(Anketa.id.desc()).limit(1)
-                                )
-                                existing_ank = res2.scalars().first()
-                                logger.debug("DBService: fallback existing_ank lookup by id for person_id=%s -> %s", pid_local, getattr(existing_ank, 'id', None))
-                            except Exception:
-                                logger.debug("DBService: fallback existing_ank lookup by id failed for person_id=%s", pid_local, exc_info=True)
-                                existing_ank = None
-
-                    if existing_ank is not None:
-                        # delete previous answers for this anketa so we can overwrite
-                        logger.info("DBService: reusing existing anketa id=%s for person_id=%s - deleting previous answers", existing_ank.id, pid_local)
-                        try:
-                            await session.execute(text('DELETE FROM "Анкета_ответ" WHERE "anketa_id" = :aid'), {'aid': existing_ank.id})
-                        except Exception:
-                            # fallback to ORM delete
-                            from sqlalchemy import delete as _del
-                            await session.execute(_del(AnketaAnswer).where(AnketaAnswer.anketa_id == existing_ank.id))
-                        ank = existing_ank
-                    else:
-                        ank = Anketa(person_id=pid_local)
-                        session.add(ank)
-                        await session.flush()
-                        logger.info("DBService: created new Анкета id=%s for person_id=%s", getattr(ank, 'id', None), pid_local)
-                except Exception as e:
-                    msg = str(e).lower() + ' ' + repr(e).lower()
-                    if 'person_id' in msg or 'undefinedcolumnerror' in msg:
-                        await session.rollback()
-
-                        pid = getattr(person, 'id', None) if person is not None else None
-                        if pid is None:
-                            raise RuntimeError('Persona id is None; cannot create legacy Анкета')
-
-                        # Try several fallback INSERT variants to support different legacy schemas.
-                        # 1) Preferred: table has column person_id -> INSERT person_id
-                        # 2) Older: table has columns id + id_q -> INSERT id,id_q (original fallback)
-                        # 3) Very old: Анкета.id == Персона.id -> INSERT id only
-
-                        # determine a reasonable id_q value from answers (first numeric qid found)
-                        id_q_value = 0
-                        for k in (answers or {}):
-                            try:
-                                _mod, qid_s = str(k).split(":", 1)
-                                qid_token = str(qid_s).split(":", 1)[0]
-                                if qid_token.isdigit():
-                                    id_q_value = int(qid_token)
-                                    break
-                            except Exception:
-                                continue
-
-                        inserted = None
-                        # attempt 1: insert with person_id
-                        try:
-                            logger.info("DBService: fallback attempt INSERT person_id for Анкета (person_id=%s)", pid)
-                            res = await session.execute(
-                                text('INSERT INTO "Анкета" ("person_id") VALUES (:person_id) RETURNING "id"'),
-                                {'person_id': pid}
-                            )
-                            inserted = res.scalar_one()
-                            ank = SimpleNamespace(id=inserted)
-                            logger.info("DBService: fallback person_id insert succeeded, anketa_id=%s", inserted)
-                        except Exception as e1:
-                            logger.info("DBService: fallback insert with person_id failed: %s", e1)
-                            await session.rollback()
-                            # attempt 2: insert id + id_q (legacy layout)
-                            try:
-                                logger.info("DBService: fallback attempt INSERT id+id_q for Анкета (id=%s, id_q=%s)", pid, id_q_value)
-                                res = await session.execute(
-                                    text('INSERT INTO "Анкета" ("id", "id_q") VALUES (:id, :id_q) RETURNING "id"'),
-                                    {'id': pid, 'id_q': id_q_value}
-                                )
-                                inserted = res.scalar_one()
-                                ank = SimpleNamespace(id=inserted)
-                                logger.info("DBService: fallback id+id_q insert succeeded, anketa_id=%s", inserted)
-                            except Exception as e2:
-                                logger.info("DBService: fallback insert with id+id_q failed: %s", e2)
-                                await session.rollback()
-                                # attempt 3: insert id only (anketa.id == persona.id)
-                                try:
-                                    logger.info("DBService: fallback attempt INSERT id only for Анкета (id=%s)", pid)
-                                    res = await session.execute(
-                                        text('INSERT INTO "Анкета" ("id") VALUES (:id) RETURNING "id"'),
-                                        {'id': pid}
-                                    )
-                                    inserted = res.scalar_one()
-                                    ank = SimpleNamespace(id=inserted)
-                                    logger.info("DBService: fallback id-only insert succeeded, anketa_id=%s", inserted)
-                                except Exception as e3:
-                                    logger.info("DBService: fallback insert with id only failed: %s", e3)
-                                    await session.rollback()
-                                    # re-raise original to be handled by outer except
-                                    raise
-                    else:
-                        raise
-
-                # Precompute mapping from answer_text -> Ответ.id to populate answer_id when possible
-                try:
-                    from app.database.models import Otvet
-                    # collect distinct texts that will be stored in answer_text
-                    texts = set()
-                    for key, val in (answers or {}).items():
-                        try:
-                            _, qid_s = str(key).split(":", 1)
-                            qid_token = str(qid_s).split(":", 1)[0]
-                        except Exception:
-                            qid_token = None
-
-                        if isinstance(val, list):
-                            for v in val:
-                                txt = json.dumps(v, ensure_ascii=False) if not isinstance(v, str) else v
-                                if txt is not None:
-                                    texts.add(txt)
-                        else:
-                            txt = json.dumps(val, ensure_ascii=False) if not isinstance(val, str) else val
-                            if txt is not None:
-                                texts.add(txt)
-
-                    text_to_id = {}
-                    if texts:
-                        res = await session.execute(select(Otvet.id, Otvet.text).where(Otvet.text.in_(list(texts))))
-                        for rid, rtext in res.fetchall():
-                            text_to_id[rtext] = rid
+                    ank, created = await self._write(
+                        self._save_batch, (tg_id, answers, username, self.identity_cache.get(tg_id))
+                    )
                 except Exception:
-                    # If anything goes wrong with lookup, continue without mappings
-                    logger.debug("DBService: could not build answer_text->id map", exc_info=True)
-                    text_to_id = {}
-
-                count = 0
-                for key, val in (answers or {}).items():
-                    module = None
-                    qid = None
-                    try:
-                        module, qid_s = str(key).split(":", 1)
-                        # qid_s may include extra parts (e.g. '27:level_0') — take first token
-                        qid_token = str(qid_s).split(":", 1)[0]
-                        qid = int(qid_token) if qid_token.isdigit() else None
-                    except Exception:
-                        module = str(key)
-
-                    # Если значение — список (multi-select), создаём запись на каждый элемент
-                    if isinstance(val, list):
-                        for v in val:
-                            atxt = json.dumps(v, ensure_ascii=False) if not isinstance(v, str) else v
-                            aid = text_to_id.get(atxt)
-                            ai = AnketaAnswer(
-                                anketa_id=getattr(ank, 'id', None),
-                                question_id=qid,
-                                answer_id=aid,
-                                answer_text=atxt
-                            )
-                            session.add(ai)
-                            count += 1
-                    else:
-                        atxt = json.dumps(val, ensure_ascii=False) if not isinstance(val, str) else val
-                        aid = text_to_id.get(atxt)
-                        ai = AnketaAnswer(
-                            anketa_id=getattr(ank, 'id', None),
-                            question_id=qid,
-                            answer_id=aid,
-                            answer_text=atxt
-                        )
-                        session.add(ai)
-                        count += 1
-
-                await session.commit()
-                logger.info("DBService: saved to anketa schema for tg_id=%s anketa_id=%s rows=%s", tg_id, getattr(ank, 'id', None), count)
-                return ank
+                    self.identity_cache.invalidate(tg_id)
+                    raise
+                self.identity_cache.put(tg_id, ank.person_id, username, ank.id)
+            logger.info("DBService: saved to anketa schema for tg_id=%s anketa_id=%s rows=%s", tg_id, ank.id, ank.rows_saved)
+            await self._notify_commit(tg_id, ank.id, answers or {}, created)
+            return ank
         except Exception:
             logger.exception("DBService: failed to save_to_anketa_schema for tg_id=%s", tg_id)
             raise
+
+    async def import_anketas(self, items) -> list:
+        """Импорт завершённых прохождений из другого источника одной транзакцией
+
+        Каждый элемент (tg_id, answers, username, created_at) становится новой Анкета (последняя
+        анкета персоны не переиспользуется) с временем created_at у неё и у строк Анкета_ответ.
+        Запись идёт теми же стратегиями, что и сохранения бота (upsert Персона, каталог ответов,
+        COPY на asyncpg); подписчики уведомляются после коммита с created=True.
+
+        Returns:
+            Анкета.id в порядке items
+        """
+        if self.anketa_writer is None:
+            await self.detect_schema()
+        async with write_session(self.session_maker) as session:
+            # one row per user in the upsert: ON CONFLICT cannot touch a row twice
+            users = {tg_id: username for tg_id, _answers, username, _created_at in items}
+            pids = await self.persona_writer.get_ids(session, list(users.items()))
+            ids = await self.anketa_writer.create_many(
+                session, [(pids[tg_id], answers, created_at) for tg_id, answers, _username, created_at in items],
+                status=STATUS_COMPLETE,
+            )
+            await self._write_answers_many(
+                session, [(ank_id, item[1]) for ank_id, item in zip(ids, items)],
+                created_at={ank_id: item[3] for ank_id, item in zip(ids, items)},
+            )
+            await session.commit()
+        for ank_id, (tg_id, answers, _username, _created_at) in zip(ids, items):
+            await self._notify_commit(tg_id, ank_id, answers or {}, True)
+        return ids
+
+    @property
+    def incremental_supported(self) -> bool:
+        """Whether the detected layout has the columns needed by save_partial."""
+        return self.capabilities is not None and self.capabilities.supports_incremental
+
+    async def _save_partial_in_session(self, session, tg_id: int, changes: dict, username: str,
+                                       fresh: bool, complete: bool, answers: dict, first: bool, ident=None):
+        """save_partial body inside the caller's transaction; returns (anketa, first).
+
+        `ident` — the IdentityCache entry: its Персона.id is trusted while the person still has an Анкета.
+        A new run over a complete Анкета writes nothing until it completes: the Анкета comes back
+        with `deferred` set and keeps its answers and status if the run is abandoned.
+        """
+        ank = None
+        if ident is not None and not (username and username != ident.username):
+            pid = ident.persona_id
+            ank = await self.anketa_writer.latest(session, pid)
+        if ank is None:
+            pid = await self.persona_writer.get_id(session, tg_id, username)
+            ank = await self.anketa_writer.latest(session, pid)
+        replace = {}
+        if ank is None:
+            # the new Анкета holds just these rows, and so does its snapshot
+            ank_id = await self.anketa_writer.insert(session, pid, changes, status=STATUS_IN_PROGRESS)
+            ank = SimpleNamespace(id=ank_id, status=STATUS_IN_PROGRESS)
+            first = True
+            logger.info("DBService: created in-progress Анкета id=%s for person_id=%s", ank.id, pid)
+        elif fresh and not complete and ank.status == STATUS_COMPLETE:
+            # a retake replaces the completed answers only once it is complete itself
+            ank.person_id = pid
+            ank.rows_saved = 0
+            ank.deferred = True
+            return ank, first
+        else:
+            if fresh:
+                first = first or ank.status in (STATUS_IN_PROGRESS, STATUS_SCREENED_OUT)
+                replace[ank.id] = None
+            elif changes:
+                replace[ank.id] = set(changes)
+            # without the full answer set the stored snapshot would be stale: mark it unknown
+            await self.anketa_writer.set_snapshots(session, {ank.id: changes if fresh else answers})
+        ank.person_id = pid
+        ank.rows_saved = (await self._write_answers_many(session, [(ank.id, changes)], replace=replace))[0]
+        status = STATUS_COMPLETE if complete else STATUS_IN_PROGRESS
+        if ank.status != status:
+            await self.anketa_writer.set_status(session, ank.id, status)
+            ank.status = status
+        return ank, first
+
+    async def _save_partial_batch(self, session, items) -> list:
+        return [await self._save_partial_in_session(session, *item) for item in items]
+
+    async def save_partial(self, tg_id: int, changes: dict, username: str = None,
+                           fresh: bool = False, complete: bool = False, answers: dict = None,
+                           first: bool = False):
+        """Записать часть ответов (инкрементальный режим) одной транзакцией.
+
+        - Найти/создать Persona и последнюю Анкета персоны (новая создаётся со статусом in_progress)
+        - fresh: новый проход опроса — прежние ответы анкеты заменяются набором changes;
+          иначе заменяются только строки изменённых ключей (значение None — ответ удалён).
+          Замена пишет разницу: совпадающие строки не трогаются. Завершённая анкета при новом
+          проходе не меняется до его завершения: запись откладывается (anketa.deferred)
+        - complete: перевести анкету в статус complete и уведомить подписчиков
+
+        Args:
+            answers: Все ответы прохода с учётом changes — снимок в Анкета.answers
+                (None — снимок сбрасывается в NULL); при complete он же уходит подписчикам
+            first: Предыдущая запись этого прохода уже вернула first=True
+
+        Returns:
+            (anketa, first): anketa.id и anketa.rows_saved; first — прохождение первое для персоны
+            (анкета создана или не была завершена), подписчики получают его как `created`
+        """
+        try:
+            if self.anketa_writer is None:
+                await self.detect_schema()
+            if not self.incremental_supported:
+                raise RuntimeError("incremental saves need Анкета.status and Анкета_ответ.answer_key")
+            async with self._user_lock(tg_id):
+                try:
+                    ank, first = await self._write(
+                        self._save_partial_batch,
+                        (tg_id, changes, username, fresh, complete, answers, first, self.identity_cache.get(tg_id)),
+                    )
+                except Exception:
+                    self.identity_cache.invalidate(tg_id)
+                    raise
+                self.identity_cache.put(tg_id, ank.person_id, username, ank.id)
+            logger.info("DBService: saved %s answer keys for tg_id=%s anketa_id=%s rows=%s status=%s",
+                        len(changes or {}), tg_id, ank.id, ank.rows_saved, ank.status)
+            if complete:
+                await self._notify_commit(tg_id, ank.id, answers or {}, first)
+            return ank, first
+        except Exception:
+            logger.exception("DBService: failed to save_partial for tg_id=%s", tg_id)
+            raise
+
+    async def _close_partial_batch(self, session, items) -> list:
+        results = []
+        for tg_id, status in items:
+            pid = await session.scalar(select(Persona.id).where(Persona.user_id == tg_id))
+            ank = await self.anketa_writer.latest(session, pid) if pid is not None else None
+            # a completed Анкета belongs to an earlier run: a retake writes nothing before it completes
+            if ank is None or ank.status != STATUS_IN_PROGRESS:
+                results.append(None)
+                continue
+            await self.anketa_writer.set_status(session, ank.id, status)
+            results.append(ank.id)
+        return results
+
+    async def close_partial(self, tg_id: int, status: str = STATUS_SCREENED_OUT):
+        """Завершить незавершённую анкету (инкрементальный режим) статусом `status` без уведомления подписчиков.
+
+        Для прохождений, остановленных до конца опроса (квота заполнена): анкета не остаётся
+        in_progress навсегда и не засчитывается подписчиками как завершённая.
+
+        Returns:
+            Анкета.id или None, если незавершённой анкеты нет
+        """
+        if self.anketa_writer is None:
+            await self.detect_schema()
+        if not self.incremental_supported:
+            return None
+        async with self._user_lock(tg_id):
+            anketa_id = await self._write(self._close_partial_batch, (tg_id, status))
+        if anketa_id is not None:
+            logger.info("DBService: closed Анкета id=%s of tg_id=%s as %s", anketa_id, tg_id, status)
+        return anketa_id
@@ -0,0 +1,89 @@
+"""Кеш соответствия tg_id -> Персона.id / Анкета.id (LRU с TTL)"""
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+
+@dataclass
+class Identity:
+    """Что известно о пользователе после последней успешной записи"""
+    persona_id: int
+    username: str = ''
+    anketa_id: Optional[int] = None
+    expires_at: float = 0.0
+
+
+class IdentityCache:
+    """
+    Ограниченный LRU-кеш идентификаторов пользователей.
+
+    Заполняется после каждой закоммиченной записи и при первом чтении
+    (например, /check_user), сбрасывается при ошибке записи. TTL ограничивает
+    устаревание, если строки меняет другой процесс.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        """
+        Args:
+            max_size: Максимум пользователей в кеше (0 — кеш выключен)
+            ttl: Время жизни записи в секундах
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[int, Identity]" = OrderedDict()
+
+    def get(self, tg_id: int) -> Optional[Identity]:
+        """Запись о пользователе или None (нет, истекла или кеш выключен)"""
+        entry = self._entries.get(tg_id)
+        if entry is None or entry.expires_at < time.monotonic():
+            if entry is not None:
+                del self._entries[tg_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(tg_id)
+        self.hits += 1
+        return entry
+
+    def put(self, tg_id: int, persona_id: int, username: Optional[str] = None,
+            anketa_id: Optional[int] = None) -> None:
+        """
+        Запоминает идентификаторы пользователя (anketa_id=None — оставить известный)
+
+        Args:
+            tg_id: Telegram id пользователя
+            persona_id: Персона.id
+            username: Имя, записанное в Персона
+            anketa_id: Последняя Анкета.id
+        """
+        if self.max_size <= 0:
+            return
+        previous = self._entries.pop(tg_id, None)
+        if anketa_id is None and previous is not None and previous.persona_id == persona_id:
+            anketa_id = previous.anketa_id
+        if username is None:
+            username = previous.username if previous is not None else ''
+        self._entries[tg_id] = Identity(persona_id, username or '', anketa_id, time.monotonic() + self.ttl)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, tg_id: int) -> None:
+        self._entries.pop(tg_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+        }
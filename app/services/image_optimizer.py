@@ -0,0 +1,235 @@
+"""Подготовка изображений опроса к отправке в Telegram (JPEG с ограниченным размером)"""
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не установлен — оптимизация недоступна, отдаём исходники
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.jfif')
+MANIFEST_NAME = "manifest.json"
+# Telegram сам ужимает фото до 1280 px по большей стороне — больше загружать незачем
+DEFAULT_MAX_SIDE = 1280
+DEFAULT_QUALITY = 85
+
+
+@dataclass
+class OptimizeReport:
+    """Итоги прогона оптимизации"""
+    processed: int = 0
+    reused: int = 0
+    skipped: int = 0
+    failed: int = 0
+    source_bytes: int = 0
+    output_bytes: int = 0
+    seconds: float = 0.0
+    errors: List[str] = field(default_factory=list)
+
+    def summary(self) -> str:
+        saved = self.source_bytes - self.output_bytes
+        ratio = (saved / self.source_bytes * 100) if self.source_bytes else 0.0
+        return (
+            f"обработано {self.processed}, из кеша {self.reused}, оставлены исходники {self.skipped}, "
+            f"ошибок {self.failed}; {self.source_bytes / 1024:.0f} КБ -> {self.output_bytes / 1024:.0f} КБ "
+            f"(-{ratio:.0f}%) за {self.seconds:.2f} с"
+        )
+
+
+def is_available() -> bool:
+    """Установлен ли Pillow"""
+    return Image is not None
+
+
+def _file_sha256(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_manifest(cache_dir: str) -> Dict[str, Dict[str, str]]:
+    """
+    Читает манифест кеша: {имя файла (lower): {"sha256": хеш исходника, "output": имя JPEG или ""}}
+
+    Пустой "output" означает, что JPEG не меньше исходника и отдаётся исходный файл.
+    """
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать манифест {path}: {e}")
+        return {}
+
+
+def _save_manifest(cache_dir: str, manifest: Dict[str, Dict[str, str]]) -> None:
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _to_rgb(img):
+    """RGB-копия изображения; прозрачность заливается белым"""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        rgba = img.convert('RGBA')
+        flat = Image.new('RGB', rgba.size, (255, 255, 255))
+        flat.paste(rgba, mask=rgba.getchannel('A'))
+        return flat
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
+
+def _optimize_one(src_path: str, dst_path: str, max_side: int, quality: int) -> Tuple[int, int]:
+    """Перекодирует один файл в JPEG (выполняется в дочернем процессе). Возвращает (байт до, байт после)"""
+    with Image.open(src_path) as img:
+        img.load()
+        img = _to_rgb(img)
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        tmp_path = dst_path + '.tmp'
+        # без exif/icc — метаданные Telegram всё равно отбрасывает
+        img.save(tmp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+    os.replace(tmp_path, dst_path)
+    return os.path.getsize(src_path), os.path.getsize(dst_path)
+
+
+def optimize_images(
+    images_dir: str,
+    cache_dir: str,
+    max_side: int = DEFAULT_MAX_SIDE,
+    quality: int = DEFAULT_QUALITY,
+    workers: Optional[int] = None,
+) -> OptimizeReport:
+    """
+    Готовит оптимизированные JPEG для всех изображений папки
+
+    Результат кладётся в cache_dir под именем <sha256 исходника и параметров>.jpg,
+    поэтому неизменённые файлы повторно не обрабатываются.
+
+    Args:
+        images_dir: Папка с исходными изображениями
+        cache_dir: Папка кеша оптимизированных файлов
+        max_side: Максимальный размер большей стороны в пикселях
+        quality: Качество JPEG
+        workers: Число процессов (None — по числу CPU)
+
+    Returns:
+        OptimizeReport: Итоги прогона
+    """
+    report = OptimizeReport()
+    if Image is None:
+        logger.warning("Pillow не установлен — оптимизация изображений пропущена")
+        return report
+    if not os.path.isdir(images_dir):
+        logger.warning(f"Папка с изображениями не найдена: {images_dir}")
+        return report
+
+    started = time.monotonic()
+    os.makedirs(cache_dir, exist_ok=True)
+    old_manifest = load_manifest(cache_dir)
+    manifest: Dict[str, Dict[str, str]] = {}
+    jobs: Dict[str, Tuple[str, str, str]] = {}
+    for filename in sorted(os.listdir(images_dir)):
+        if not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        key = filename.lower()
+        src_path = os.path.join(images_dir, filename)
+        src_hash = _file_sha256(src_path)
+        output = hashlib.sha256(f"{src_hash}:{max_side}:{quality}".encode()).hexdigest()[:32] + ".jpg"
+        previous = old_manifest.get(key)
+        if previous and previous.get("sha256") == src_hash and previous.get("params") == f"{max_side}:{quality}" \
+                and (not previous.get("output") or os.path.exists(os.path.join(cache_dir, previous["output"]))):
+            manifest[key] = previous
+            report.reused += 1
+            src_size = os.path.getsize(src_path)
+            report.source_bytes += src_size
+            report.output_bytes += os.path.getsize(os.path.join(cache_dir, previous["output"])) \
+                if previous.get("output") else src_size
+            continue
+        jobs[key] = (src_path, src_hash, output)
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                key: pool.submit(_optimize_one, src_path, os.path.join(cache_dir, output), max_side, quality)
+                for key, (src_path, _src_hash, output) in jobs.items()
+            }
+            for key, future in futures.items():
+                src_path, src_hash, output = jobs[key]
+                try:
+                    src_size, dst_size = future.result()
+                except Exception as e:
+                    report.failed += 1
+                    report.errors.append(f"{key}: {e}")
+                    logger.warning(f"Не удалось оптимизировать {key}: {e}")
+                    continue
+                report.processed += 1
+                report.source_bytes += src_size
+                if dst_size >= src_size:
+                    # JPEG не выиграл — отдаём исходный файл
+                    os.remove(os.path.join(cache_dir, output))
+                    output = ""
+                    report.skipped += 1
+                    dst_size = src_size
+                report.output_bytes += dst_size
+                manifest[key] = {"sha256": src_hash, "params": f"{max_side}:{quality}", "output": output}
+
+    # удаляем файлы, на которые манифест больше не ссылается
+    used = {entry["output"] for entry in manifest.values() if entry.get("output")}
+    for name in os.listdir(cache_dir):
+        if name.endswith('.jpg') and name not in used:
+            os.remove(os.path.join(cache_dir, name))
+    _save_manifest(cache_dir, manifest)
+    report.seconds = time.monotonic() - started
+    logger.info(f"Оптимизация изображений: {report.summary()}")
+    return report
+
+
+def compose_grid(
+    src_paths: List[str],
+    dst_path: str,
+    max_side: int = DEFAULT_MAX_SIDE,
+    quality: int = DEFAULT_QUALITY,
+    gap: int = 8,
+) -> int:
+    """
+    Собирает несколько изображений в одну сетку (например, все уровни вопроса)
+
+    Args:
+        src_paths: Пути к изображениям в порядке показа
+        dst_path: Куда сохранить JPEG
+        max_side: Максимальный размер большей стороны результата
+        quality: Качество JPEG
+        gap: Отступ между ячейками в пикселях
+
+    Returns:
+        int: Размер результата в байтах
+    """
+    if Image is None:
+        raise RuntimeError("Pillow не установлен")
+    cols = math.ceil(math.sqrt(len(src_paths)))
+    rows = math.ceil(len(src_paths) / cols)
+    cell = (max_side - gap * (max(cols, rows) - 1)) // max(cols, rows)
+    grid = Image.new('RGB', (cols * cell + gap * (cols - 1), rows * cell + gap * (rows - 1)), (255, 255, 255))
+    for i, src_path in enumerate(src_paths):
+        with Image.open(src_path) as img:
+            img.load()
+            tile = _to_rgb(img)
+            tile.thumbnail((cell, cell), Image.LANCZOS)
+        x = (i % cols) * (cell + gap) + (cell - tile.width) // 2
+        y = (i // cols) * (cell + gap) + (cell - tile.height) // 2
+        grid.paste(tile, (x, y))
+    tmp_path = dst_path + '.tmp'
+    grid.save(tmp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+    os.replace(tmp_path, dst_path)
+    return os.path.getsize(dst_path)
@@ -1,79 +1,330 @@
 """Сервис для работы с изображениями"""
+import asyncio
+import hashlib
+import json
 import os
-from typing import Dict, Optional
-from aiogram.types import FSInputFile
+import time
+from typing import Dict, Iterable, List, Optional, Union
+from aiogram.types import FSInputFile, Message
 import logging
 
+from app.services.image_optimizer import compose_grid, is_available, load_manifest
+
 logger = logging.getLogger(__name__)
 
 
 class ImageService:
     """Сервис для кеширования и получения изображений"""
-    
-    def __init__(self, images_dir: str):
+
+    IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.jfif')
+
+    def __init__(
+        self,
+        images_dir: str,
+        file_id_cache: Optional[str] = None,
+        optimized_dir: Optional[str] = None,
+        aliases: Optional[Dict[str, str]] = None,
+    ):
+        """
+        Args:
+            images_dir: Папка с изображениями опроса
+            file_id_cache: JSON файл для сохранения Telegram file_id загруженных изображений
+            optimized_dir: Кеш оптимизированных JPEG (см. image_optimizer); если для файла есть
+                актуальная версия, отправляется она
+            aliases: Псевдонимы {имя в опросе: файл} для ссылок, не совпадающих с именами файлов
+        """
         self.images_dir = images_dir
+        self.optimized_dir = optimized_dir
         self.image_cache = {}
+        # sha256 содержимого по ключу кеша — по нему file_id инвалидируется при замене файла
+        self.image_hashes: Dict[str, str] = {}
+        self.file_id_cache = file_id_cache
+        # {bot_id: {ключ: {"sha256": ..., "file_id": ...}}} — file_id действителен только для своего бота
+        self._file_ids: Dict[str, Dict[str, Dict[str, str]]] = {}
+        # набор изображений (ключи кеша) -> ключ составной картинки-сетки
+        self._composites: Dict[tuple, str] = {}
         self._load_images()
+        self._build_index(aliases)
+        self._load_file_ids()
 
     def _load_images(self):
         if not os.path.exists(self.images_dir):
             logger.warning(f"Папка с изображениями не найдена: {self.images_dir}")
             return
-        
+
+        manifest = load_manifest(self.optimized_dir) if self.optimized_dir else {}
         for filename in os.listdir(self.images_dir):
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.jfif')):
+            if filename.lower().endswith(self.IMAGE_EXTENSIONS):
                 path = os.path.join(self.images_dir, filename)
                 try:
                     key = filename.lower()
-                    self.image_cache[key] = FSInputFile(path)
+                    with open(path, 'rb') as f:
+                        digest = hashlib.sha256(f.read()).hexdigest()
+                    entry = manifest.get(key)
+                    if entry and entry.get("sha256") == digest and entry.get("output") \
+                            and os.path.exists(os.path.join(self.optimized_dir, entry["output"])):
+                        # оптимизированная копия актуальна — отправляем её
+                        self.image_cache[key] = FSInputFile(
+                            os.path.join(self.optimized_dir, entry["output"]),
+                            filename=os.path.splitext(key)[0] + ".jpg",
+                        )
+                        digest = f"{digest}:{entry['output']}"
+                    else:
+                        self.image_cache[key] = FSInputFile(path)
+                    self.image_hashes[key] = digest
                     logger.info(f"Кешировано изображение: {key}")
                 except Exception as e:
                     logger.error(f"Ошибка кеширования {filename}: {e}")
 
-    def has_image(self, filename: str) -> bool:
-        key = filename.lower()
-        if key in self.image_cache:
-            logger.info(f"Проверка изображения '{key}': найдено")
-            return True
-
-        # попробуем альтернативные расширения
-        name, _ = os.path.splitext(key)
-        for ext in ('.png', '.jpg', '.jpeg', '.jfif'):
-            alt = name + ext
-            if alt in self.image_cache:
-                logger.info(f"Проверка изображения '{key}': найдено по альтернативному имени {alt}")
-                return True
-
-        # попытка найти по basename (устранение опечаток, например 'rafficlights.png' -> 'trafficlights.png')
-        for cached in self.image_cache.keys():
-            if os.path.splitext(cached)[0].endswith(name) or name.endswith(os.path.splitext(cached)[0]):
-                logger.info(f"Проверка изображения '{key}': найдено по похожему имени {cached}")
-                return True
-
-        logger.info(f"Проверка изображения '{key}': не найдено")
-        return False
-
-    def get_image(self, filename: str) -> Optional[FSInputFile]:
+    def _load_file_ids(self):
+        if not self.file_id_cache or not os.path.exists(self.file_id_cache):
+            return
+        try:
+            with open(self.file_id_cache, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать кеш file_id {self.file_id_cache}: {e}")
+            return
+
+        stale = 0
+        for bot_id, entries in raw.items():
+            for key, entry in entries.items():
+                # файл изменился или удалён — старый file_id показывает старую картинку
+                if self.image_hashes.get(key) != entry.get("sha256") or not entry.get("file_id"):
+                    stale += 1
+                    continue
+                self._file_ids.setdefault(bot_id, {})[key] = entry
+        logger.info(f"Загружено file_id: {sum(len(v) for v in self._file_ids.values())}, устаревших: {stale}")
+
+    def _save_file_ids(self):
+        if not self.file_id_cache:
+            return
+        tmp_path = self.file_id_cache + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._file_ids, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.file_id_cache)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить кеш file_id {self.file_id_cache}: {e}")
+
+    def _build_index(self, aliases: Optional[Dict[str, str]] = None) -> None:
+        """Индекс имя -> ключ кеша: точные имена, варианты расширения и заданные псевдонимы"""
+        self._index: Dict[str, Optional[str]] = {key: key for key in self.image_cache}
+        by_stem: Dict[str, Dict[str, str]] = {}
+        for key in self.image_cache:
+            stem, ext = os.path.splitext(key)
+            by_stem.setdefault(stem, {})[ext] = key
+        for stem, variants in by_stem.items():
+            # при нескольких файлах с одним именем предпочитаем расширение по порядку IMAGE_EXTENSIONS
+            preferred = next(variants[ext] for ext in self.IMAGE_EXTENSIONS + tuple(variants) if ext in variants)
+            for ext in self.IMAGE_EXTENSIONS:
+                self._index.setdefault(stem + ext, preferred)
+            self._index.setdefault(stem, preferred)
+        for alias, target in (aliases or {}).items():
+            resolved = self._index.get(target.lower())
+            if resolved is None:
+                logger.warning(f"Псевдоним изображения {alias} -> {target}: файл не найден")
+                continue
+            self._index[alias.lower()] = resolved
+
+    def _fuzzy_candidates(self, key: str) -> List[str]:
+        """Похожие имена (суффикс/префикс), например 'rafficlights.png' -> 'trafficlights.png'"""
+        name = os.path.splitext(key)[0] or key
+        if name in self._index:
+            # искажённое расширение при точном имени, например 'angle.jd' -> 'angle.jfif'
+            return [self._index[name]]
+        candidates = []
+        for cached in sorted(self.image_cache):
+            stem = os.path.splitext(cached)[0]
+            if name and (stem.endswith(name) or name.endswith(stem)):
+                candidates.append(cached)
+        return candidates
+
+    def index_references(self, filenames: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        Разрешает ссылки опроса на изображения заранее и сообщает о проблемах
+
+        Args:
+            filenames: Имена изображений из опроса (Question.image / Level.image)
+
+        Returns:
+            Dict[str, List[str]]: {"missing": [...], "ambiguous": [...], "fuzzy": [...]}
+        """
+        report: Dict[str, List[str]] = {"missing": [], "ambiguous": [], "fuzzy": []}
+        for filename in filenames:
+            key = filename.lower()
+            if key in self._index:
+                if self._index[key] is None:
+                    report["missing"].append(filename)
+                continue
+            candidates = self._fuzzy_candidates(key)
+            self._index[key] = candidates[0] if candidates else None
+            if not candidates:
+                report["missing"].append(filename)
+            elif len(candidates) > 1:
+                report["ambiguous"].append(f"{filename} -> {', '.join(candidates)}")
+            else:
+                report["fuzzy"].append(f"{filename} -> {candidates[0]}")
+        for name in report["fuzzy"]:
+            logger.info(f"Изображение найдено по похожему имени: {name}")
+        for name in report["ambiguous"]:
+            logger.warning(f"Неоднозначная ссылка на изображение (взят первый вариант): {name}")
+        if report["missing"]:
+            logger.warning(f"Изображения не найдены: {', '.join(report['missing'])}")
+        return report
+
+    def _resolve(self, filename: str) -> Optional[str]:
+        """Ключ кеша для имени файла; ссылки вне индекса разрешаются один раз и запоминаются"""
         key = filename.lower()
-        img = self.image_cache.get(key)
-        if img:
-            return img
-
-        # альтернативные расширения
-        name, _ = os.path.splitext(key)
-        for ext in ('.png', '.jpg', '.jpeg', '.jfif'):
-            alt = name + ext
-            img = self.image_cache.get(alt)
-            if img:
-                logger.info(f"get_image: resolved {key} -> {alt}")
-                return img
-
-        # похожие имена (суффикс/префикс)
-        for cached, imgf in self.image_cache.items():
-            if os.path.splitext(cached)[0].endswith(name) or name.endswith(os.path.splitext(cached)[0]):
-                logger.info(f"get_image: resolved {key} -> {cached}")
-                return imgf
-
-        logger.warning(f"Изображение '{key}' не найдено в кеше")
-        return None
-    
\ No newline at end of file
+        try:
+            return self._index[key]
+        except KeyError:
+            self.index_references([filename])
+            return self._index[key]
+
+    def build_composite(self, filenames: List[str]) -> Optional[str]:
+        """
+        Готовит (или берёт с диска) одну картинку-сетку из нескольких изображений
+
+        Args:
+            filenames: Имена изображений в порядке показа
+
+        Returns:
+            Optional[str]: Ключ составного изображения для get_image или None, если собрать нельзя
+        """
+        members = tuple(dict.fromkeys(k for k in (self._resolve(f) for f in filenames) if k is not None))
+        if len(members) < 2:
+            return None
+        if members in self._composites:
+            return self._composites[members]
+        if not self.optimized_dir or not is_available():
+            return None
+        digest = hashlib.sha256("|".join(self.image_hashes.get(k, k) for k in members).encode()).hexdigest()
+        key = f"composite_{digest[:16]}.jpg"
+        path = os.path.join(self.optimized_dir, "composites", key)
+        try:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                compose_grid([self.image_cache[k].path for k in members], path)
+                logger.info(f"Собрано составное изображение {key} из {len(members)} файлов")
+        except Exception as e:
+            logger.warning(f"Не удалось собрать составное изображение из {', '.join(members)}: {e}")
+            return None
+        self.image_cache[key] = FSInputFile(path)
+        self.image_hashes[key] = digest
+        self._index[key] = key
+        self._composites[members] = key
+        return key
+
+    def get_composite(self, filenames: List[str]) -> Optional[str]:
+        """Ключ заранее собранной сетки для набора изображений или None"""
+        members = tuple(dict.fromkeys(k for k in (self._resolve(f) for f in filenames) if k is not None))
+        return self._composites.get(members)
+
+    def composite_names(self) -> List[str]:
+        """Ключи всех собранных составных изображений"""
+        return list(self._composites.values())
+
+    def has_image(self, filename: str) -> bool:
+        return self._resolve(filename) is not None
+
+    def get_image(self, filename: str, bot_id: Optional[int] = None) -> Optional[Union[str, FSInputFile]]:
+        """
+        Возвращает изображение для отправки: сохранённый file_id (если бот уже загружал
+        этот файл и он не менялся), иначе FSInputFile для загрузки
+        """
+        resolved = self._resolve(filename)
+        if resolved is None:
+            return None
+        if bot_id is not None:
+            entry = self._file_ids.get(str(bot_id), {}).get(resolved)
+            if entry is not None:
+                return entry["file_id"]
+        return self.image_cache[resolved]
+
+    def remember_file_id(self, filename: str, bot_id: Optional[int], sent: Optional[Message]) -> None:
+        """Запоминает file_id, который Telegram вернул после первой загрузки файла"""
+        if bot_id is None or sent is None or not getattr(sent, 'photo', None):
+            return
+        resolved = self._resolve(filename)
+        if resolved is None:
+            return
+        file_id = sent.photo[-1].file_id
+        entries = self._file_ids.setdefault(str(bot_id), {})
+        current = entries.get(resolved)
+        if current is not None and current.get("file_id") == file_id:
+            return
+        entries[resolved] = {"sha256": self.image_hashes.get(resolved, ""), "file_id": file_id}
+        self._save_file_ids()
+
+    def forget_file_id(self, filename: str, bot_id: Optional[int]) -> None:
+        """Удаляет file_id (например, если Telegram его отверг)"""
+        resolved = self._resolve(filename)
+        if bot_id is None or resolved is None:
+            return
+        if self._file_ids.get(str(bot_id), {}).pop(resolved, None) is not None:
+            self._save_file_ids()
+
+    async def prewarm(
+        self,
+        bot,
+        chat_id: int,
+        filenames: Iterable[str],
+        concurrency: int = 4,
+        timeout: float = 60.0,
+    ) -> Dict[str, int]:
+        """
+        Заранее загружает изображения в служебный чат, чтобы первые респонденты
+        получали их уже по file_id
+
+        Args:
+            bot: Bot, от имени которого загружаются файлы (file_id привязан к боту)
+            chat_id: Служебный чат (канал/группа/админ), куда отправляются фото
+            filenames: Имена изображений из опроса
+            concurrency: Сколько загрузок выполнять одновременно
+            timeout: Общий лимит времени на прогрев в секундах
+
+        Returns:
+            Dict[str, int]: Счётчики uploaded / cached / missing / failed / bytes
+        """
+        stats = {"uploaded": 0, "cached": 0, "missing": 0, "failed": 0, "bytes": 0}
+        pending = {}
+        for filename in filenames:
+            resolved = self._resolve(filename)
+            if resolved is None:
+                logger.warning(f"Прогрев: изображение '{filename}' не найдено")
+                stats["missing"] += 1
+            elif isinstance(self.get_image(resolved, bot.id), str):
+                stats["cached"] += 1
+            else:
+                pending[resolved] = None
+
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+        async def upload(key: str) -> None:
+            async with semaphore:
+                try:
+                    sent = await bot.send_photo(chat_id, photo=self.image_cache[key], disable_notification=True)
+                except Exception as e:
+                    stats["failed"] += 1
+                    logger.warning(f"Прогрев: не удалось загрузить {key}: {e}")
+                    return
+                self.remember_file_id(key, bot.id, sent)
+                stats["uploaded"] += 1
+                stats["bytes"] += os.path.getsize(self.image_cache[key].path)
+
+        started = time.monotonic()
+        tasks = [asyncio.create_task(upload(key)) for key in pending]
+        if tasks:
+            _done, not_done = await asyncio.wait(tasks, timeout=timeout)
+            for task in not_done:
+                task.cancel()
+            if not_done:
+                logger.warning(f"Прогрев: не уложились в {timeout} с, не загружено {len(not_done)}")
+                stats["failed"] += len(not_done)
+        logger.info(
+            f"Прогрев изображений (bot_id={bot.id}): загружено {stats['uploaded']} "
+            f"({stats['bytes'] / 1024:.0f} КБ) за {time.monotonic() - started:.1f} с, "
+            f"уже в кеше {stats['cached']}, не найдено {stats['missing']}, ошибок {stats['failed']}"
+        )
+        return stats
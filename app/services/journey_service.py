@@ -0,0 +1,236 @@
+"""Журнал прохождения опроса: показы вопросов, ответы, отказы"""
+import asyncio
+import datetime
+import logging
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func, insert, select
+
+from app.database.models import async_session, write_session, JourneyEvent
+
+logger = logging.getLogger(__name__)
+
+EVENT_START = "start"
+EVENT_SHOWN = "shown"
+EVENT_ANSWERED = "answered"
+EVENT_FINISH = "finish"
+
+_STEP_RE = re.compile(r'^modul_(\d+):(\d+)(?::level_(\d+))?$')
+
+
+def _step_sort_key(step: str) -> Tuple[int, int, int, str]:
+    m = _STEP_RE.match(step or "")
+    if not m:
+        return (1 << 30, 0, 0, step or "")
+    return (int(m.group(1)), int(m.group(2)), int(m.group(3) or -1), step)
+
+
+class JourneyService:
+    """
+    Поток событий прохождения опроса.
+
+    События копятся в кольцевом буфере в памяти и пачками дописываются в
+    `Событие_опроса`. Воронка (охват шага и медиана времени ответа) считается
+    инкрементально при каждом событии, отчёт не читает ни ответы, ни журнал.
+    """
+
+    def __init__(
+        self,
+        session_maker=async_session,
+        capacity: int = 10000,
+        flush_interval: float = 5.0,
+        dwell_samples: int = 501,
+        run_ttl: float = 86400.0,
+    ):
+        """
+        Args:
+            session_maker: Фабрика async-сессий SQLAlchemy
+            capacity: Размер кольцевого буфера (при переполнении теряются самые старые события)
+            flush_interval: Период сброса буфера в БД в секундах
+            dwell_samples: Сколько последних времён ответа хранить на шаг для медианы
+            run_ttl: Через сколько секунд без событий проход считается брошенным и забывается
+        """
+        self.session_maker = session_maker
+        self.flush_interval = flush_interval
+        self.dwell_samples = dwell_samples
+        self.run_ttl = run_ttl
+        self._buffer: Deque[dict] = deque(maxlen=capacity)
+        self.dropped = 0
+        self._starts = 0
+        self._reach: Dict[str, int] = {}
+        self._dwell: Dict[str, Deque[int]] = {}
+        # текущий проход пользователя: показанные шаги и последний показ (шаг, время)
+        self._seen: Dict[int, Set[str]] = {}
+        self._shown_at: Dict[int, Tuple[str, datetime.datetime]] = {}
+        # время последнего события прохода (monotonic) в порядке активности: брошенные проходы
+        # не доходят до finish(), их вытесняет _evict_stale
+        self._active: "OrderedDict[int, float]" = OrderedDict()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _push(self, user_id: int, event: str, step: Optional[str], now: datetime.datetime,
+              dwell_ms: Optional[int] = None) -> None:
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append({
+            "user_id": user_id, "event": event, "step": step, "dwell_ms": dwell_ms, "created_at": now,
+        })
+
+    def _add_dwell(self, step: str, dwell_ms: int) -> None:
+        samples = self._dwell.get(step)
+        if samples is None:
+            samples = self._dwell[step] = deque(maxlen=self.dwell_samples)
+        samples.append(dwell_ms)
+
+    def _touch(self, user_id: int) -> None:
+        self._active[user_id] = time.monotonic()
+        self._active.move_to_end(user_id)
+
+    def _evict_stale(self) -> int:
+        """Забывает проходы без событий дольше run_ttl
+
+        Returns:
+            int: Сколько проходов забыто
+        """
+        deadline = time.monotonic() - self.run_ttl
+        evicted = 0
+        while self._active:
+            user_id, last = next(iter(self._active.items()))
+            if last > deadline:
+                break
+            self._active.popitem(last=False)
+            self._seen.pop(user_id, None)
+            self._shown_at.pop(user_id, None)
+            evicted += 1
+        return evicted
+
+    def start(self, user_id: int) -> None:
+        """Начало нового прохождения"""
+        now = datetime.datetime.utcnow()
+        self._evict_stale()
+        self._touch(user_id)
+        self._seen[user_id] = set()
+        self._shown_at.pop(user_id, None)
+        self._starts += 1
+        self._push(user_id, EVENT_START, None, now)
+
+    def shown(self, user_id: int, step: str) -> None:
+        """Вопрос (или уровень вопроса) показан пользователю"""
+        now = datetime.datetime.utcnow()
+        self._touch(user_id)
+        seen = self._seen.setdefault(user_id, set())
+        if step in seen:
+            # повторный показ того же шага (например, после ошибки) не меняет охват и не сбрасывает таймер
+            return
+        seen.add(step)
+        self._shown_at[user_id] = (step, now)
+        self._reach[step] = self._reach.get(step, 0) + 1
+        self._push(user_id, EVENT_SHOWN, step, now)
+
+    def answered(self, user_id: int, step: str) -> None:
+        """Пользователь ответил на шаг"""
+        now = datetime.datetime.utcnow()
+        self._touch(user_id)
+        dwell_ms = None
+        shown = self._shown_at.get(user_id)
+        if shown is not None and shown[0] == step:
+            dwell_ms = int((now - shown[1]).total_seconds() * 1000)
+            self._add_dwell(step, dwell_ms)
+        self._push(user_id, EVENT_ANSWERED, step, now, dwell_ms)
+
+    def finish(self, user_id: int) -> None:
+        """Опрос завершён"""
+        now = datetime.datetime.utcnow()
+        self._active.pop(user_id, None)
+        self._seen.pop(user_id, None)
+        self._shown_at.pop(user_id, None)
+        self._push(user_id, EVENT_FINISH, None, now)
+
+    def funnel(self) -> List[Tuple[str, int, Optional[float]]]:
+        """
+        Воронка по шагам в порядке опроса
+
+        Returns:
+            List[Tuple[str, int, Optional[float]]]: (шаг, охват, медиана времени ответа в секундах)
+        """
+        rows = []
+        for step in sorted(self._reach, key=_step_sort_key):
+            samples = sorted(self._dwell.get(step) or ())
+            median = None
+            if samples:
+                mid = len(samples) // 2
+                median_ms = samples[mid] if len(samples) % 2 else (samples[mid - 1] + samples[mid]) / 2
+                median = median_ms / 1000.0
+            rows.append((step, self._reach[step], median))
+        return rows
+
+    @property
+    def starts(self) -> int:
+        return self._starts
+
+    async def load(self) -> None:
+        """Восстанавливает охват и последние времена ответа из журнала"""
+        async with self.session_maker() as session:
+            res = await session.execute(
+                select(JourneyEvent.event, JourneyEvent.step, func.count())
+                .where(JourneyEvent.event.in_([EVENT_START, EVENT_SHOWN]))
+                .group_by(JourneyEvent.event, JourneyEvent.step)
+            )
+            for event, step, count in res.all():
+                if event == EVENT_START:
+                    self._starts += count
+                elif step:
+                    self._reach[step] = self._reach.get(step, 0) + count
+            res = await session.execute(
+                select(JourneyEvent.step, JourneyEvent.dwell_ms)
+                .where(JourneyEvent.event == EVENT_ANSWERED, JourneyEvent.dwell_ms.is_not(None))
+                .order_by(JourneyEvent.id.desc())
+                .limit(self.dwell_samples * max(len(self._reach), 1))
+            )
+            for step, dwell_ms in reversed(res.all()):
+                self._add_dwell(step, dwell_ms)
+        logger.info("JourneyService: seeded %s steps, %s starts", len(self._reach), self._starts)
+
+    async def flush(self) -> None:
+        """Дописывает накопленные события в `Событие_опроса` одной вставкой"""
+        if not self._buffer:
+            return
+        batch = list(self._buffer)
+        self._buffer.clear()
+        try:
+            async with write_session(self.session_maker) as session:
+                await session.execute(insert(JourneyEvent), batch)
+                await session.commit()
+        except Exception:
+            # вернём события в начало буфера; при переполнении кольцо отбросит самые старые
+            self._buffer = deque(batch + list(self._buffer), maxlen=self._buffer.maxlen)
+            raise
+
+    def start_flushing(self) -> None:
+        """Запускает периодический сброс буфера"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Останавливает фоновый сброс и сбрасывает остаток"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            evicted = self._evict_stale()
+            if evicted:
+                logger.debug("JourneyService: forgot %s abandoned runs", evicted)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("JourneyService: flush failed, will retry")
@@ -0,0 +1,217 @@
+"""Сервис квот выборки (возраст/пол и т.п.) со счётчиками в памяти"""
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert, select
+
+from app.database.models import async_session, write_session, QuotaCounter
+
+logger = logging.getLogger(__name__)
+
+# Разделитель ключей и значений в составных ячейках ("modul_1:1|modul_1:2" -> "18-34|Мужской")
+CELL_SEPARATOR = "|"
+
+
+def load_quota_limits(file_path: str) -> Dict[str, Dict[str, int]]:
+    """
+    Загружает лимиты квот из JSON файла
+
+    Формат: {"modul_1:1": {"18-34": 100, ...}, "modul_1:1|modul_1:2": {"18-34|Мужской": 50}}
+
+    Args:
+        file_path: Путь к JSON файлу
+
+    Returns:
+        Dict[str, Dict[str, int]]: Лимиты по измерениям и ячейкам
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    return {dim: {cell: int(limit) for cell, limit in cells.items()} for dim, cells in raw.items()}
+
+
+class QuotaService:
+    """
+    Квоты на число завершённых анкет по ячейкам выборки.
+
+    Счётчики живут в памяти и увеличиваются после коммита сохранения анкеты
+    (слушатель DBService), поэтому проверка квоты — обращение к словарю.
+    Приращения периодически пачкой дописываются в `Квота_счётчик`, при старте
+    счётчики восстанавливаются одним агрегирующим запросом.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, Dict[str, int]],
+        session_maker=async_session,
+        flush_interval: float = 30.0,
+        survey_service=None,
+    ):
+        """
+        Args:
+            limits: Лимиты {измерение: {ячейка: лимит}}
+            session_maker: Фабрика async-сессий SQLAlchemy
+            flush_interval: Период сброса приращений в БД в секундах
+            survey_service: SurveyService — чтобы знать полное число ячеек измерения
+        """
+        self.limits = limits
+        self.session_maker = session_maker
+        self.flush_interval = flush_interval
+        self.dimensions: Dict[str, Tuple[str, ...]] = {
+            dim: tuple(dim.split(CELL_SEPARATOR)) for dim in limits
+        }
+        # ключ ответа -> измерения, в которые он входит
+        self._dims_by_key: Dict[str, List[str]] = {}
+        for dim, keys in self.dimensions.items():
+            for key in keys:
+                self._dims_by_key.setdefault(key, []).append(dim)
+        self._counts: Dict[Tuple[str, str], int] = {}
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._full_cells: Dict[str, int] = {dim: 0 for dim in limits}
+        self._cell_total: Dict[str, int] = {
+            dim: self._count_cells(dim, survey_service) for dim in limits
+        }
+        self._closed: set = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _count_cells(self, dim: str, survey_service) -> int:
+        """Число возможных ячеек измерения: произведение числа вариантов его вопросов"""
+        if survey_service is None:
+            return len(self.limits[dim])
+        total = 1
+        for key in self.dimensions[dim]:
+            module, _, qid = key.partition(":")
+            question = survey_service.get_question(module, int(qid)) if qid.isdigit() else None
+            if question is None or not question.options:
+                return len(self.limits[dim])
+            total *= len(question.options)
+        return total
+
+    def _cell_for(self, dim: str, answers: Dict[str, Any]) -> Optional[str]:
+        values = []
+        for key in self.dimensions[dim]:
+            value = answers.get(key)
+            if not isinstance(value, str):
+                return None
+            values.append(value)
+        return CELL_SEPARATOR.join(values)
+
+    def _add(self, dim: str, cell: str, delta: int) -> None:
+        key = (dim, cell)
+        limit = self.limits[dim].get(cell)
+        was_full = limit is not None and self._counts.get(key, 0) >= limit
+        self._counts[key] = self._counts.get(key, 0) + delta
+        is_full = limit is not None and self._counts[key] >= limit
+        if is_full != was_full:
+            self._full_cells[dim] += 1 if is_full else -1
+            if self._full_cells[dim] >= self._cell_total[dim]:
+                self._closed.add(dim)
+            else:
+                self._closed.discard(dim)
+
+    def is_quota_key(self, answer_key: str) -> bool:
+        """Участвует ли ключ ответа ("modul_1:1") в каком-либо измерении"""
+        return answer_key in self._dims_by_key
+
+    def is_closed(self) -> bool:
+        """True, если в каком-либо измерении заполнены все ячейки — новые старты бессмысленны"""
+        return bool(self._closed)
+
+    def check(self, answers: Dict[str, Any]) -> Optional[str]:
+        """
+        Проверяет, не попадает ли респондент в уже заполненную ячейку
+
+        Args:
+            answers: Текущие ответы респондента
+
+        Returns:
+            Optional[str]: Измерение с заполненной ячейкой или None
+        """
+        for dim in self.limits:
+            cell = self._cell_for(dim, answers)
+            if cell is None:
+                continue
+            limit = self.limits[dim].get(cell)
+            if limit is not None and self._counts.get((dim, cell), 0) >= limit:
+                return dim
+        return None
+
+    def record(self, answers: Dict[str, Any]) -> None:
+        """Засчитывает завершённую анкету во все подходящие ячейки"""
+        for dim in self.limits:
+            cell = self._cell_for(dim, answers)
+            if cell is None:
+                continue
+            self._add(dim, cell, 1)
+            self._pending[(dim, cell)] = self._pending.get((dim, cell), 0) + 1
+
+    async def on_save_committed(self, tg_id: int, anketa_id, answers: Dict[str, Any], created: bool) -> None:
+        """Слушатель DBService: считаем только первое завершение (повторное прохождение не добавляет)"""
+        if created:
+            self.record(answers)
+
+    def snapshot(self) -> List[Tuple[str, str, int, Optional[int], int]]:
+        """Строки (измерение, ячейка, счётчик, лимит, не сброшено) для отчёта"""
+        rows = []
+        for dim, cells in self.limits.items():
+            seen = set(cells) | {cell for (d, cell) in self._counts if d == dim}
+            for cell in sorted(seen):
+                rows.append((dim, cell, self._counts.get((dim, cell), 0), cells.get(cell),
+                             self._pending.get((dim, cell), 0)))
+        return rows
+
+    async def load(self) -> None:
+        """Восстанавливает счётчики из журнала одним агрегирующим запросом"""
+        async with self.session_maker() as session:
+            res = await session.execute(
+                select(QuotaCounter.dimension, QuotaCounter.cell, func.sum(QuotaCounter.delta))
+                .group_by(QuotaCounter.dimension, QuotaCounter.cell)
+            )
+            rows = res.all()
+        for dim, cell, total in rows:
+            if dim in self.limits:
+                self._add(dim, cell, int(total or 0))
+        logger.info("QuotaService: seeded %s cells, closed=%s", len(rows), sorted(self._closed))
+
+    async def flush(self) -> None:
+        """Дописывает накопленные приращения в `Квота_счётчик` одной вставкой"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            async with write_session(self.session_maker) as session:
+                await session.execute(
+                    insert(QuotaCounter),
+                    [{"dimension": dim, "cell": cell, "delta": delta} for (dim, cell), delta in pending.items()],
+                )
+                await session.commit()
+        except Exception:
+            # вернём приращения, чтобы не потерять их при следующем сбросе
+            for key, delta in pending.items():
+                self._pending[key] = self._pending.get(key, 0) + delta
+            raise
+
+    def start(self) -> None:
+        """Запускает периодический сброс счётчиков"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Останавливает фоновый сброс и сбрасывает остаток"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("QuotaService: flush failed, will retry")
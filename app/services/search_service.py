@@ -0,0 +1,195 @@
+"""Полнотекстовый поиск по свободным ответам ("Другой вариант")"""
+import bisect
+import logging
+import math
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from sqlalchemy import delete, insert, select
+
+from app.database.models import async_session, write_session, CustomAnswerDoc
+
+logger = logging.getLogger(__name__)
+
+CUSTOM_SUFFIX = ":custom_answer"
+
+_TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+_STOP_WORDS = frozenset(
+    "и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только "
+    "ее мне было вот от меня еще нет о из ему теперь когда даже ну ли если уже или ни быть был "
+    "до вас нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для "
+    "мы тебя их чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того "
+    "потому этого какой совсем ним здесь этом один почти мой тем чтобы нее были куда зачем всех "
+    "никогда можно при наконец два об другой хоть после над больше тот через эти нас про всего "
+    "них какая много разве три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя "
+    "такой им более всегда конечно всю между это".split()
+)
+# Окончания для лёгкого стемминга (от длинных к коротким)
+_ENDINGS = sorted(
+    (
+        "иями ями ами ого его ому ему ыми ими ешь ете ишь ите ются утся ость ости ение ения "
+        "ых их ой ей ый ий ая яя ое ее ые ие ую юю ам ям ах ях ом ем ов ев ия ию ии ть ти ет ут ют "
+        "ит ат ят ал ил ла ло ли а я о е ы и у ю ь й"
+    ).split(),
+    key=len,
+    reverse=True,
+)
+
+
+def _stem(token: str) -> str:
+    for ending in _ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= 3:
+            return token[:-len(ending)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Приводит текст к списку основ: регистр и ё сворачиваются, стоп-слова отбрасываются"""
+    folded = (text or "").lower().replace("ё", "е")
+    return [_stem(t) for t in _TOKEN_RE.findall(folded) if t not in _STOP_WORDS and len(t) > 1]
+
+
+@dataclass
+class SearchHit:
+    """Результат поиска"""
+    doc_id: int
+    score: float
+    anketa_id: int
+    user_id: int
+    question_key: str
+    text: str
+
+
+class SearchService:
+    """
+    Инвертированный индекс свободных ответов.
+
+    Документы хранятся в таблице `Свободный_ответ`; постинги строятся в памяти
+    при загрузке и обновляются инкрементально слушателем сохранения анкеты.
+    Ранжирование — BM25, термины запроса дополняются по префиксу основы.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, session_maker=async_session):
+        self.session_maker = session_maker
+        self._docs: Dict[int, Tuple[int, int, str, str]] = {}
+        self._doc_len: Dict[int, int] = {}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._vocab: List[str] = []
+        self._by_anketa: Dict[int, List[int]] = {}
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _index(self, doc_id: int, anketa_id: int, user_id: int, question_key: str, text: str) -> None:
+        tokens = tokenize(text)
+        self._docs[doc_id] = (anketa_id, user_id, question_key, text)
+        self._doc_len[doc_id] = len(tokens)
+        self._total_len += len(tokens)
+        self._by_anketa.setdefault(anketa_id, []).append(doc_id)
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                bisect.insort(self._vocab, token)
+            postings[doc_id] = postings.get(doc_id, 0) + 1
+
+    def _unindex(self, doc_id: int) -> None:
+        anketa_id, _user_id, _key, text = self._docs.pop(doc_id)
+        self._total_len -= self._doc_len.pop(doc_id, 0)
+        for token in set(tokenize(text)):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[token]
+                i = bisect.bisect_left(self._vocab, token)
+                if i < len(self._vocab) and self._vocab[i] == token:
+                    del self._vocab[i]
+        ids = self._by_anketa.get(anketa_id)
+        if ids is not None:
+            ids.remove(doc_id)
+            if not ids:
+                del self._by_anketa[anketa_id]
+
+    def _expand(self, term: str) -> List[str]:
+        i = bisect.bisect_left(self._vocab, term)
+        result = []
+        while i < len(self._vocab) and self._vocab[i].startswith(term):
+            result.append(self._vocab[i])
+            i += 1
+        return result
+
+    async def load(self) -> None:
+        """Строит индекс по всем документам таблицы `Свободный_ответ`"""
+        async with self.session_maker() as session:
+            res = await session.execute(select(
+                CustomAnswerDoc.id, CustomAnswerDoc.anketa_id, CustomAnswerDoc.user_id,
+                CustomAnswerDoc.question_key, CustomAnswerDoc.text,
+            ))
+            rows = res.all()
+        for row in rows:
+            self._index(*row)
+        logger.info("SearchService: indexed %s custom answers, %s terms", len(self._docs), len(self._postings))
+
+    async def on_save_committed(self, tg_id: int, anketa_id, answers: dict, created: bool) -> None:
+        """Слушатель DBService: переиндексирует свободные ответы сохранённой анкеты"""
+        if anketa_id is None:
+            return
+        docs = [
+            {"anketa_id": anketa_id, "user_id": tg_id, "question_key": key[:-len(CUSTOM_SUFFIX)], "text": value}
+            for key, value in (answers or {}).items()
+            if str(key).endswith(CUSTOM_SUFFIX) and isinstance(value, str) and value.strip()
+        ]
+        if not docs and anketa_id not in self._by_anketa:
+            return
+        async with write_session(self.session_maker) as session:
+            await session.execute(delete(CustomAnswerDoc).where(CustomAnswerDoc.anketa_id == anketa_id))
+            ids = []
+            if docs:
+                res = await session.execute(insert(CustomAnswerDoc).returning(CustomAnswerDoc.id), docs)
+                ids = list(res.scalars().all())
+            await session.commit()
+        for doc_id in list(self._by_anketa.get(anketa_id, [])):
+            self._unindex(doc_id)
+        for doc_id, doc in zip(ids, docs):
+            self._index(doc_id, doc["anketa_id"], doc["user_id"], doc["question_key"], doc["text"])
+
+    def search(self, query: str, page: int = 1, page_size: int = 10) -> Tuple[int, List[SearchHit]]:
+        """
+        Ищет свободные ответы по запросу
+
+        Args:
+            query: Текст запроса
+            page: Номер страницы (с 1)
+            page_size: Размер страницы
+
+        Returns:
+            Tuple[int, List[SearchHit]]: (всего найдено, результаты страницы)
+        """
+        n_docs = len(self._docs)
+        if not n_docs:
+            return 0, []
+        avg_len = self._total_len / n_docs or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            for token in self._expand(term):
+                postings = self._postings[token]
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                # точное совпадение основы весит больше, чем совпадение по префиксу
+                weight = idf if token == term else idf * 0.5
+                for doc_id, tf in postings.items():
+                    norm = tf + self.K1 * (1 - self.B + self.B * self._doc_len[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + weight * tf * (self.K1 + 1) / norm
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        start = max(page - 1, 0) * page_size
+        hits = []
+        for doc_id, score in ranked[start:start + page_size]:
+            anketa_id, user_id, question_key, text = self._docs[doc_id]
+            hits.append(SearchHit(doc_id, score, anketa_id, user_id, question_key, text))
+        return len(ranked), hits
@@ -0,0 +1,275 @@
+"""Загрузка опроса из таблиц БД с кешированием снимка и опросом версии"""
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, exists
+
+from app.data.data_models import SurveyData, Module, Question, Level
+from app.database.models import (
+    async_session,
+    Modul,
+    Vopros,
+    Otvet,
+    VoprosOtvet,
+    GroupAnswers,
+    SurveyVersion,
+)
+
+logger = logging.getLogger(__name__)
+
+# import_json_data кладёт ответы уровней в логическую группу "id вопроса + 1000"
+LEVEL_GROUP_OFFSET = 1000
+# ключи уровня, которые import_json_data сериализует в текст ответа ("height: 2-4 см - 4 - сложно")
+LEVEL_FIELDS = ("image", "height", "angle", "surface")
+
+
+class SurveyProvider:
+    """
+    Собирает SurveyData из таблиц `Модуль`, `Вопрос`, `Ответ`, `Группа_ответов`, `Вопрос_ответ`.
+
+    Опрос собирается несколькими запросами на всю таблицу (а не по запросу на вопрос),
+    результат кешируется в памяти. Изменения обнаруживаются по строке `Версия_опроса`,
+    которую провайдер опрашивает с низкой частотой; при смене версии снимок
+    пересобирается и передаётся подписчикам (например, SurveyService.set_survey_data).
+    """
+
+    def __init__(self, session_maker=async_session, poll_interval: float = 60.0):
+        """
+        Args:
+            session_maker: Фабрика async-сессий SQLAlchemy
+            poll_interval: Период опроса строки версии в секундах
+        """
+        self.session_maker = session_maker
+        self.poll_interval = poll_interval
+        self.snapshot: Optional[SurveyData] = None
+        self.version: Optional[Tuple[Any, Any]] = None
+        self._subscribers: List[Callable[[SurveyData], None]] = []
+        self._poll_task: Optional[asyncio.Task] = None
+
+    def subscribe(self, callback: Callable[[SurveyData], None]) -> None:
+        """Регистрирует обработчик, вызываемый с новым снимком после перезагрузки"""
+        self._subscribers.append(callback)
+
+    async def get_version(self) -> Optional[Tuple[Any, Any]]:
+        """Возвращает (version, checksum) из `Версия_опроса` или None, если строки нет"""
+        async with self.session_maker() as session:
+            res = await session.execute(
+                select(SurveyVersion.version, SurveyVersion.checksum).where(SurveyVersion.id == 1)
+            )
+            row = res.first()
+        return (row[0], row[1]) if row is not None else None
+
+    async def load(self) -> SurveyData:
+        """
+        Собирает опрос из БД и сохраняет его как текущий снимок
+
+        Returns:
+            SurveyData: Скомпилированный опрос
+
+        Raises:
+            ValueError: Если в таблицах нет ни одного вопроса
+        """
+        async with self.session_maker() as session:
+            version_row, modules, questions, answers, scale = await fetch_survey_rows(session)
+
+        data = build_survey_data(modules, questions, answers, scale)
+        self.snapshot = data
+        self.version = (version_row[0], version_row[1]) if version_row is not None else None
+        logger.info(
+            "SurveyProvider: loaded survey from DB version=%s modules=%s questions=%s",
+            self.version, len(data.modules), len(questions)
+        )
+        return data
+
+    async def refresh(self) -> bool:
+        """
+        Проверяет версию и при изменении пересобирает снимок
+
+        Returns:
+            bool: True, если опрос был перезагружен
+        """
+        version = await self.get_version()
+        if self.snapshot is not None and version == self.version:
+            return False
+        data = await self.load()
+        for callback in self._subscribers:
+            try:
+                callback(data)
+            except Exception:
+                logger.exception("SurveyProvider: subscriber %r failed", callback)
+        return True
+
+    def start_polling(self) -> None:
+        """Запускает фоновую задачу опроса версии"""
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = asyncio.create_task(self._poll_loop())
+
+    async def stop_polling(self) -> None:
+        """Останавливает фоновую задачу опроса версии"""
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            try:
+                await self._poll_task
+            except asyncio.CancelledError:
+                pass
+            self._poll_task = None
+
+    async def _poll_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if await self.refresh():
+                    logger.info("SurveyProvider: survey reloaded, version=%s", self.version)
+            except Exception:
+                # БД может быть временно недоступна — продолжаем работать на старом снимке
+                logger.exception("SurveyProvider: version poll failed, keeping cached survey")
+
+
+def survey_row_queries():
+    """
+    Запросы fetch_survey_rows: (version, modules, questions, answers, options_scale)
+
+    Все ответы всех вопросов одним запросом: Вопрос_ответ ссылается на строку-представителя
+    группы, а сами ответы лежат во всех строках с тем же логическим group_id.
+    Шкала оценок импортируется первой и не входит ни в одну группу.
+    """
+    rep = GroupAnswers.__table__.alias("rep")
+    grp = GroupAnswers.__table__.alias("grp")
+    return (
+        select(SurveyVersion.version, SurveyVersion.checksum).where(SurveyVersion.id == 1),
+        select(Modul.id, Modul.name).order_by(Modul.id),
+        select(Vopros.id, Vopros.module_id, Vopros.text, Vopros.type, Vopros.condition, Vopros.image)
+        .order_by(Vopros.module_id, Vopros.id),
+        select(VoprosOtvet.question_id, grp.c.group_id, Otvet.id, Otvet.text)
+        .join(rep, rep.c.id == VoprosOtvet.group_id)
+        .join(grp, grp.c.group_id == rep.c.group_id)
+        .join(Otvet, Otvet.id == grp.c.answer_id)
+        .order_by(VoprosOtvet.question_id, Otvet.id),
+        select(Otvet.text)
+        .where(~exists().where(GroupAnswers.answer_id == Otvet.id))
+        .order_by(Otvet.id),
+    )
+
+
+async def fetch_survey_rows(session):
+    """
+    Читает таблицы опроса несколькими запросами на всю таблицу
+
+    Returns:
+        (version_row, modules, questions, answers, options_scale) — см. build_survey_data
+    """
+    version_q, modules_q, questions_q, answers_q, scale_q = survey_row_queries()
+    version_row = (await session.execute(version_q)).first()
+    modules = (await session.execute(modules_q)).all()
+    questions = (await session.execute(questions_q)).all()
+    answers = (await session.execute(answers_q)).all()
+    scale = (await session.execute(scale_q)).scalars().all()
+    return version_row, modules, questions, answers, list(scale)
+
+
+def local_question_ids(questions) -> Dict[int, int]:
+    """Вопрос.id -> номер вопроса внутри модуля (в БД id сквозные, бот адресует вопросы по номеру)"""
+    local_ids: Dict[int, int] = {}
+    counters: Dict[Any, int] = {}
+    for row in questions:
+        counters[row.module_id] = counters.get(row.module_id, 0) + 1
+        local_ids[row.id] = counters[row.module_id]
+    return local_ids
+
+
+def split_level_answer(text: str, options_scale: List[str]) -> Tuple[str, str]:
+    """Разделяет "height: 2-4 см - 4 - сложно" на текст уровня и вариант ответа"""
+    for opt in options_scale:
+        suffix = f" - {opt}"
+        if text.endswith(suffix):
+            return text[:-len(suffix)], opt
+    level_text, _, opt = text.partition(" - ")
+    return level_text, opt
+
+
+def _parse_level_text(level_text: str) -> Dict[str, str]:
+    fields = {}
+    for part in level_text.split(" | "):
+        key, sep, value = part.partition(": ")
+        if sep and key in LEVEL_FIELDS:
+            fields[key] = value
+    return fields
+
+
+def _parse_condition(condition: Optional[str], local_ids: Dict[int, int]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Преобразует "Да:3;Нет:4" (глобальные id Вопрос) в формат if из JSON (локальные id)"""
+    if not condition:
+        return None
+    result = {}
+    for part in condition.split(";"):
+        answer, sep, target = part.rpartition(":")
+        if not sep or not target.strip().isdigit():
+            continue
+        target_id = int(target)
+        result[answer] = {"id": local_ids.get(target_id, target_id)}
+    return result or None
+
+
+def build_survey_data(modules, questions, answers, options_scale: List[str]) -> SurveyData:
+    """
+    Собирает SurveyData из строк, полученных SurveyProvider.load
+
+    Args:
+        modules: Строки (id, name) таблицы Модуль
+        questions: Строки (id, module_id, text, type, condition, image) таблицы Вопрос
+        answers: Строки (question_id, group_id, answer_id, text) ответов вопросов
+        options_scale: Тексты шкалы оценок
+
+    Returns:
+        SurveyData: Скомпилированный опрос
+    """
+    if not questions:
+        raise ValueError("В таблице Вопрос нет данных опроса")
+
+    local_ids = local_question_ids(questions)
+    by_module: Dict[Any, List[Any]] = {}
+    for row in questions:
+        by_module.setdefault(row.module_id, []).append(row)
+
+    options: Dict[int, List[str]] = {}
+    level_options: Dict[int, Dict[str, List[str]]] = {}
+    for question_id, group_id, _answer_id, text in answers:
+        if group_id == question_id + LEVEL_GROUP_OFFSET:
+            level_text, opt = split_level_answer(text, options_scale)
+            level_options.setdefault(question_id, {}).setdefault(level_text, []).append(opt)
+        else:
+            options.setdefault(question_id, []).append(text)
+
+    module_names = {mid: name for mid, name in modules}
+    result: Dict[str, Module] = {}
+    for module_id, rows in by_module.items():
+        name = module_names.get(module_id) or f"modul_{module_id}"
+        module_questions: Dict[int, Question] = {}
+        for row in rows:
+            levels = None
+            if row.id in level_options:
+                levels = []
+                # dict сохраняет порядок первого появления — это порядок уровней в исходном JSON
+                for level_text, opts in level_options[row.id].items():
+                    fields = _parse_level_text(level_text)
+                    levels.append(Level(
+                        options=options_scale if opts == options_scale else opts,
+                        image=fields.get("image"),
+                        height=fields.get("height"),
+                        angle=fields.get("angle"),
+                        surface=fields.get("surface"),
+                    ))
+            qid = local_ids[row.id]
+            module_questions[qid] = Question(
+                id=qid,
+                text=row.text,
+                type=row.type,
+                options=options.get(row.id),
+                levels=levels,
+                if_conditions=_parse_condition(row.condition, local_ids),
+                image=row.image,
+            )
+        result[name] = Module(questions=module_questions)
+
+    return SurveyData(modules=result, options_scale=options_scale)
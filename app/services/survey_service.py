@@ -19,7 +19,49 @@ class SurveyService:
             survey_data: Данные опроса
         """
         self.survey_data = survey_data
-    
+
+    def set_survey_data(self, survey_data: SurveyData) -> None:
+        """
+        Подменяет данные опроса (например, после перезагрузки из БД)
+
+        Args:
+            survey_data: Новый скомпилированный опрос
+        """
+        self.survey_data = survey_data
+        logger.info("SurveyService: survey data replaced (modules=%s)", list(survey_data.modules.keys()))
+
+    def get_image_names(self) -> List[str]:
+        """
+        Собирает имена всех изображений опроса (вопросы и уровни) без повторов
+
+        Returns:
+            List[str]: Имена файлов в порядке появления в опросе
+        """
+        names: Dict[str, None] = {}
+        for module in self.survey_data.modules.values():
+            for question in module.questions.values():
+                if question.image:
+                    names[question.image] = None
+                for level in question.levels or []:
+                    if level.image:
+                        names[level.image] = None
+        return list(names)
+
+    def get_level_image_groups(self) -> List[List[str]]:
+        """
+        Наборы изображений уровней по вопросам (то, что показывается перед вопросом с уровнями)
+
+        Returns:
+            List[List[str]]: Уникальные изображения уровней каждого вопроса, где их больше одного
+        """
+        groups = []
+        for module in self.survey_data.modules.values():
+            for question in module.questions.values():
+                images = list(dict.fromkeys(level.image for level in question.levels or [] if level.image))
+                if len(images) > 1:
+                    groups.append(images)
+        return groups
+
     def get_question(self, module: str, question_id: int) -> Optional[Question]:
         """
         Получает вопрос по ID и модулю
@@ -28,6 +28,7 @@ def setup_database():
 
         sql_commands = [
             # Удаление таблиц, если существуют
+            'DROP TABLE IF EXISTS "Версия_опроса" CASCADE',
             'DROP TABLE IF EXISTS "Группа_ответов" CASCADE',
             'DROP TABLE IF EXISTS "Вопрос_ответ" CASCADE',
             'DROP TABLE IF EXISTS "Ответ" CASCADE',
@@ -74,7 +75,8 @@ def setup_database():
             '''
             CREATE TABLE "Ответ" (
                 "id" SERIAL PRIMARY KEY,
-                "text" TEXT NOT NULL
+                "text" TEXT NOT NULL,
+                "label" TEXT
             )
             ''',
 
@@ -106,15 +108,50 @@ def setup_database():
                 "person_id" INTEGER NOT NULL,
                 "question_id" INTEGER,
                 "group_id" INTEGER,
+                "status" VARCHAR(16),
+                "answers" JSONB,
                 CONSTRAINT fk_person FOREIGN KEY ("person_id") REFERENCES "Персона" ("id"),
                 CONSTRAINT fk_question_link FOREIGN KEY ("question_id") REFERENCES "Вопрос" ("id")
             )
             ''',
 
+            # Версия опроса: бот опрашивает эту строку и перезагружает опрос при изменении
+            '''
+            CREATE TABLE "Версия_опроса" (
+                "id" INTEGER PRIMARY KEY,
+                "version" INTEGER NOT NULL DEFAULT 1,
+                "checksum" TEXT,
+                "updated_at" TIMESTAMP DEFAULT now()
+            )
+            ''',
+            'INSERT INTO "Версия_опроса" ("id", "version") VALUES (1, 1)',
+
+            # Любая правка таблиц опроса увеличивает версию
+            '''
+            CREATE OR REPLACE FUNCTION bump_survey_version() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO "Версия_опроса" ("id", "version", "updated_at") VALUES (1, 1, now())
+                ON CONFLICT ("id") DO UPDATE
+                SET "version" = "Версия_опроса"."version" + 1, "updated_at" = now();
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            ''',
+        ] + [
+            f'''
+            CREATE TRIGGER "bump_survey_version_{table}"
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "{table}"
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_survey_version()
+            '''
+            for table in ("Модуль", "Вопрос", "Ответ", "Группа_ответов", "Вопрос_ответ")
+        ] + [
             # Индексы
             'CREATE INDEX idx_question_id ON "Вопрос_ответ" ("question_id")',
             'CREATE INDEX idx_group_id ON "Вопрос_ответ" ("group_id")',
-            'CREATE INDEX idx_answer_id ON "Группа_ответов" ("answer_id")'
+            'CREATE INDEX idx_answer_id ON "Группа_ответов" ("answer_id")',
+            'CREATE UNIQUE INDEX ix_persona_user_id ON "Персона" ("user_id")',
+            'CREATE INDEX ix_anketa_person_id ON "Анкета" ("person_id")',
+            'CREATE INDEX ix_otvet_text ON "Ответ" USING hash ("text")'
         ]
 
         print("Создание структуры базы данных...")
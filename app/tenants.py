@@ -0,0 +1,65 @@
+"""Описание арендаторов (ботов) для многопользовательского режима"""
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import FrozenSet, List, Optional
+
+
+@dataclass(frozen=True)
+class Tenant:
+    """Бот одной кампании/города со своим опросом и схемой БД"""
+    name: str
+    token: str
+    # JSON-файл опроса; None — Config.DATA_FILE
+    survey_file: Optional[str] = None
+    # "json" или "db" (опрос из таблиц в схеме арендатора)
+    survey_source: str = "json"
+    # Схема БД (Postgres) или подключаемый файл (SQLite); None — общая схема
+    schema: Optional[str] = None
+    admin_ids: FrozenSet[int] = field(default_factory=frozenset)
+
+
+def load_tenants(file_path: str) -> List[Tenant]:
+    """
+    Загружает список арендаторов из JSON файла
+
+    Формат: [{"name": "samara", "token": "...", "schema": "samara", "survey_file": "...",
+    "survey_source": "json", "admin_ids": [123]}, ...]. Вместо "token" можно указать
+    "token_env" — имя переменной окружения с токеном.
+
+    Args:
+        file_path: Путь к JSON файлу
+
+    Returns:
+        List[Tenant]: Арендаторы в порядке объявления
+
+    Raises:
+        ValueError: Если описание арендатора некорректно
+    """
+    base_dir = Path(file_path).resolve().parent
+    with open(file_path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+
+    tenants = []
+    names = set()
+    for item in raw:
+        name = item.get("name")
+        if not name or name in names:
+            raise ValueError(f"Арендатор без имени или с повторяющимся именем: {name!r}")
+        names.add(name)
+        token = item.get("token") or os.getenv(item.get("token_env", ""), "")
+        if not token:
+            raise ValueError(f"Для арендатора {name!r} не задан токен (token / token_env)")
+        survey_file = item.get("survey_file")
+        if survey_file and not os.path.isabs(survey_file):
+            survey_file = str(base_dir / survey_file)
+        tenants.append(Tenant(
+            name=name,
+            token=token,
+            survey_file=survey_file,
+            survey_source=item.get("survey_source", "json"),
+            schema=item.get("schema"),
+            admin_ids=frozenset(int(i) for i in item.get("admin_ids", [])),
+        ))
+    return tenants
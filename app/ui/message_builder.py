@@ -1,6 +1,7 @@
 """Построитель сообщений для опроса"""
 from typing import Optional, List
-from aiogram.types import Message, InlineKeyboardMarkup
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, InlineKeyboardMarkup, InputMediaPhoto
 
 from app.data.data_models import Level, Question
 from app.services.image_service import ImageService
@@ -9,18 +10,75 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Ограничение Telegram на число элементов в sendMediaGroup
+MEDIA_GROUP_LIMIT = 10
+
 
 class MessageBuilder:
     """Класс для построения и отправки сообщений с вопросами"""
 
-    def __init__(self, image_service: ImageService):
+    def __init__(self, image_service: ImageService, composite_levels: bool = False):
         """
         Инициализирует построитель сообщений
 
         Args:
             image_service: Сервис для работы с изображениями
+            composite_levels: Показывать изображения уровней одной заранее собранной сеткой
         """
         self.image_service = image_service
+        self.composite_levels = composite_levels
+
+    async def _send_photo(self, message: Message, image: str, **kwargs) -> Message:
+        """
+        Отправляет изображение: по сохранённому file_id, если бот уже загружал файл,
+        иначе загружает файл и запоминает полученный file_id.
+        """
+        bot_id = message.bot.id if message.bot is not None else None
+        photo = self.image_service.get_image(image, bot_id)
+        try:
+            sent = await message.answer_photo(photo=photo, **kwargs)
+        except TelegramBadRequest as e:
+            if not isinstance(photo, str):
+                raise
+            # file_id больше не принимается (например, бот пересоздан) — загружаем файл заново
+            logger.warning(f"file_id для {image} отклонён ({e}), загружаем файл")
+            self.image_service.forget_file_id(image, bot_id)
+            photo = self.image_service.get_image(image, bot_id)
+            sent = await message.answer_photo(photo=photo, **kwargs)
+        if not isinstance(photo, str):
+            self.image_service.remember_file_id(image, bot_id, sent)
+        return sent
+
+    async def _send_photo_group(self, message: Message, images: List[str]) -> List[Message]:
+        """
+        Отправляет несколько изображений альбомами (до MEDIA_GROUP_LIMIT в каждом)
+        вместо отдельного сообщения на каждое изображение.
+        """
+        bot_id = message.bot.id if message.bot is not None else None
+        sent_messages: List[Message] = []
+        for start in range(0, len(images), MEDIA_GROUP_LIMIT):
+            chunk = images[start:start + MEDIA_GROUP_LIMIT]
+            # альбом из одного элемента Telegram не принимает
+            if len(chunk) == 1:
+                sent_messages.append(await self._send_photo(message, chunk[0]))
+                continue
+            photos = [self.image_service.get_image(img, bot_id) for img in chunk]
+            try:
+                sent = await message.answer_media_group(media=[InputMediaPhoto(media=p) for p in photos])
+            except TelegramBadRequest as e:
+                if not any(isinstance(p, str) for p in photos):
+                    raise
+                logger.warning(f"Альбом по file_id отклонён ({e}), загружаем файлы")
+                for img, photo in zip(chunk, photos):
+                    if isinstance(photo, str):
+                        self.image_service.forget_file_id(img, bot_id)
+                photos = [self.image_service.get_image(img, bot_id) for img in chunk]
+                sent = await message.answer_media_group(media=[InputMediaPhoto(media=p) for p in photos])
+            for img, photo, m in zip(chunk, photos, sent):
+                if not isinstance(photo, str):
+                    self.image_service.remember_file_id(img, bot_id, m)
+            sent_messages.extend(sent)
+        return sent_messages
 
     async def send_level_message(
         self,
@@ -34,8 +92,9 @@ class MessageBuilder:
         """
         sent = None
         if getattr(level, "image", None) and self.image_service.has_image(level.image):
-            sent = await message.answer_photo(
-                photo=self.image_service.get_image(level.image),
+            sent = await self._send_photo(
+                message,
+                level.image,
                 caption=level_text,
                 reply_markup=markup,
             )
@@ -77,8 +136,9 @@ class MessageBuilder:
 
             # Если на первом уровне есть общее изображение — присылаем его с подписью
             if current_level == 0 and getattr(question, "image", None) and self.image_service.has_image(question.image):
-                m = await message.answer_photo(
-                    photo=self.image_service.get_image(question.image),
+                m = await self._send_photo(
+                    message,
+                    question.image,
                     caption=level_text,
                     reply_markup=markup,
                 )
@@ -112,8 +172,9 @@ class MessageBuilder:
             caption = question.text
             if options_lines and include_options:
                 caption += "\n\n" + "\n".join(options_lines)
-            m = await message.answer_photo(
-                photo=self.image_service.get_image(question.image),
+            m = await self._send_photo(
+                message,
+                question.image,
                 caption=caption,
                 reply_markup=markup,
             )
@@ -139,12 +200,17 @@ class MessageBuilder:
 
             # Удаляем дубликаты, сохраняем порядок
             unique_images = list(dict.fromkeys(level_images))
+            available: List[str] = []
             for img in unique_images:
                 if self.image_service.has_image(img):
-                    m = await message.answer_photo(photo=self.image_service.get_image(img))
-                    sent_messages.append(m)
+                    available.append(img)
                 else:
                     logger.debug(f"Уровневое изображение не найдено в кеше: {img}")
+            composite = self.image_service.get_composite(available) if self.composite_levels else None
+            if composite:
+                sent_messages.append(await self._send_photo(message, composite))
+            elif available:
+                sent_messages.extend(await self._send_photo_group(message, available))
 
         # Отправляем текст вопроса с вариантами (включая уровни в описании)
         full_text = question.text
@@ -6,28 +6,49 @@ from pathlib import Path
 from aiogram import Bot
 from dotenv import load_dotenv, find_dotenv
 
-from app import setup_bot, setup_logging
 
+def load_env():
+    """Загружает переменные окружения из .env (пытаемся найти файл явно)
 
-async def main():
-    """Основная функция запуска бота"""
-    # Загружаем переменные окружения из .env (пытаемся найти файл явно)
+    Returns:
+        Путь к загруженному .env или None
+    """
     dotenv_path = find_dotenv()
     if dotenv_path:
         load_dotenv(dotenv_path)
-    else:
-        # пробуем взять .env рядом с main.py
-        env_file = Path(__file__).resolve().parent / ".env"
-        if env_file.exists():
-            load_dotenv(env_file)
-            dotenv_path = str(env_file)
-        else:
-            # fallback — попытка загрузить по умолчанию (может читать из cwd)
-            load_dotenv()
+        return dotenv_path
+    # пробуем взять .env рядом с main.py
+    env_file = Path(__file__).resolve().parent / ".env"
+    if env_file.exists():
+        load_dotenv(env_file)
+        return str(env_file)
+    # fallback — попытка загрузить по умолчанию (может читать из cwd)
+    load_dotenv()
+    return None
+
+
+# До импорта app: Config читает окружение при определении класса
+DOTENV_PATH = load_env()
+
+from app import setup_bot, setup_multi_bot, setup_logging
+from app.config import Config
+from app.tenants import load_tenants
+
+
+async def main():
+    """Основная функция запуска бота"""
+    dotenv_path = DOTENV_PATH
 
     # Настроим логирование (читает Config.LOG_LEVEL)
     setup_logging()
     logging.getLogger(__name__).info("Logging initialized")
+
+    # Многобот-режим: все боты из TENANTS_FILE в одном event loop
+    tenants_file = Config.TENANTS_FILE
+    if tenants_file:
+        bots, dp = await setup_multi_bot(load_tenants(tenants_file))
+        await dp.start_polling(*bots)
+        return
     
     # Получаем токен бота из переменных окружения
     # Попробуем явно прочитать токен из файла .env (если найден), иначе из переменных окружения
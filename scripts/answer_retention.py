@@ -0,0 +1,111 @@
+"""Секции Анкета_ответ по месяцам (Postgres), архив старых месяцев и удаление тестовых персон
+
+Команды:
+  partition — перестроить Анкета_ответ в таблицу, секционированную по месяцам created_at
+              (копирует все строки под блокировкой: запускать в окно обслуживания)
+  ensure    — создать секции текущего и --ahead следующих месяцев (из cron раз в сутки,
+              если бот работает без перезапуска дольше --ahead месяцев)
+  archive   — убрать из таблицы месяцы, закончившиеся до --before: DETACH (секция остаётся
+              отдельной таблицей) или --export DIR — выгрузка в DIR/<схема>.<секция>.csv.gz и DROP
+  purge-test — удалить персон scripts/collect_test_data.py (username test_user_*) со всеми ответами
+
+Примеры:
+  python scripts/answer_retention.py partition [--schema tenant]
+  python scripts/answer_retention.py archive --before 2026-01 --export scripts/out/archive
+  python scripts/answer_retention.py purge-test --dry-run
+
+Снимок ответов (Анкета.answers) архивом не затрагивается. Запущенный бот сверяет кешированные
+id персон с базой, но поиск по свободным ответам удалённых персон очистится только после перезапуска.
+"""
+import argparse
+import asyncio
+import datetime
+import sys
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_DIR))
+
+from app.config import Config
+from app.database.models import WRITE_OPTIONS, engine, get_session_maker
+from app.database.retention import (
+    TEST_USERNAME_PREFIX,
+    archivable_partitions,
+    archive_partition,
+    ensure_partitions,
+    partition_answers,
+    purge_test_personas,
+)
+
+
+def parse_month(value: str) -> datetime.date:
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"месяц в формате ГГГГ-ММ: {value}")
+
+
+async def run(args) -> int:
+    if args.command != 'purge-test' and engine.dialect.name != 'postgresql':
+        print(f"Секционирование есть только в Postgres (сейчас {engine.dialect.name})")
+        return 1
+    if args.schema:
+        # SQLite: подключает файл схемы арендатора к соединениям (ATTACH)
+        get_session_maker(args.schema)
+    try:
+        if args.command == 'partition':
+            async with engine.begin() as conn:
+                done = await conn.run_sync(partition_answers, args.schema, args.ahead)
+            print("Анкета_ответ секционирована по месяцам" if done else "Анкета_ответ уже секционирована")
+        elif args.command == 'ensure':
+            async with engine.begin() as conn:
+                created = await conn.run_sync(ensure_partitions, args.schema, args.ahead)
+            print(f"Созданы секции: {', '.join(created)}" if created else "Все секции на месте")
+        elif args.command == 'archive':
+            async with engine.connect() as conn:
+                names = await conn.run_sync(archivable_partitions, args.schema, args.before)
+            if not names:
+                print(f"Нет секций старше {args.before:%Y-%m}")
+            for name in names:
+                if args.dry_run:
+                    print(f"{name}: будет {'выгружена и удалена' if args.export else 'отсоединена'}")
+                    continue
+                # каждая секция — своя транзакция: сбой не откатывает уже архивированные
+                async with engine.begin() as conn:
+                    rows, path = await conn.run_sync(archive_partition, args.schema, name, args.export)
+                print(f"{name}: {rows} строк " + (f"выгружено в {path}, секция удалена" if path else "— отсоединена"))
+        else:
+            # SQLite: BEGIN IMMEDIATE, как у остальных записей
+            async with engine.execution_options(**WRITE_OPTIONS).connect() as conn:
+                counts = await conn.run_sync(purge_test_personas, args.schema, args.prefix)
+                if args.dry_run:
+                    await conn.rollback()
+                else:
+                    await conn.commit()
+            verb = 'будет удалено' if args.dry_run else 'удалено'
+            for table, count in counts.items():
+                print(f"{table}: {verb} {count}")
+    finally:
+        await engine.dispose()
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--schema', default=None, help='схема арендатора (по умолчанию — общая)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name in ('partition', 'ensure'):
+        command = commands.add_parser(name)
+        command.add_argument('--ahead', type=int, default=Config.ANSWER_PARTITIONS_AHEAD, help='сколько месяцев вперёд создать секции')
+    archive = commands.add_parser('archive')
+    archive.add_argument('--before', type=parse_month, required=True, help='ГГГГ-ММ: месяцы до него уходят в архив')
+    archive.add_argument('--export', type=Path, default=None, help='каталог для .csv.gz (иначе только DETACH)')
+    archive.add_argument('--dry-run', action='store_true', help='только показать секции')
+    purge = commands.add_parser('purge-test')
+    purge.add_argument('--prefix', default=TEST_USERNAME_PREFIX, help='начало username тестовых персон')
+    purge.add_argument('--dry-run', action='store_true', help='только посчитать (транзакция откатывается)')
+    return asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
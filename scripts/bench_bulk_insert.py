@@ -0,0 +1,105 @@
+"""Бенчмарк записи ответов анкеты: ORM (объект на строку), bulk (executemany) и group commit
+
+Каждое «завершение опроса» — полный вызов DBService.save_to_anketa_schema
+(upsert Персона, Анкета, ~60 строк Анкета_ответ) на временной SQLite базе.
+Все завершения размера N запускаются одновременно (N сохранений в полёте);
+--inflight ограничивает их число, если нужно сравнить с меньшей конкуренцией.
+Режим group — bulk через задачу-писателя SQLite, объединяющую сохранения в общие транзакции.
+
+Пример: python scripts/bench_bulk_insert.py --sizes 1 100 10000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# отдельная база, чтобы не трогать db.sqlite3
+_tmp_dir = tempfile.mkdtemp(prefix='bench_bulk_')
+os.environ['DATABASE_URL'] = f"sqlite+aiosqlite:///{os.path.join(_tmp_dir, 'bench.sqlite3')}"
+
+from sqlalchemy import delete
+
+from app.database.models import engine, Base, async_session, AnketaAnswer, Anketa, Persona
+from app.database.schema import AnswerWriter
+from app.services.db_service import DBService
+
+
+class OrmAnswerWriter(AnswerWriter):
+    """Прежний способ: ORM-объект на каждую строку, flush через unit of work"""
+
+    async def write(self, session, rows):
+        session.add_all([AnketaAnswer(**row) for row in rows])
+        await session.flush()
+
+
+def make_answers(n_questions: int = 40) -> dict:
+    """Анкета примерно на 60 строк: одиночные ответы, уровни и множественный выбор"""
+    answers = {}
+    for qid in range(1, n_questions + 1):
+        if qid % 5 == 0:
+            answers[f"modul_1:{qid}"] = ["Вариант 1", "Вариант 2", "Вариант 3"]
+        elif qid % 7 == 0:
+            for level in range(3):
+                answers[f"modul_2:{qid}:level_{level}"] = "Скорее да"
+        else:
+            answers[f"modul_1:{qid}"] = "Да" if qid % 2 else "Нет"
+    answers["modul_3:1:custom_answer"] = "Свободный ответ респондента"
+    return answers
+
+
+async def run(db: DBService, n: int, answers: dict, inflight: int, base_id: int) -> float:
+    semaphore = asyncio.Semaphore(inflight)
+
+    async def one(i: int):
+        async with semaphore:
+            await db.save_to_anketa_schema(base_id + i, answers, username=f"bench_{i}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return time.perf_counter() - started
+
+
+async def reset():
+    async with async_session() as session:
+        await session.execute(delete(AnketaAnswer))
+        await session.execute(delete(Anketa))
+        await session.execute(delete(Persona))
+        await session.commit()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 10000])
+    parser.add_argument('--inflight', type=int, default=None,
+                        help='сохранений в полёте (по умолчанию — все анкеты размера сразу)')
+    args = parser.parse_args()
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    answers = make_answers()
+    rows = len(DBService._prepare_answer_rows(0, answers))
+    print(f"База: {engine.url.database}; строк на анкету: {rows}")
+    print(f"{'анкет':>8} {'в полёте':>9} {'режим':>6} {'сек':>9} {'анкет/с':>10} {'строк/с':>10}")
+
+    for n in args.sizes:
+        inflight = min(args.inflight or n, n)
+        for mode in ('orm', 'bulk', 'group'):
+            db = DBService(group_commit=(mode == 'group'))
+            await db.detect_schema()
+            if mode == 'orm':
+                db.answer_writer = OrmAnswerWriter()
+            await reset()
+            elapsed = await run(db, n, answers, inflight, base_id=1_000_000)
+            await db.close()
+            print(f"{n:>8} {inflight:>9} {mode:>6} {elapsed:>9.3f} {n / elapsed:>10.1f} {n * rows / elapsed:>10.0f}")
+
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""Перевод существующих строк Анкета_ответ в компактное хранение (ANSWER_STORAGE=compact)
+
+Строка с вариантом из каталога ответов получает answer_id (если его не было), а её answer_text,
+совпадающий с Ответ.label, заменяется на NULL; полный вид строк даёт представление
+Анкета_ответ_полный. Свободные ответы не меняются.
+
+Строки обрабатываются пачками по id (keyset), каждая пачка — своя транзакция. Номер последней
+обработанной строки сохраняется в scripts/out, повторный запуск продолжает с него (--restart —
+сначала); уже компактные строки пропускаются, так что повтор безопасен.
+
+Пример: python scripts/compact_answers.py --batch 5000 [--schema tenant] [--dry-run]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_DIR))
+
+from sqlalchemy import bindparam, select, update
+
+from app.database.migrations import run_migrations
+from app.database.models import engine, get_session_maker, write_session, AnketaAnswer
+from app.database.schema import detect_capabilities
+from app.services.answer_catalog import AnswerCatalog
+
+
+def checkpoint_path(schema: str = None) -> Path:
+    return PROJECT_DIR / 'scripts' / 'out' / f"compact_answers_{schema or 'default'}.json"
+
+
+async def compact(schema: str = None, batch: int = 5000, dry_run: bool = False, restart: bool = False) -> int:
+    session_maker = get_session_maker(schema)
+    # Ответ.label и представление Анкета_ответ_полный
+    await run_migrations(engine, schema)
+    caps = await detect_capabilities(session_maker, schema)
+    if not caps.answer_view:
+        print("Нет представления Анкета_ответ_полный — миграция не применена, см. лог")
+        return 1
+    catalog = AnswerCatalog(session_maker)
+    await catalog.load()
+    if not catalog.loaded:
+        print("Каталог ответов пуст (таблицы опроса не заполнены) — сжимать нечего")
+        return 1
+
+    table = AnketaAnswer.__table__
+    with_key = caps.answer_has_key
+    columns = [table.c.id, table.c.answer_id, table.c.answer_text] + ([table.c.answer_key] if with_key else [])
+    # строку не трогаем, если её успел переписать бот
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam('row_id'), table.c.answer_text == bindparam('old_text'))
+        .values(answer_id=bindparam('new_answer_id'), answer_text=None)
+    )
+
+    path = checkpoint_path(schema)
+    last_id = 0
+    if path.exists() and not restart:
+        last_id = json.loads(path.read_text(encoding='utf-8')).get('last_id', 0)
+        print(f"Продолжение с id > {last_id}")
+
+    scanned = compacted = 0
+    started = time.perf_counter()
+    while True:
+        async with write_session(session_maker) as session:
+            rows = (await session.execute(
+                select(*columns).where(table.c.id > last_id).order_by(table.c.id).limit(batch)
+            )).all()
+            if not rows:
+                break
+            params = []
+            for row in rows:
+                if row.answer_text is None:
+                    continue
+                answer_id = row.answer_id
+                if answer_id is None and with_key:
+                    answer_id = catalog.resolve(row.answer_key, row.answer_text)
+                if answer_id is not None and catalog.label(answer_id) == row.answer_text:
+                    params.append({'row_id': row.id, 'old_text': row.answer_text, 'new_answer_id': answer_id})
+            if params and not dry_run:
+                await session.execute(stmt, params)
+                await session.commit()
+        scanned += len(rows)
+        compacted += len(params)
+        last_id = rows[-1].id
+        if not dry_run:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps({'last_id': last_id}), encoding='utf-8')
+        elapsed = time.perf_counter() - started
+        print(f"id <= {last_id}: просмотрено {scanned}, сжато {compacted} ({scanned / elapsed:.0f} строк/с)")
+
+    print(f"Готово: просмотрено {scanned}, {'можно сжать' if dry_run else 'сжато'} {compacted}")
+    if compacted and not dry_run and caps.dialect == 'postgresql':
+        print('Освободить место: VACUUM (ANALYZE) "Анкета_ответ"')
+    await engine.dispose()
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--schema', default=None, help='схема арендатора (по умолчанию — общая)')
+    parser.add_argument('--batch', type=int, default=5000, help='строк в одной транзакции')
+    parser.add_argument('--dry-run', action='store_true', help='только посчитать')
+    parser.add_argument('--restart', action='store_true', help='начать сначала, не с сохранённой позиции')
+    args = parser.parse_args()
+    return asyncio.run(compact(args.schema, args.batch, args.dry_run, args.restart))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""Перенос старых таблиц users / survey_responses в Персона / Анкета / Анкета_ответ
+
+Первые волны опроса сохранялись в survey_responses(tg_id, data TEXT, created_at): data — JSON
+с ответами (словарь ответов или всё состояние FSM с ключом "answers"). Скрипт читает таблицу
+пачками по id (keyset), переводит ключи в текущую схему "модуль:вопрос[:level_N|:custom_answer]"
+(сверяясь с файлом опроса) и записывает каждую пачку одной транзакцией через
+DBService.import_anketas — те же стратегии записи, что у бота. Каждый ответ становится
+отдельной Анкета со своим created_at. Затем в Персона добавляются пользователи users без ответов.
+
+Ответы персон, уже проходивших опрос в боте, тоже переносятся: бот выбирает последнюю анкету
+по Анкета.created_at, так что перенесённая (более ранняя) анкета не заменит его собственную.
+Позиция сохраняется в scripts/out после каждой пачки, повторный запуск продолжает с неё
+(--restart — сначала); анкеты, записанные перед сбоем, но не попавшие в позицию, распознаются
+по персоне и времени и не дублируются.
+
+Пример: python scripts/migrate_legacy_responses.py --batch 1000 [--source sqlite+aiosqlite:///old.sqlite3]
+        [--schema tenant] [--survey app/data/ovz.json] [--dry-run]
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_DIR))
+
+from sqlalchemy import BigInteger, Column, DateTime, Integer, MetaData, Table, Text, inspect, null, select, type_coerce
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.config import Config
+from app.data.data_loader import load_survey_data
+from app.data.data_models import SurveyData
+from app.database.engine import database_url
+from app.database.migrations import run_migrations
+from app.database.models import Base, WRITE_OPTIONS, engine, get_session_maker, write_session, Persona
+from app.services.answer_catalog import AnswerCatalog
+from app.services.db_service import DBService
+from app.services.search_service import SearchService
+
+_legacy = MetaData()
+LEGACY_USERS = Table('users', _legacy, Column('id', Integer), Column('tg_id', BigInteger))
+LEGACY_RESPONSES = Table(
+    'survey_responses', _legacy,
+    Column('id', Integer), Column('tg_id', BigInteger), Column('data', Text), Column('created_at', DateTime),
+)
+
+# "modul_1:5", "modul_1_5", "modul_1.5:level_0", "modul_1-5-custom" ...
+_KEY_RE = re.compile(r'^(?P<module>[^\W\d_]\w*?_\d+)[:._-](?P<qid>\d+)(?:[:._-](?P<sub>.+))?$')
+_LEVEL_RE = re.compile(r'^(?:level|lvl)[_ -]?(\d+)$', re.IGNORECASE)
+_CUSTOM_SUFFIXES = {'custom_answer', 'custom', 'other'}
+
+
+def checkpoint_path(schema: str = None) -> Path:
+    return PROJECT_DIR / 'scripts' / 'out' / f"migrate_legacy_{schema or 'default'}.json"
+
+
+def legacy_answers(raw: str) -> dict:
+    """Словарь ответов из data: плоский или вложенный по модулям/вопросам, возможно внутри "answers"."""
+    data = json.loads(raw)
+    if isinstance(data, str):
+        # сериализовано дважды
+        data = json.loads(data)
+    if isinstance(data, dict) and isinstance(data.get('answers'), dict):
+        data = data['answers']
+    if not isinstance(data, dict):
+        raise ValueError(f"ожидался JSON-объект, получен {type(data).__name__}")
+
+    flat = {}
+
+    def walk(prefix: str, value) -> None:
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(f"{prefix}:{key}" if prefix else str(key), item)
+        else:
+            flat[prefix] = value
+
+    walk('', data)
+    return flat
+
+
+def map_key(key: str, survey: SurveyData) -> Optional[str]:
+    """Ключ ответа в текущей схеме или None, если вопроса (уровня) нет в опросе."""
+    match = _KEY_RE.match(key)
+    if match is None:
+        return None
+    module, qid, sub = match['module'], int(match['qid']), match['sub']
+    if module not in survey.modules and module.startswith('module_'):
+        module = 'modul_' + module[len('module_'):]
+    question = survey.modules[module].questions.get(qid) if module in survey.modules else None
+    if question is None:
+        return None
+    if sub is None:
+        return f"{module}:{qid}"
+    level = _LEVEL_RE.match(sub)
+    if level is not None:
+        index = int(level[1])
+        return f"{module}:{qid}:level_{index}" if index < len(question.levels or []) else None
+    if sub.lower() in _CUSTOM_SUFFIXES:
+        return f"{module}:{qid}:custom_answer"
+    return None
+
+
+def map_answers(raw: str, survey: SurveyData, unmapped: Counter) -> dict:
+    answers = {}
+    for key, value in legacy_answers(raw).items():
+        mapped = map_key(key, survey)
+        if mapped is None:
+            unmapped[key] += 1
+        elif value is not None and value != '' and value != []:
+            answers[mapped] = value
+    return answers
+
+
+async def _known_anketas(session, anketa_table, tg_ids: List[int]) -> Set[Tuple[int, object]]:
+    """(tg_id, Анкета.created_at) анкет персон пачки в целевой базе."""
+    created_at = (
+        # тип DateTime: на SQLite время читается как datetime, как и из survey_responses
+        type_coerce(anketa_table.c.created_at, DateTime) if 'created_at' in anketa_table.c else null()
+    )
+    res = await session.execute(
+        select(Persona.user_id, created_at)
+        .join(anketa_table, anketa_table.c.person_id == Persona.id)
+        .where(Persona.user_id.in_(tg_ids))
+    )
+    return {tuple(row) for row in res.all()}
+
+
+async def migrate(source_url: Optional[str] = None, schema: str = None, batch: int = 1000,
+                  survey_path: str = Config.DATA_FILE, dry_run: bool = False, restart: bool = False) -> int:
+    survey = load_survey_data(survey_path)
+    source = create_async_engine(source_url or database_url())
+    async with source.connect() as conn:
+        tables = await conn.run_sync(lambda sync_conn: set(inspect(sync_conn).get_table_names()))
+    if LEGACY_RESPONSES.name not in tables:
+        print(f"В источнике нет таблицы {LEGACY_RESPONSES.name} — переносить нечего")
+        await source.dispose()
+        return 1
+
+    session_maker = get_session_maker(schema)
+    db = DBService(session_maker, schema, compact_answers=Config.ANSWER_STORAGE == 'compact')
+    if not dry_run:
+        # целевые таблицы, как при запуске бота (в базе могут быть только старые таблицы)
+        bind = engine.execution_options(**WRITE_OPTIONS)
+        if schema:
+            bind = bind.execution_options(schema_translate_map={None: schema})
+        async with bind.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(engine, schema)
+        await db.detect_schema()
+        if not db.capabilities.anketa_has_person_id:
+            print("Анкета без person_id (старая схема): у персоны может быть только одна анкета")
+            return 1
+        db.answer_catalog = AnswerCatalog(session_maker)
+        await db.answer_catalog.load()
+        # свободные ответы попадают в поиск администратора, как при сохранении ботом
+        search = SearchService(session_maker)
+        db.add_commit_listener(search.on_save_committed)
+    anketa_table = db.capabilities.anketa_table() if db.capabilities is not None else None
+
+    path = checkpoint_path(schema)
+    state = {}
+    if path.exists() and not restart:
+        state = json.loads(path.read_text(encoding='utf-8'))
+        print(f"Продолжение с survey_responses.id > {state.get('last_id', 0)}")
+    last_id = state.get('last_id', 0)
+
+    def save_state() -> None:
+        if not dry_run:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(state), encoding='utf-8')
+
+    stats = Counter()
+    unmapped = Counter()
+    started = time.perf_counter()
+    while True:
+        async with source.connect() as conn:
+            rows = (await conn.execute(
+                select(LEGACY_RESPONSES).where(LEGACY_RESPONSES.c.id > last_id).order_by(LEGACY_RESPONSES.c.id).limit(batch)
+            )).all()
+        if not rows:
+            break
+        items = []
+        for row in rows:
+            try:
+                answers = map_answers(row.data, survey, unmapped)
+            except ValueError as e:
+                # json.JSONDecodeError тоже ValueError
+                stats['broken'] += 1
+                print(f"survey_responses.id={row.id}: не разобран ({e})")
+                continue
+            if not answers:
+                stats['empty'] += 1
+                continue
+            items.append((row.tg_id, answers, '', row.created_at))
+
+        if items and not dry_run:
+            async with session_maker() as session:
+                imported = await _known_anketas(session, anketa_table, list({item[0] for item in items}))
+            fresh = []
+            for item in items:
+                if (item[0], item[3]) in imported:
+                    stats['already_imported'] += 1
+                else:
+                    fresh.append(item)
+            if fresh:
+                await db.import_anketas(fresh)
+            items = fresh
+        stats['responses'] += len(rows)
+        stats['migrated'] += len(items)
+        stats['answers'] += sum(len(item[1]) for item in items)
+        last_id = state['last_id'] = rows[-1].id
+        save_state()
+        elapsed = time.perf_counter() - started
+        print(f"id <= {last_id}: прочитано {stats['responses']}, перенесено {stats['migrated']} "
+              f"({stats['responses'] / elapsed:.0f} строк/с, {stats['answers'] / elapsed:.0f} ответов/с)")
+
+    users = 0
+    if LEGACY_USERS.name in tables and not dry_run:
+        # пользователи без ответов — только Персона
+        users_last = state.get('users_last_id', 0)
+        while True:
+            async with source.connect() as conn:
+                rows = (await conn.execute(
+                    select(LEGACY_USERS).where(LEGACY_USERS.c.id > users_last, LEGACY_USERS.c.tg_id.is_not(None))
+                    .order_by(LEGACY_USERS.c.id).limit(batch)
+                )).all()
+            if not rows:
+                break
+            async with write_session(session_maker) as session:
+                await db.persona_writer.get_ids(session, [(tg_id, '') for tg_id in {row.tg_id for row in rows}])
+                await session.commit()
+            users += len(rows)
+            users_last = state['users_last_id'] = rows[-1].id
+            save_state()
+
+    elapsed = time.perf_counter() - started
+    print(f"Готово за {elapsed:.1f} с: прочитано {stats['responses']}, "
+          f"{'можно перенести' if dry_run else 'перенесено'} {stats['migrated']} анкет ({stats['answers']} ответов); "
+          f"пропущено: перенесены ранее {stats['already_imported']}, "
+          f"пустых {stats['empty']}, не разобрано {stats['broken']}; пользователей users: {users}")
+    if unmapped:
+        print("Ключи без соответствия в опросе (ключ: ответов):")
+        for key, count in unmapped.most_common(20):
+            print(f"  {key}: {count}")
+    await source.dispose()
+    await engine.dispose()
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', default=None, help='URL базы со старыми таблицами (по умолчанию — база бота)')
+    parser.add_argument('--schema', default=None, help='схема арендатора (по умолчанию — общая)')
+    parser.add_argument('--batch', type=int, default=1000, help='ответов в одной транзакции')
+    parser.add_argument('--survey', default=Config.DATA_FILE, help='файл опроса для сверки ключей')
+    parser.add_argument('--dry-run', action='store_true', help='только разобрать и посчитать')
+    parser.add_argument('--restart', action='store_true', help='начать сначала, не с сохранённой позиции')
+    args = parser.parse_args()
+    return asyncio.run(migrate(args.source, args.schema, args.batch, args.survey, args.dry_run, args.restart))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
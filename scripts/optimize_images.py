@@ -0,0 +1,38 @@
+"""Готовит оптимизированные JPEG-копии изображений опроса (можно запускать при сборке)
+
+Пример: python scripts/optimize_images.py --quality 80 --workers 4
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+from app.services.image_optimizer import is_available, optimize_images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images-dir', default=Config.IMAGES_DIR)
+    parser.add_argument('--cache-dir', default=Config.IMAGES_CACHE_DIR)
+    parser.add_argument('--max-side', type=int, default=Config.IMAGE_MAX_SIDE)
+    parser.add_argument('--quality', type=int, default=Config.IMAGE_JPEG_QUALITY)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    if not is_available():
+        print('Pillow не установлен: pip install Pillow')
+        return 1
+
+    report = optimize_images(args.images_dir, args.cache_dir, args.max_side, args.quality, args.workers)
+    print(report.summary())
+    for error in report.errors:
+        print(' !', error)
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())